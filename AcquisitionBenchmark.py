@@ -0,0 +1,622 @@
+"""
+Performance benchmarks for the acquisition path, run against the simulated instruments (see SimulatedInstruments.py).
+
+Usage:
+    python AcquisitionBenchmark.py                          run and write the results
+    python AcquisitionBenchmark.py --update-baseline        run and store the results as this host's baseline
+    python AcquisitionBenchmark.py --compare                run and compare against this host's baseline
+    python AcquisitionBenchmark.py --quick                  smaller sizes, for a fast sanity check
+
+Results are written as JSON (default bench_results.json). Each result holds a value, a unit and whether higher is better.
+The results are absolute timings, so benchmark_baseline.json keeps one baseline per host and size (see host_key()) and
+results are only compared against the baseline recorded on the same host. With --compare a result is a regression if
+it is worse than the baseline by more than the tolerance, exit code is 1 if any regressed.
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import sys
+import time
+import numpy as np
+
+from VisaResource import parse_raw_bytes_data
+from AcquisitionProcess import AcquisitionClient, analyse
+from CampaignJournal import CampaignJournal
+from LiveWaveform import LiveWaveformBuffer
+from OscilloscopeInterface import Oscilloscope, ScaledWaveform
+from OssillaSmu import OscillaSMU, SampleRingBuffer
+from SimulatedInstruments import (SimulatedResourceManager, SimulatedScopeResource, SimulatedSmuDevice, SimulatedTeensy,
+                                  SimulatedVnaResource, SimulatedSpectrumAnalyzerResource, SIMULATED_VNA_ID,
+                                  SIMULATED_SPECTRUM_ID, definite_length_block)
+from SpectrumAnalyzerInterface import SpectrumAnalyzer
+from Stations import StationCoordinator
+from SweepEngine import SweepEngine, StepResult
+from TestPlan import expand_plan, compile_plan
+from TeensyController import TeensyController
+from VnaInterface import VNA
+from WaveformAveraging import RunningAverage
+from WaveformStorage import CODECS, CompressedWaveformReader, quantize_voltages, save_compressed
+
+
+DEFAULT_BASELINE = "benchmark_baseline.json"
+DEFAULT_OUTPUT = "bench_results.json"
+
+
+def best_time(function, repeats=3):
+    """
+    Runs function repeatedly and returns the shortest wall time, the least disturbed run
+
+    Args:
+        function (callable) :
+            Called with no arguments
+        repeats (int) : [optional]
+            Number of timed runs
+
+    Returns:
+        float : shortest run time in seconds
+    """
+    best = float("inf")
+    for _ in range(max(1, repeats)):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def points_label(points):
+    """Short label for a point count used in result names eg. 1e6"""
+    return f"{points:.0e}".replace("e+0", "e").replace("e+", "e")
+
+
+def result(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def bench_decode(config):
+    """
+    Decode throughput of parse_raw_bytes_data for REAL,32 blocks across record lengths.
+    Sizes whose predicted run time exceeds the time budget are skipped (recorded as null).
+    """
+    results = {}
+    last_points = None
+    last_time = None
+    for points in config["decode_points"]:
+        name = f"decode_real32_{points_label(points)}_MBps"
+        if last_time is not None and last_time * points / last_points > config["time_budget"]:
+            results[name] = result(None, "MB/s", True)
+            continue
+        waveform = np.linspace(-1, 1, points, dtype="<f4")
+        block = definite_length_block(waveform.tobytes())
+        run_time = best_time(lambda: parse_raw_bytes_data(block, silent=True), config["repeats"] if points < 1E6 else 1)
+        results[name] = result(len(block) / run_time / 1E6, "MB/s", True)
+        last_points, last_time = points, run_time
+        del block, waveform
+    return results
+
+
+def format_label(data_format):
+    """Short label for a transfer format used in result names eg. int8"""
+    return data_format.replace(",", "").lower()
+
+
+def connect_simulated_scope(record_length, transfer_rate=None):
+    scope = Oscilloscope(SimulatedResourceManager(record_length=record_length, acquisition_time=1E-6,
+                                                  transfer_rate=transfer_rate, seed=0))
+    scope.connect()
+    scope.set_acquisition_time(1E-6)
+    scope.set_acquisition_record_length(record_length)
+    return scope
+
+
+def bench_record_waveform(config):
+    """
+    Time of the full record_waveform cycle (arm, trigger wait, transfer, decode, conversion to volts) for the simulated
+    scope in every transfer format, the bus is modelled by the configured transfer rate
+    """
+    results = {}
+    for points in config["record_points"]:
+        scope = connect_simulated_scope(points, config["scope_transfer_rate"])
+        for data_format in Oscilloscope.TRANSFER_FORMATS:
+            scope.set_transfer_format(data_format)
+            run_time = best_time(lambda: scope.record_waveform(silent=True), config["repeats"])
+            name = f"record_waveform_{format_label(data_format)}_{points_label(points)}_ms"
+            results[name] = result(run_time * 1E3, "ms", False)
+        scope.close()
+    return results
+
+
+def bench_export_window(config):
+    """
+    record_waveform cycle with the export window following a 100 ns pulse in a 10 us acquisition, compared to the
+    same capture exporting the whole acquisition
+    """
+    points = config["record_points"][-1]
+    scope = Oscilloscope(SimulatedResourceManager(record_length=points, acquisition_time=10E-6, pulse_width=100E-9,
+                                                  transfer_rate=config["scope_transfer_rate"], seed=0))
+    scope.connect()
+    scope.set_acquisition_time(10E-6)
+    scope.set_acquisition_record_length(points)
+    full_time = best_time(lambda: scope.record_waveform(silent=True), config["repeats"])
+    scope.set_auto_export_window()
+    # first capture finds the pulse and sets the window
+    scope.record_waveform(silent=True)
+    window_time = best_time(lambda: scope.record_waveform(silent=True), config["repeats"])
+    scope.close()
+    return {
+        f"record_waveform_full_{points_label(points)}_ms": result(full_time * 1E3, "ms", False),
+        f"record_waveform_export_window_{points_label(points)}_ms": result(window_time * 1E3, "ms", False),
+    }
+
+
+def bench_compression(config):
+    """
+    Compressed waveform storage of a synthetic pulse capture: compression ratio against the raw REAL,32 bytes,
+    encode and full decode throughput (raw MB/s) per codec, and the time to read a 1% window of the file
+    """
+    points = config["record_points"][-1]
+    voltages = SimulatedScopeResource(record_length=points, seed=0).synthesize_waveform()
+    codes, gain, offset = quantize_voltages(voltages)
+    raw_megabytes = voltages.nbytes / 1E6
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for codec in CODECS:
+            path = os.path.join(directory, codec)
+            encode_time = best_time(lambda: save_compressed(path, codes, gain, offset, -5E-7, 5E-7, codec=codec), 1)
+            file_path = path + ".lmaz"
+            with CompressedWaveformReader(file_path) as reader:
+                decode_time = best_time(lambda: reader.read(), config["repeats"])
+                window_time = best_time(lambda: reader.read_time_window(-5E-9, 5E-9), config["repeats"])
+            results[f"compression_{codec}_ratio"] = result(voltages.nbytes / os.path.getsize(file_path), "x", True)
+            results[f"compression_{codec}_encode_MBps"] = result(raw_megabytes / encode_time, "MB/s", True)
+            results[f"compression_{codec}_decode_MBps"] = result(raw_megabytes / decode_time, "MB/s", True)
+            results[f"compression_{codec}_window_read_ms"] = result(window_time * 1E3, "ms", False)
+    return results
+
+
+def connect_simulated_smu():
+    smu = OscillaSMU("COM1", device_factory=lambda com_port: SimulatedSmuDevice(com_port, seed=0))
+    smu.connect()
+    smu.device["smu1"].set.enabled(True, response=0)
+    return smu
+
+
+def bench_smu(config):
+    """Points per second through OscillaSMU.make_measurement over the simulated serial link"""
+    smu = connect_simulated_smu()
+    points = config["smu_points"]
+    voltages = np.linspace(0, 1, points)
+
+    def sweep():
+        for voltage in voltages:
+            smu.make_measurement(float(voltage))
+
+    run_time = best_time(sweep, 1)
+    smu.close()
+    return {"smu_make_measurement_points_per_s": result(points / run_time, "points/s", True)}
+
+
+def bench_smu_stream(config):
+    """
+    Samples per second streamed by OscillaSMU.start_streaming over the simulated serial link, with measure commands
+    pipelined (the default) and one at a time, and the host cost of parsing a batch of responses into the sample ring
+    buffer, per sample
+    """
+    results = {}
+    for name, pipeline in (("smu_stream_samples_per_s", 8), ("smu_stream_unpipelined_samples_per_s", 1)):
+        smu = connect_simulated_smu()
+        smu.start_streaming(voltage=1.0, pipeline=pipeline)
+        time.sleep(config["smu_stream_time"])
+        smu.stop_streaming()
+        samples = smu.stream_buffer.written
+        rate = samples / max(smu.stream_buffer.last_time() - smu.stream_buffer.times[0], 1E-9)
+        smu.close()
+        results[name] = result(rate, "samples/s", True)
+
+    batch = 64
+    times = np.zeros(batch)
+    responses = ["[1.000000e00,1.000000e-07;]\n"] * batch
+    smu.stream_buffer = SampleRingBuffer(100000)
+    parse_time = best_time(lambda: smu._store(times, responses), config["repeats"] * 10)
+    results["smu_stream_parse_us_per_sample"] = result(parse_time / batch * 1E6, "us", False)
+    return results
+
+
+def bench_sweep_step(config):
+    """
+    Latency of one sweep step: set the SMU bias, capture the stress pulse with the scope, then measure leakage
+    """
+    scope = connect_simulated_scope(config["sweep_record_points"])
+    smu = connect_simulated_smu()
+
+    def step():
+        smu.set_voltage(0)
+        scope.record_waveform(silent=True)
+        smu.make_measurement(1.0)
+
+    run_time = best_time(step, config["repeats"])
+    scope.close()
+    smu.close()
+    return {"sweep_step_ms": result(run_time * 1E3, "ms", False)}
+
+
+def bench_relay_switch(config):
+    """
+    Host cost of switching between the TLP and SMU measurement paths over the pseudo-terminal controller stand in,
+    acknowledged (one round trip) and pipelined (frame sent, acknowledgement collected later). Skipped without os.openpty
+    """
+    names = ("relay_path_switch_acked_us", "relay_path_switch_pipelined_us")
+    if not hasattr(os, "openpty"):
+        return {name: result(None, "us", False) for name in names}
+    switches = config["relay_switches"]
+    with SimulatedTeensy() as teensy:
+        controller = TeensyController(teensy.port)
+        controller.connect()
+
+        def switch(wait):
+            for index in range(switches):
+                controller.select_path("tlp" if index % 2 else "smu", wait=wait)
+
+        acked = best_time(lambda: switch(True), config["repeats"])
+        pipelined = best_time(lambda: switch(False), config["repeats"])
+        controller.flush()
+        controller.close()
+    return {
+        names[0]: result(acked / switches * 1E6, "us", False),
+        names[1]: result(pipelined / switches * 1E6, "us", False),
+    }
+
+
+def bench_vna_check(config):
+    """
+    Time of a full 4 S-parameter check (sweep and trace transfer) on a segmented sweep, and of a repeated calibration
+    read which is answered from the cache. The LAN is modelled by the command latency and transfer rate
+    """
+    resources = {SIMULATED_VNA_ID: lambda name: SimulatedVnaResource(name, command_latency=500E-6, transfer_rate=10E6, seed=0)}
+    vna = VNA(SimulatedResourceManager(resources))
+    vna.connect(device_id=SIMULATED_VNA_ID)
+    vna.configure_segments([(100E3, 1E9, config["vna_points"] // 4), (1E9, 8E9, config["vna_points"] - config["vna_points"] // 4)])
+    check_time = best_time(vna.measure_s_parameters, config["repeats"])
+    vna.read_calibration()
+    calibration_time = best_time(vna.read_calibration, config["repeats"])
+    vna.close()
+    return {
+        "vna_s_parameter_check_ms": result(check_time * 1E3, "ms", False),
+        "vna_cached_calibration_ms": result(calibration_time * 1E3, "ms", False),
+    }
+
+
+def bench_spectrum_stream(config):
+    """
+    Time of a single sweep and trace read, and the share of the streaming time the analyzer spends sweeping (the rest
+    is command and transfer overhead between sweeps). USB is modelled by the command latency and transfer rate
+    """
+    sweep_time = 5E-3
+    resources = {SIMULATED_SPECTRUM_ID: lambda name: SimulatedSpectrumAnalyzerResource(name, command_latency=200E-6,
+                                                                                      transfer_rate=5E6, sweep_time=sweep_time, seed=0)}
+    analyzer = SpectrumAnalyzer(SimulatedResourceManager(resources))
+    analyzer.connect(device_id=SIMULATED_SPECTRUM_ID)
+    analyzer.set_sweep_points(config["spectrum_points"])
+    sweep = best_time(lambda: analyzer.record_sweep(silent=True), config["repeats"])
+    start = time.perf_counter()
+    analyzer.start_streaming(capacity=64)
+    time.sleep(config["spectrum_stream_time"])
+    analyzer.stop_streaming()
+    duty = analyzer.stream_sweeps * sweep_time / (time.perf_counter() - start)
+    analyzer.close()
+    return {
+        "spectrum_sweep_and_read_ms": result(sweep * 1E3, "ms", False),
+        "spectrum_stream_sweep_duty_percent": result(duty * 100, "%", True),
+    }
+
+
+def bench_averaging(config):
+    """Throughput of folding a capture into the running mean and variance, and the capture count to converge in the simulation"""
+    points = config["average_points"]
+    rng = np.random.default_rng(0)
+    captures = [rng.normal(0, 0.01, points).astype(np.float32) for _ in range(8)]
+    average = RunningAverage()
+
+    def fold():
+        for capture in captures:
+            average.add(capture)
+
+    fold_time = best_time(fold, config["repeats"]) / len(captures)
+    scope = connect_simulated_scope(config["sweep_record_points"])
+    scope.device.noise = 0.05
+    converged = scope.record_averaged_waveform(1000, tolerance=0.01, silent=True)
+    scope.close()
+    return {
+        f"average_fold_{points_label(points)}_Msamples_per_s": result(points / fold_time / 1E6, "Msamples/s", True),
+        "average_captures_to_converge": result(converged.count, "captures", False),
+    }
+
+
+def bench_failure_detection(config):
+    """
+    Run time of a stress plan on DUTs that fail at 2 kV, with online failure detection (failing sweeps stop at the
+    failing point and the failed pins are skipped) and without
+    """
+    plan = {"parameters": {"tlp_voltage_max": 5000, "smu_voltage_max": 0.3, "smu_voltage_increment": 0.05,
+                           "smu_settle_time": 0.0},
+            "groups": [{"pins": [f"IO{pin}" for pin in range(config["failure_pins"])], "measurements": ["tlp", "iv"]}]}
+    steps = compile_plan(expand_plan(plan))
+    scope = connect_simulated_scope(config["sweep_record_points"])
+    smu = connect_simulated_smu()
+    dut = smu.device.connections[0].wrapped
+
+    def set_tlp_level(level):
+        # every pin breaks down at 2 kV, its leakage resistance drops
+        dut.resistance = 1E7 if level < 2000 else 1E4
+
+    times = {}
+    for detection in (True, False):
+        engine = SweepEngine(scope, smu, set_tlp_level=set_tlp_level)
+        if not detection:
+            engine.detector = None
+        start = time.perf_counter()
+        engine.run(steps, silent=True)
+        times[detection] = time.perf_counter() - start
+    scope.close()
+    smu.close()
+    return {
+        "failure_detection_plan_s": result(times[True], "s", False),
+        "failure_detection_time_saved_percent": result((1 - times[True] / times[False]) * 100, "%", True),
+    }
+
+
+def bench_journal(config):
+    """Overhead of journaling a step (begin and commit record, each synced to disk), with a checksummed pulse capture"""
+    steps = compile_plan(expand_plan({"groups": [{"pins": [f"IO{pin}" for pin in range(config["failure_pins"])],
+                                                  "measurements": ["tlp", "iv"]}]}))
+    with tempfile.TemporaryDirectory() as directory:
+        capture = os.path.join(directory, "capture.npz")
+        np.savez(capture, voltages=np.zeros(config["sweep_record_points"], dtype=np.float32))
+        with CampaignJournal(os.path.join(directory, "journal.jsonl")) as journal:
+            journal.open(steps, silent=True)
+            start = time.perf_counter()
+            for step in steps:
+                step_result = StepResult(step, "done", {"voltage": 10.0, "current": 1.0, "files": [capture]})
+                journal.begin(step)
+                journal.commit(step, step_result, step.config, {"oscilloscope": "RTO6"})
+            elapsed = time.perf_counter() - start
+    return {"journal_step_overhead_us": result(elapsed / len(steps) * 1E6, "us", False)}
+
+
+def bench_stations(config):
+    """
+    Total throughput of one and of several simulated stations run concurrently by the station coordinator, the scaling
+    efficiency is the throughput of n stations over n times that of one (100% is linear)
+    """
+    plan = {"parameters": {"tlp_voltage_max": 3000, "smu_voltage_max": 0.3, "smu_voltage_increment": 0.05,
+                           "smu_settle_time": 0.0, "osc_acquisition_time": 1E-6, "osc_waveform_resolution": 1E-9},
+            "groups": [{"pins": ["IO0", "IO1"], "measurements": ["tlp", "iv"]}]}
+    throughput = {}
+    with tempfile.TemporaryDirectory() as directory:
+        plan_path = os.path.join(directory, "plan.json")
+        with open(plan_path, "w") as plan_file:
+            json.dump(plan, plan_file)
+        for count in (1, config["station_count"]):
+            stations = [{"name": f"station{index}", "plan": plan_path, "simulated": True,
+                         "record_length": config["sweep_record_points"]} for index in range(count)]
+            coordinator = StationCoordinator(stations, os.path.join(directory, f"results{count}.jsonl"), silent=True)
+            coordinator.run(report_interval=None)
+            throughput[count] = coordinator.total_throughput()
+    count = config["station_count"]
+    return {
+        f"stations_{count}_steps_per_s": result(throughput[count], "steps/s", True),
+        "stations_scaling_efficiency_percent": result(throughput[count] / (count * throughput[1]) * 100, "%", True),
+    }
+
+
+def bench_live_view(config):
+    """
+    Cost of live plotting: handing a capture to the live view on the acquisition side, and decimating the largest
+    record to a 1000 column display frame (INT,8 codes) on the display side
+    """
+    points = max(config["record_points"])
+    codes = np.random.default_rng(0).integers(-100, 100, points, dtype=np.int8)
+    waveform = ScaledWaveform(codes, 0.01, 0.0, 0.0, 1E-6, "INT,8")
+    live_view = LiveWaveformBuffer(1000)
+    repeats = 1000
+    start = time.perf_counter()
+    for _ in range(repeats):
+        live_view.publish(1, waveform)
+    publish_time = (time.perf_counter() - start) / repeats
+    frame_time = best_time(lambda: live_view.take(1, force=True), config["repeats"])
+    return {
+        "live_view_publish_us": result(publish_time * 1E6, "us", False),
+        f"live_view_frame_{points_label(points)}_ms": result(frame_time * 1E3, "ms", False),
+    }
+
+
+def bench_acquisition_process(config):
+    """
+    CPU time the GUI process spends per capture (INT,16, analysed), capturing in process versus receiving the captures
+    of the acquisition process through shared memory
+    """
+    points = config["record_points"][1]
+    captures = config["process_captures"]
+    scope = connect_simulated_scope(points)
+    scope.set_transfer_format("INT,16")
+    start = time.process_time()
+    for _ in range(captures):
+        analyse(scope.record_waveform_raw(silent=True))
+    in_process = (time.process_time() - start) / captures
+    scope.close()
+
+    with AcquisitionClient({"simulated": True, "smu": None, "record_length": points}, slot_bytes=4 * points) as client:
+        client.start()
+        client.call("set_acquisition_time", 1E-6)
+        client.call("set_acquisition_record_length", points)
+        client.call("set_transfer_format", "INT,16")
+        received = 0
+        start = time.process_time()
+        wall_start = time.perf_counter()
+        client.capture(captures)
+        while received < captures and time.perf_counter() - wall_start < 60:
+            for capture in client.poll(timeout=1.0):
+                received += 1
+                capture.summary["top"]
+        shared = (time.process_time() - start) / max(received, 1)
+        wall = time.perf_counter() - wall_start
+    label = points_label(points)
+    return {
+        f"gui_cpu_per_capture_in_process_{label}_ms": result(in_process * 1E3, "ms", False),
+        f"gui_cpu_per_capture_shared_memory_{label}_ms": result(shared * 1E3, "ms", False),
+        f"acquisition_process_captures_per_s_{label}": result(received / wall, "captures/s", True),
+    }
+
+
+BENCHMARKS = [bench_decode, bench_record_waveform, bench_export_window, bench_compression, bench_smu, bench_smu_stream,
+              bench_sweep_step, bench_relay_switch, bench_vna_check, bench_spectrum_stream, bench_averaging,
+              bench_live_view, bench_acquisition_process, bench_failure_detection, bench_journal, bench_stations]
+
+
+def run_benchmarks(config, silent=False):
+    """
+    Runs all benchmarks in BENCHMARKS
+
+    Args:
+        config (dict) :
+            Benchmark sizes and settings, see build_config()
+        silent (boolean) : [optional] default=False
+            Specifies if status remarks are made to the console, true no remarks are made
+
+    Returns:
+        dict : results by name
+    """
+    results = {}
+    for benchmark in BENCHMARKS:
+        if not silent:
+            print("Running " + benchmark.__name__ + "...")
+        results.update(benchmark(config))
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Compares results against a baseline
+
+    Args:
+        results (dict) :
+            Current results by name
+        baseline (dict) :
+            Baseline results by name
+        tolerance (float) :
+            Allowed relative change in the worse direction eg. 0.25 for 25%
+
+    Returns:
+        list : (name, baseline value, current value, relative change) for every regressed result
+    """
+    regressions = []
+    for name, current in results.items():
+        reference = baseline.get(name)
+        if reference is None or reference["value"] in (None, 0) or current["value"] is None:
+            continue
+        change = (current["value"] - reference["value"]) / reference["value"]
+        worse = -change if current["higher_is_better"] else change
+        if worse > tolerance:
+            regressions.append((name, reference["value"], current["value"], change))
+    return regressions
+
+
+def host_key(quick=False):
+    """Key of this host's baseline: host name, machine, Python version and benchmark sizes"""
+    python = ".".join(platform.python_version_tuple()[:2])
+    return f"{platform.node()}-{platform.machine()}-py{python}-{'quick' if quick else 'full'}"
+
+
+def load_baselines(path):
+    """
+    Returns:
+        dict : host key -> baseline report, empty if the file does not exist or holds no per host baselines
+    """
+    try:
+        with open(path, "r") as baseline_file:
+            baselines = json.load(baseline_file)
+    except FileNotFoundError:
+        return {}
+    return baselines.get("hosts", {})
+
+
+def build_config(quick=False, max_points=1E8):
+    decode_points = [int(10 ** exponent) for exponent in range(3, 9) if 10 ** exponent <= max_points]
+    return {
+        "decode_points": decode_points[:4] if quick else decode_points,
+        "record_points": [1000, 100000] if quick else [1000, 100000, 1000000],
+        "sweep_record_points": 10000,
+        "scope_transfer_rate": 50E6,
+        "smu_points": 20 if quick else 200,
+        "smu_stream_time": 0.2 if quick else 1.0,
+        "relay_switches": 50 if quick else 500,
+        "vna_points": 201 if quick else 1601,
+        "spectrum_points": 601,
+        "average_points": 100000 if quick else 1000000,
+        "failure_pins": 2 if quick else 4,
+        "station_count": 2 if quick else 4,
+        "process_captures": 20 if quick else 100,
+        "spectrum_stream_time": 0.5 if quick else 2.0,
+        "repeats": 1 if quick else 3,
+        "time_budget": 2.0 if quick else 30.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Acquisition path benchmarks against simulated instruments")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON file the results are written to")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="JSON file of the per host baselines")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as this host's baseline")
+    parser.add_argument("--compare", action="store_true", help="compare the results to this host's baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression (default 0.25)")
+    parser.add_argument("--max-points", type=float, default=1E8, help="largest decode record length")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes and single repeats")
+    args = parser.parse_args(argv)
+
+    config = build_config(args.quick, args.max_points)
+    results = run_benchmarks(config)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "config": config,
+        },
+        "results": results,
+    }
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    for name, entry in results.items():
+        value = "skipped" if entry["value"] is None else f"{entry['value']:.4g} {entry['unit']}"
+        print(f"{name}: {value}")
+    print("Results written to " + args.output)
+
+    key = host_key(args.quick)
+    baselines = load_baselines(args.baseline)
+    if args.update_baseline:
+        baselines[key] = report
+        with open(args.baseline, "w") as baseline_file:
+            json.dump({"hosts": baselines}, baseline_file, indent=2)
+        print("Baseline of " + key + " updated: " + args.baseline)
+        return 0
+    if not args.compare:
+        return 0
+    if key not in baselines:
+        # timings of other hosts are not comparable
+        print("No baseline for " + key + " in " + args.baseline + ", run with --update-baseline to create one")
+        return 0
+    baseline = baselines[key]["results"]
+
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    for name, reference, current, change in regressions:
+        print(f"REGRESSION {name}: {reference:.4g} -> {current:.4g} ({change:+.1%})")
+    if len(regressions) == 0:
+        print("No regressions against the baseline of " + key)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
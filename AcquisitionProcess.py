@@ -0,0 +1,394 @@
+"""
+Acquisition and analysis in a separate process, handing captures to the GUI through shared memory.
+
+Decoding and analysing waveforms holds the interpreter lock, in the GUI process that competes with the Qt event loop.
+AcquisitionClient starts a worker process that owns the oscilloscope: it captures, analyses (pulse levels and summary)
+and writes the samples into a slot of a SharedWaveformRing, then sends a small message (slot, generation, scaling,
+results) over a queue. The GUI maps the slot as a numpy array without copying, so its CPU load per capture does not
+grow with the record length.
+
+Each slot has a generation counter, odd while the worker writes it. The worker never waits for the GUI: with all slots
+in use it overwrites the oldest one, a SharedCapture whose slot was overwritten meanwhile reports valid() false and its
+samples must be dropped (or copied with copy() while still valid).
+
+Commands (client -> worker), all answered on the event queue:
+    capture(count, channel)     captures count waveforms
+    run(channel) / stop()       captures continuously until stopped
+    call(method, *args)         calls an Oscilloscope method (configuration), answered with its return value
+    shutdown()                  ends the worker
+"""
+import multiprocessing
+import queue
+import signal
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+from OscilloscopeInterface import ScaledWaveform
+
+
+class SharedWaveformRing():
+    """
+    Fixed size waveform slots in one shared memory block, preceded by one int64 generation counter per slot
+
+    Attributes:
+        slots : int
+            Number of slots
+        slot_bytes : int
+            Capacity of a slot in bytes
+        name : str
+            Name of the shared memory block, other processes attach with SharedWaveformRing(name=name, ...)
+    """
+
+    def __init__(self, slots=8, slot_bytes=4 << 20, name=None):
+        self.slots = int(slots)
+        self.slot_bytes = int(slot_bytes)
+        self.header_bytes = 8 * self.slots
+        self.owner = name == None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=self.header_bytes + self.slots * self.slot_bytes)
+            self.generations[:] = 0
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        self.next_slot = 0
+
+    @property
+    def generations(self):
+        return np.ndarray((self.slots,), dtype=np.int64, buffer=self.memory.buf)
+
+    def write(self, samples):
+        """
+        Copies samples into the next slot (writer side)
+
+        Returns:
+            int, int : the slot and its generation after the write
+
+        Raises:
+            ValueError : the samples do not fit a slot
+        """
+        samples = np.ascontiguousarray(samples)
+        if samples.nbytes > self.slot_bytes:
+            raise ValueError(f"Capture of {samples.nbytes} bytes does not fit a {self.slot_bytes} byte slot")
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.slots
+        generations = self.generations
+        # odd while the slot is written, readers of the previous capture in this slot see it changed
+        generations[slot] += 1
+        self.view(slot, samples.dtype, len(samples))[:] = samples
+        generations[slot] += 1
+        return slot, int(generations[slot])
+
+    def view(self, slot, dtype, count):
+        """Returns the first count samples of a slot as a numpy array mapped onto the shared memory (no copy)"""
+        offset = self.header_bytes + slot * self.slot_bytes
+        return np.ndarray((count,), dtype=dtype, buffer=self.memory.buf, offset=offset)
+
+    def generation(self, slot):
+        return int(self.generations[slot])
+
+    def close(self):
+        """Detaches, the owner also frees the shared memory"""
+        if self.memory == None:
+            return
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+        self.memory = None
+
+
+class SharedCapture(ScaledWaveform):
+    """
+    A waveform whose samples are mapped from a ring slot
+
+    Attributes:
+        channel : int
+            The channel captured
+        summary : dict
+            Analysis results of the worker: base, top [V] and the pulse_summary() values
+        timestamp : float
+            time.time() of the capture
+        sequence : int
+            Number of the capture, counting from 1
+    """
+
+    def __init__(self, ring, slot, generation, codes, message):
+        super().__init__(codes, message["gain"], message["offset"], message["start_time"], message["stop_time"],
+                         message["data_format"])
+        self.ring = ring
+        self.slot = slot
+        self.slot_generation = generation
+        self.channel = message["channel"]
+        self.summary = message["summary"]
+        self.timestamp = message["timestamp"]
+        self.sequence = message["sequence"]
+
+    def valid(self):
+        """True while the slot still holds this capture"""
+        return self.ring.memory != None and self.ring.generation(self.slot) == self.slot_generation
+
+    def copy(self):
+        """
+        Returns:
+            ScaledWaveform : the capture copied out of shared memory, None if it was overwritten already
+        """
+        codes = self.codes.copy()
+        if not self.valid():
+            return None
+        return ScaledWaveform(codes, self.gain, self.offset, self.start_time, self.stop_time, self.data_format)
+
+
+def analyse(waveform):
+    from PulseAnalysis import pulse_levels, pulse_summary
+    voltages = waveform.voltages
+    base, top = pulse_levels(voltages)
+    summary = pulse_summary(waveform.times, voltages)
+    summary.update({"base": base, "top": top})
+    return summary
+
+
+def acquisition_worker(station, ring_name, slots, slot_bytes, commands, events):
+    """
+    Worker process: connects the oscilloscope of the station (see Stations.connect_station()) and executes commands
+
+    Args:
+        station (dict) :
+            The instruments, only the oscilloscope is used
+        ring_name (str) :
+            Shared memory block of the SharedWaveformRing
+        slots, slot_bytes (int) :
+            Geometry of the ring
+        commands (multiprocessing.Queue) :
+            (command, arguments) tuples
+        events (multiprocessing.Queue) :
+            ("capture", message), ("result", value), ("call_error", reason), ("error", reason), ("idle", None),
+            ("ready", identity)
+    """
+    from Stations import connect_station
+    # Ctrl+C is handled by the GUI process, which shuts the worker down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ring = SharedWaveformRing(slots, slot_bytes, name=ring_name)
+    oscilloscope = None
+    try:
+        try:
+            oscilloscope = connect_station(dict(station, smu=None, controller=None, vna=None))["oscilloscope"]
+        except Exception as error:
+            events.put(("error", repr(error)))
+            return
+        events.put(("ready", oscilloscope.device_name))
+        sequence = 0
+        remaining = 0
+        channel = 1
+        while True:
+            try:
+                command, arguments = commands.get(block=remaining == 0)
+            except queue.Empty:
+                command = None
+            if command == "shutdown":
+                break
+            elif command == "capture":
+                remaining, channel = arguments
+            elif command == "run":
+                remaining, channel = -1, arguments[0]
+            elif command == "stop":
+                if remaining != 0:
+                    events.put(("idle", None))
+                remaining = 0
+            elif command == "call":
+                method, call_arguments = arguments
+                try:
+                    events.put(("result", getattr(oscilloscope, method)(*call_arguments)))
+                except Exception as error:
+                    events.put(("call_error", repr(error)))
+            if remaining == 0:
+                continue
+
+            waveform = oscilloscope.record_waveform_raw(channel=channel, silent=True)
+            if waveform is None:
+                events.put(("error", "capture failed"))
+                remaining = 0
+                continue
+            sequence += 1
+            try:
+                slot, generation = ring.write(waveform.codes)
+            except ValueError as error:
+                events.put(("error", str(error)))
+                remaining = 0
+                continue
+            events.put(("capture", {
+                "slot": slot, "generation": generation, "dtype": waveform.codes.dtype.str, "count": len(waveform.codes),
+                "gain": waveform.gain, "offset": waveform.offset, "start_time": waveform.start_time,
+                "stop_time": waveform.stop_time, "data_format": waveform.data_format, "channel": channel,
+                "summary": analyse(waveform), "timestamp": time.time(), "sequence": sequence,
+            }))
+            if remaining > 0:
+                remaining -= 1
+                if remaining == 0:
+                    events.put(("idle", None))
+    finally:
+        if oscilloscope != None:
+            oscilloscope.close()
+        ring.close()
+
+
+class AcquisitionClient():
+    """
+    GUI side of the acquisition process
+
+    Attributes:
+        ring : SharedWaveformRing
+            The slots captures arrive in, owned (and freed) by the client
+        identity : str
+            *IDN? of the oscilloscope the worker connected, None until it is ready
+        captures : int
+            Captures received
+        overwritten : int
+            Captures whose slot was overwritten before they were polled
+    """
+
+    def __init__(self, station, slots=8, slot_bytes=4 << 20):
+        """
+        Args:
+            station (dict) :
+                The oscilloscope the worker connects, like a station of Stations.py eg. {"oscilloscope": "RTO6"} or
+                {"simulated": true}. The GUI process must not hold a connection to it
+            slots (int) : [optional] default=8
+                Slots of the ring, captures not polled before the worker wrapped around are lost
+            slot_bytes (int) : [optional] default=4 MiB
+                Capacity of a slot, at least the record length times the sample size of the transfer format
+        """
+        self.station = station
+        self.ring = SharedWaveformRing(slots, slot_bytes)
+        # spawned, the worker must not inherit the GUI's Qt or VISA state
+        context = multiprocessing.get_context("spawn")
+        self.commands = context.Queue()
+        self.events = context.Queue()
+        self.process = context.Process(target=acquisition_worker, name="Acquisition", daemon=True,
+                                       args=(station, self.ring.name, slots, slot_bytes, self.commands, self.events))
+        self.identity = None
+        self.captures = 0
+        self.overwritten = 0
+        self.errors = []
+        self.idle = True
+        # capture messages received but not polled yet
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self, timeout=30.0):
+        """
+        Starts the worker and waits until it connected the oscilloscope
+
+        Returns:
+            boolean : true if the worker is ready
+        """
+        self.process.start()
+        deadline = time.perf_counter() + timeout
+        while self.identity == None and time.perf_counter() < deadline:
+            try:
+                kind, payload = self.events.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if kind == "ready":
+                self.identity = payload
+            elif kind == "error":
+                print("Acquisition process failed: " + payload)
+                return False
+        return self.identity != None
+
+    def capture(self, count=1, channel=1):
+        self.idle = False
+        self.commands.put(("capture", (count, channel)))
+
+    def run(self, channel=1):
+        self.idle = False
+        self.commands.put(("run", (channel,)))
+
+    def stop(self):
+        self.commands.put(("stop", None))
+
+    def call(self, method, *arguments, timeout=10.0):
+        """
+        Calls an Oscilloscope method in the worker (between captures) and returns its return value
+
+        Raises:
+            RuntimeError : the call raised in the worker
+        """
+        self.commands.put(("call", (method, arguments)))
+        deadline = time.perf_counter() + timeout
+        while True:
+            kind, payload = self.receive(deadline - time.perf_counter())
+            if kind == None:
+                raise TimeoutError("No answer to " + method)
+            if kind == "result":
+                return payload
+            if kind == "call_error":
+                raise RuntimeError(payload)
+
+    def receive(self, timeout=None):
+        """
+        Handles the next event, waiting up to timeout seconds (not at all if None)
+
+        Returns:
+            str, object : the event, None, None if there was none
+        """
+        try:
+            if timeout == None:
+                kind, payload = self.events.get_nowait()
+            else:
+                kind, payload = self.events.get(timeout=max(0.0, timeout))
+        except queue.Empty:
+            return None, None
+        if kind == "capture":
+            self.pending.append(payload)
+        elif kind == "idle":
+            self.idle = True
+        elif kind == "error":
+            self.idle = True
+            self.errors.append(payload)
+            print("Acquisition process: " + payload)
+        return kind, payload
+
+    def poll(self, timeout=None):
+        """
+        Returns the captures that arrived, mapped from shared memory
+
+        Args:
+            timeout (float) : [optional] [units seconds]
+                Waits up to this long for a capture if none is waiting, returns right away if not given
+
+        Returns:
+            SharedCapture[] : the captures in order, overwritten ones are left out (and counted in overwritten)
+        """
+        if timeout != None and not self.pending:
+            deadline = time.perf_counter() + timeout
+            while not self.pending:
+                kind, _ = self.receive(deadline - time.perf_counter())
+                if kind == None:
+                    break
+        while self.receive()[0] != None:
+            pass
+        captures = []
+        for message in self.pending:
+            codes = self.ring.view(message["slot"], np.dtype(message["dtype"]), message["count"])
+            capture = SharedCapture(self.ring, message["slot"], message["generation"], codes, message)
+            if capture.valid():
+                captures.append(capture)
+            else:
+                self.overwritten += 1
+        self.captures += len(self.pending)
+        self.pending = []
+        return captures
+
+    def close(self, timeout=5.0):
+        """Shuts the worker down and frees the shared memory"""
+        if self.process.is_alive():
+            self.commands.put(("shutdown", None))
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.ring.close()
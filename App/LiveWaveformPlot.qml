@@ -0,0 +1,43 @@
+import QtQuick
+import QtQuick.Controls
+import QtQml
+
+import WaveformProvider
+
+// Live pulse plot of one scope channel. The frame arrives as one float32 buffer (x, y interleaved, min/max decimated
+// to the plot width) and is drawn without creating an object per point, at most provider.maxFps times a second.
+Canvas {
+    id: root
+
+    property alias channel: provider.channel
+    property alias maxFps: provider.maxFps
+    property color lineColor: "#BEA9EF"
+    property var points: new Float32Array(0)
+
+    WaveformProvider {
+        id: provider
+        buckets: Math.max(1, Math.round(root.width))
+        onFrameChanged: {
+            root.points = new Float32Array(provider.samples())
+            root.requestPaint()
+        }
+    }
+
+    Component.onCompleted: peripheral_controller.attachWaveformProvider(provider)
+
+    onPaint: {
+        var context = getContext("2d")
+        context.clearRect(0, 0, width, height)
+        if (points.length < 4)
+            return
+        var xScale = width / Math.max(provider.xMax - provider.xMin, 1e-15)
+        var yScale = height / Math.max(provider.yMax - provider.yMin, 1e-9)
+        context.strokeStyle = lineColor
+        context.lineWidth = 1
+        context.beginPath()
+        context.moveTo((points[0] - provider.xMin) * xScale, height - (points[1] - provider.yMin) * yScale)
+        for (var index = 2; index < points.length; index += 2)
+            context.lineTo((points[index] - provider.xMin) * xScale, height - (points[index + 1] - provider.yMin) * yScale)
+        context.stroke()
+    }
+}
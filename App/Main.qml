@@ -24,6 +24,7 @@ ApplicationWindow{
     // Peripheral Handling. Created from Python.
     PeripheralController {
         id: peripheral_controller
+        objectName: "peripheral_controller"
     }
     
     // Configuration Dialog see ConfigurationDialog.qml
@@ -342,6 +343,14 @@ ApplicationWindow{
             Layout.fillHeight: true
 
             color: "#ffffff"
+
+            // latest pulse captured on the trigger channel, see LiveWaveformPlot.qml
+            LiveWaveformPlot {
+                id: livePulsePlot
+                anchors.fill: parent
+                anchors.margins: 5
+                lineColor: window.oscColor
+            }
         }
 
         Rectangle {
@@ -0,0 +1,223 @@
+"""
+Headless batch reanalysis of archived captures (.lmao files written by save_raw_data_to_file).
+
+Capture files are discovered under the given paths, split into chunks and decoded/analysed on a process pool.
+Results of every chunk are appended to one consolidated CSV, and a manifest records processed files (with their size
+and modification time) so an interrupted run resumes where it stopped and unchanged files are never processed twice.
+A file that changed since it was processed is analysed again and gets a new row, the last row of a path is current.
+
+Usage:
+    python BatchReprocess.py ./captures --output results.csv --sample-interval 1e-10
+    python BatchReprocess.py ./captures --workers 8 --chunk-size 16 --format INT,16
+"""
+import argparse
+import concurrent.futures
+import csv
+import json
+import os
+import sys
+import time
+import numpy as np
+
+from VisaResource import parse_raw_bytes_data
+from PulseAnalysis import pulse_summary, find_edges
+
+
+RESULT_FIELDS = ["path", "samples", "amplitude", "mean", "rise_time", "rising_edge", "falling_edge", "error"]
+
+
+def discover_captures(paths, pattern_extension=".lmao"):
+    """
+    Finds capture files, directories are searched recursively
+
+    Args:
+        paths (str[]) :
+            Files and directories to search
+        pattern_extension (str) : [optional] default=".lmao"
+            Extension of the capture files
+
+    Returns:
+        str[] : sorted absolute paths of the capture files
+    """
+    found = set()
+    for path in paths:
+        if os.path.isfile(path):
+            found.add(os.path.abspath(path))
+            continue
+        for root, _, files in os.walk(path):
+            for name in files:
+                if name.endswith(pattern_extension):
+                    found.add(os.path.abspath(os.path.join(root, name)))
+    return sorted(found)
+
+
+def file_signature(path):
+    """Returns the (size, modification time) used to detect changed files"""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_manifest(path):
+    """Loads the manifest of processed files, an empty manifest if it does not exist"""
+    try:
+        with open(path, "r") as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {"processed": {}}
+
+
+def save_manifest(manifest, path):
+    """Writes the manifest atomically so an interrupted run never leaves it half written"""
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(temporary_path, path)
+
+
+def analyse_capture(path, options):
+    """
+    Decodes and analyses one capture file
+
+    Args:
+        path (str) :
+            The capture file
+        options (dict) :
+            data_format, sample_interval, start_time, gate and plateau window (see main())
+
+    Returns:
+        dict : one result row, see RESULT_FIELDS
+    """
+    row = {"path": path}
+    values = parse_raw_bytes_data(path=path, silent=True, data_format=options["data_format"])
+    if isinstance(values, int) or len(values) < 2:
+        row["error"] = "decode failed"
+        return row
+    if options["gain"] != 1.0 or options["offset"] != 0.0 or values.dtype.kind == "i":
+        values = values.astype(np.float32) * np.float32(options["gain"]) + np.float32(options["offset"])
+
+    times = options["start_time"] + np.arange(len(values)) * options["sample_interval"]
+    summary = pulse_summary(times, values, options["gate_start"], options["gate_stop"],
+                            options["plateau_start"], options["plateau_stop"])
+    rising, falling = find_edges(times, values)
+    row.update(summary)
+    row.update({"samples": len(values), "rising_edge": rising, "falling_edge": falling})
+    return row
+
+
+def process_chunk(paths, options):
+    """
+    Work unit run on a pool process: analyses a chunk of files
+
+    Returns:
+        list of (path, signature, row)
+    """
+    results = []
+    for path in paths:
+        try:
+            signature = file_signature(path)
+            row = analyse_capture(path, options)
+        except Exception as error:
+            signature = None
+            row = {"path": path, "error": repr(error)}
+        results.append((path, signature, row))
+    return results
+
+
+def chunked(items, size):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def run_batch(paths, output, manifest_path, options, workers=None, chunk_size=8, silent=False):
+    """
+    Processes all unprocessed capture files on a process pool
+
+    Args:
+        paths (str[]) :
+            Files and directories to search for captures
+        output (str) :
+            CSV file results are appended to
+        manifest_path (str) :
+            Manifest of processed files, used to resume
+        options (dict) :
+            Analysis options passed to analyse_capture()
+        workers (int) : [optional]
+            Number of worker processes, the number of cores if not given
+        chunk_size (int) : [optional] default=8
+            Files per work unit
+        silent (boolean) : [optional] default=False
+            Specifies if status remarks are made to the console, true no remarks are made
+
+    Returns:
+        int, int : number of files processed and number skipped as already processed
+    """
+    manifest = load_manifest(manifest_path)
+    processed = manifest["processed"]
+    captures = discover_captures(paths)
+    pending = [path for path in captures if processed.get(path) != file_signature(path)]
+    skipped = len(captures) - len(pending)
+    if not silent:
+        print(f"Found {len(captures)} captures, {skipped} already processed, {len(pending)} to process")
+    if len(pending) == 0:
+        return 0, skipped
+
+    new_output = not os.path.exists(output) or os.path.getsize(output) == 0
+    start = time.perf_counter()
+    done = 0
+    with open(output, "a", newline="") as output_file:
+        writer = csv.DictWriter(output_file, fieldnames=RESULT_FIELDS)
+        if new_output:
+            writer.writeheader()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(process_chunk, chunk, options) for chunk in chunked(pending, chunk_size)]
+            for future in concurrent.futures.as_completed(futures):
+                for path, signature, row in future.result():
+                    writer.writerow(row)
+                    if signature != None:
+                        processed[path] = signature
+                    done += 1
+                # results first, then the manifest, a crash in between only repeats this chunk
+                output_file.flush()
+                save_manifest(manifest, manifest_path)
+                if not silent:
+                    print(f"{done}/{len(pending)} files, {done / (time.perf_counter() - start):.1f} files/s")
+    return done, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel reanalysis of archived capture files")
+    parser.add_argument("paths", nargs="+", help="capture files or directories (searched recursively)")
+    parser.add_argument("--output", default="reprocess_results.csv", help="consolidated results CSV (appended)")
+    parser.add_argument("--manifest", default=None, help="manifest of processed files, default <output>.manifest.json")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, default the number of cores")
+    parser.add_argument("--chunk-size", type=int, default=8, help="files per work unit")
+    parser.add_argument("--format", default="REAL,32", help="block format of the captures: REAL,32, INT,8, INT,16")
+    parser.add_argument("--gain", type=float, default=1.0, help="volts per code for integer captures")
+    parser.add_argument("--offset", type=float, default=0.0, help="volts at code 0 for integer captures")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="seconds per sample, default 1 (sample index)")
+    parser.add_argument("--start-time", type=float, default=0.0, help="time of the first sample")
+    parser.add_argument("--gate", type=float, nargs=2, default=(None, None), metavar=("START", "STOP"),
+                        help="pulse gate for amplitude and rise time")
+    parser.add_argument("--plateau", type=float, nargs=2, default=(None, None), metavar=("START", "STOP"),
+                        help="plateau window for the mean")
+    args = parser.parse_args(argv)
+
+    options = {
+        "data_format": args.format.upper(),
+        "gain": args.gain,
+        "offset": args.offset,
+        "sample_interval": args.sample_interval,
+        "start_time": args.start_time,
+        "gate_start": args.gate[0],
+        "gate_stop": args.gate[1],
+        "plateau_start": args.plateau[0],
+        "plateau_stop": args.plateau[1],
+    }
+    manifest = args.manifest if args.manifest != None else args.output + ".manifest.json"
+    done, skipped = run_batch(args.paths, args.output, manifest, options, args.workers, max(1, args.chunk_size))
+    print(f"Processed {done} files, skipped {skipped}. Results in {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Write-ahead journal of a test campaign, so a run interrupted by a crash or a lost instrument resumes where it stopped.
+
+The journal is an append-only JSON lines file. Before a step runs a "begin" record is appended, once its results are
+stored a "commit" record with the step's parameters, results, data file checksums and the hash of the instrument state
+it ran under. Each record is one short write, flushed and synced, so a record that made it to the file survives a crash.
+
+On resume the committed steps are not measured again: their data files are re-verified by checksum instead, and a step
+whose files are missing or changed runs again. A step that began but never committed was interrupted, it runs again
+(for a TLP step the pin may have received that pulse already, which is reported).
+"""
+import hashlib
+import json
+import os
+import time
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """Returns the SHA-256 of a file as hex"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def step_key(step):
+    """Stable identity of a plan step across runs of the same plan"""
+    return f"{step.pin}|{step.measurement}|{step.level:g}|{step.stage}"
+
+
+def plan_hash(steps):
+    """Hash of the steps and their parameters, independent of the run order, a journal only resumes the plan it was written for"""
+    description = sorted([step_key(step), sorted(step.parameters.items())] for step in steps)
+    return hashlib.sha256(json.dumps(description, default=str).encode()).hexdigest()
+
+
+def state_hash(config, identities):
+    """Hash of the configuration a step ran under and the identities of the instruments it ran on"""
+    return hashlib.sha256(json.dumps([sorted(config.items()), sorted(identities.items())], default=str).encode()).hexdigest()[:16]
+
+
+def journal_values(values):
+    """The JSON serializable part of a step's values, arrays are stored in data files instead"""
+    kept = {}
+    for name, value in values.items():
+        try:
+            json.dumps(value)
+        except TypeError:
+            continue
+        kept[name] = value
+    return kept
+
+
+class CampaignJournal():
+    """
+    Append-only journal of the steps of one campaign
+
+    Attributes:
+        path : str
+            The journal file
+        fsync : boolean
+            Syncs every record to disk, off trades crash safety for a little less overhead per step
+        committed : dict
+            step key -> commit record, of the steps whose results are stored
+        interrupted : dict
+            step key -> begin record, of steps that began but never committed
+        data_lost : dict
+            step key -> paths of the data files that are missing or changed, of committed steps that stay committed
+        identities : dict
+            Instrument name -> identity (*IDN? and similar) of the last committed step
+    """
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self.committed = {}
+        self.interrupted = {}
+        self.data_lost = {}
+        self.identities = {}
+        self.file = None
+        self.plan = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.file != None:
+            self.file.close()
+            self.file = None
+
+    def _append(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def read(self):
+        """
+        Reads the journal file
+
+        Returns:
+            list of dict, int : the records and the length of the file they span. A torn last record (crash during the
+            write) is not returned
+        """
+        records = []
+        length = 0
+        if not os.path.exists(self.path):
+            return records, length
+        with open(self.path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+                length += len(line)
+        return records, length
+
+    def open(self, steps, verify=True, silent=False):
+        """
+        Opens the journal for the plan, resuming it if the file holds a journal of the same plan
+
+        Args:
+            steps (PlanStep[]) :
+                The steps of the campaign
+            verify (boolean) : [optional] default=True
+                Re-verifies the data files of committed steps by checksum. Steps with missing or changed files run
+                again, except TLP steps: pulsing the pin again would change its stress history, they stay committed
+                and are listed in data_lost
+            silent (boolean) : [optional] default=False
+                Specifies if status remarks are made to the console, true no remarks are made
+
+        Returns:
+            dict : step key -> commit record of the steps that do not have to run again
+        """
+        self.plan = plan_hash(steps)
+        records, length = self.read()
+        if records and (records[0].get("type") != "campaign" or records[0].get("plan") != self.plan):
+            raise ValueError("Journal " + str(self.path) + " belongs to a different plan, use a new journal file")
+
+        self.committed = {}
+        begun = {}
+        for record in records[1:]:
+            if record["type"] == "begin":
+                begun[record["key"]] = record
+            elif record["type"] == "commit":
+                begun.pop(record["key"], None)
+                self.committed[record["key"]] = record
+                self.identities = record.get("identities", self.identities)
+        self.interrupted = begun
+
+        self.data_lost = {}
+        if verify:
+            for key, record in list(self.committed.items()):
+                lost = [entry["path"] for entry in record.get("files", [])
+                        if not os.path.exists(entry["path"]) or file_checksum(entry["path"]) != entry["sha256"]]
+                if not lost:
+                    continue
+                if "|tlp|" in key:
+                    # the journaled pulse values are still replayed, only the capture is gone
+                    self.data_lost[key] = lost
+                    if not silent:
+                        print(f"Data of step {key} is missing or changed ({', '.join(lost)}), it is not pulsed again")
+                else:
+                    if not silent:
+                        print(f"Data of step {key} is missing or changed ({', '.join(lost)}), it runs again")
+                    del self.committed[key]
+
+        # a torn last record would corrupt the next one, it is cut off
+        if os.path.exists(self.path) and os.path.getsize(self.path) != length:
+            os.truncate(self.path, length)
+        self.file = open(self.path, "a")
+        if not records:
+            self._append({"type": "campaign", "plan": self.plan, "steps": len(steps), "created": time.time()})
+        elif not silent:
+            print(f"Resuming campaign: {len(self.committed)} of {len(steps)} steps committed")
+            for key in self.interrupted:
+                print(f"Step {key} was interrupted" + (", the pin may already have received this pulse" if "|tlp|" in key else ""))
+        return self.committed
+
+    def check_identities(self, identities, silent=False):
+        """
+        Compares the instruments connected now with those of the last committed step
+
+        Returns:
+            list of str : the instruments whose identity changed
+        """
+        changed = [name for name, identity in identities.items()
+                   if name in self.identities and self.identities[name] != identity]
+        if changed and not silent:
+            print("Instruments changed since the campaign was interrupted: " + ", ".join(changed))
+        return changed
+
+    def begin(self, step):
+        """Appends the begin record of a step, before it changes anything on the DUT"""
+        self._append({"type": "begin", "key": step_key(step), "time": time.time()})
+
+    def commit(self, step, result, config, identities):
+        """
+        Appends the commit record of a finished step
+
+        Args:
+            step (PlanStep) :
+                The step
+            result (StepResult) :
+                Its outcome, data files listed in result.values["files"] are checksummed
+            config (dict) :
+                The configuration in place while it ran
+            identities (dict) :
+                Instrument name -> identity
+        """
+        files = [{"path": path, "sha256": file_checksum(path)} for path in result.values.get("files", [])]
+        record = {
+            "type": "commit", "key": step_key(step), "status": result.status, "failure": result.failure,
+            "values": journal_values(result.values), "files": files, "elapsed": result.elapsed,
+            "parameters": step.parameters, "state": state_hash(config, identities), "time": time.time(),
+        }
+        if identities != self.identities:
+            record["identities"] = identities
+            self.identities = identities
+        self._append(record)
+        self.committed[record["key"]] = record
@@ -0,0 +1,276 @@
+import copy
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+def waveform_memory(waveform):
+    """
+    Bytes a ScaledWaveform can hold in memory: its codes plus the voltages (float32) and times (float64) computed on
+    access, whether or not they have been computed yet. Charging them up front keeps the budget when record_waveform()
+    or a reader computes them after the waveform was cached
+    """
+    points = len(waveform.codes)
+    nbytes = 0 if isinstance(waveform.codes, np.memmap) else waveform.codes.nbytes
+    if waveform._voltages is not None:
+        if waveform._voltages is not waveform.codes:
+            nbytes += waveform._voltages.nbytes
+    elif waveform.data_format != "REAL,32" or isinstance(waveform.codes, np.memmap):
+        nbytes += points * np.dtype(np.float32).itemsize
+    nbytes += waveform._times.nbytes if waveform._times is not None else points * np.dtype(np.float64).itemsize
+    return nbytes
+
+
+class CaptureCache():
+    """
+    In-memory cache of recent waveforms (ScaledWaveform) keyed by (sweep step, channel, timestamp).
+    Least recently used waveforms are evicted once the cached waveforms exceed the byte budget, each is charged for its
+    codes and the voltages and times that may be computed from them (see waveform_memory()). With a spill directory
+    evicted waveforms are moved to memory-mapped files instead of dropped, up to their own byte budget, so they can
+    still be read without parsing the capture again. Spill files are written after the cache lock is released, on the
+    CaptureWriter thread if one is given, until then the evicted waveform is served from memory.
+
+    Attributes:
+        max_bytes : int
+            Byte budget of the waveforms held in memory
+        spill_directory : str
+            Directory of the memory-mapped spill files, None drops evicted waveforms
+        max_spill_bytes : int
+            Byte budget of the spill files
+        hits, misses, spill_hits, evictions, spills : int
+            Lookup and eviction counters, see stats()
+    """
+
+    def __init__(self, max_bytes=256E6, spill_directory=None, max_spill_bytes=2E9, writer=None):
+        """
+        Args:
+            max_bytes (int) : [optional] default=256E6
+                Byte budget of the waveforms held in memory
+            spill_directory (str) : [optional]
+                Directory evicted waveforms are memory mapped to, "" uses a temporary directory removed on exit
+            max_spill_bytes (int) : [optional] default=2E9
+                Byte budget of the spill files
+            writer (CaptureWriter) : [optional]
+                Writes the spill files in the background, without one they are written by put() (outside the lock)
+        """
+        self.max_bytes = int(max_bytes)
+        self.max_spill_bytes = int(max_spill_bytes)
+        self.temporary_directory = None
+        if spill_directory == "":
+            self.temporary_directory = tempfile.TemporaryDirectory(prefix="capture_cache_")
+            spill_directory = self.temporary_directory.name
+        elif spill_directory != None:
+            os.makedirs(spill_directory, exist_ok=True)
+        self.spill_directory = spill_directory
+        self.writer = writer
+
+        self.lock = threading.Lock()
+        # key -> (waveform, bytes), least recently used first
+        self.memory = OrderedDict()
+        # key -> (waveform backed by a memmap, or in memory until its spill file is written, bytes, spill file)
+        self.spilled = OrderedDict()
+        self.memory_bytes = 0
+        self.spill_bytes = 0
+        self.spill_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.spill_hits = 0
+        self.evictions = 0
+        self.spills = 0
+
+
+    def __len__(self):
+        return len(self.memory) + len(self.spilled)
+
+
+    def __contains__(self, key):
+        return key in self.memory or key in self.spilled
+
+
+    def put(self, step, channel, waveform, timestamp=None):
+        """
+        Caches a waveform
+
+        Args:
+            step :
+                The sweep step the waveform belongs to (any hashable, eg. the step index or pulse voltage)
+            channel (int) :
+                The scope channel
+            waveform (ScaledWaveform) :
+                The waveform
+            timestamp (float) : [optional]
+                Time of the capture, time.time() if not given
+
+        Returns:
+            tuple : the key (step, channel, timestamp)
+        """
+        key = (step, channel, time.time() if timestamp == None else timestamp)
+        with self.lock:
+            self._discard(key)
+            nbytes = waveform_memory(waveform)
+            self.memory[key] = (waveform, nbytes)
+            self.memory_bytes += nbytes
+            spills = self._enforce_budget()
+        # no disk I/O under the lock (or in the capture path, with a writer)
+        for spill in spills:
+            if self.writer == None:
+                self._write_spill(*spill)
+            elif not self.writer.submit(self._write_spill, *spill):
+                self.remove(spill[0])
+        return key
+
+
+    def get(self, key):
+        """
+        Returns:
+            ScaledWaveform : the cached waveform (memory mapped if it was spilled), None if it is not cached
+        """
+        with self.lock:
+            if key in self.memory:
+                # voltages and times were charged when it was cached, computing them does not grow the total
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key][0]
+            if key in self.spilled:
+                self.spilled.move_to_end(key)
+                self.spill_hits += 1
+                # a copy, so voltages computed by the caller are not kept alive (and uncounted) by the cache
+                return copy.copy(self.spilled[key][0])
+            self.misses += 1
+            return None
+
+
+    def keys(self, step=None, channel=None):
+        """
+        Returns:
+            tuple[] : keys of the cached waveforms matching step and channel (None matches all), oldest capture first
+        """
+        with self.lock:
+            keys = list(self.memory) + list(self.spilled)
+        return sorted((key for key in keys if (step == None or key[0] == step) and (channel == None or key[1] == channel)),
+                      key=lambda key: key[2])
+
+
+    def latest(self, step=None, channel=None):
+        """
+        Returns:
+            ScaledWaveform : the most recent cached waveform matching step and channel, None if there is none
+        """
+        keys = self.keys(step, channel)
+        if len(keys) == 0:
+            with self.lock:
+                self.misses += 1
+            return None
+        return self.get(keys[-1])
+
+
+    def remove(self, key):
+        with self.lock:
+            self._discard(key)
+
+
+    def clear(self):
+        """Drops all cached waveforms and deletes the spill files"""
+        with self.lock:
+            for key in list(self.memory) + list(self.spilled):
+                self._discard(key)
+
+
+    def stats(self):
+        """
+        Returns:
+            dict : entries, memory_bytes, spilled_entries, spill_bytes, hits, spill_hits, misses, hit_rate, evictions, spills
+        """
+        with self.lock:
+            lookups = self.hits + self.spill_hits + self.misses
+            return {
+                "entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "spilled_entries": len(self.spilled),
+                "spill_bytes": self.spill_bytes,
+                "hits": self.hits,
+                "spill_hits": self.spill_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.spill_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "spills": self.spills,
+            }
+
+
+    def _discard(self, key):
+        if key in self.memory:
+            self.memory_bytes -= self.memory.pop(key)[1]
+        if key in self.spilled:
+            waveform, nbytes, path = self.spilled.pop(key)
+            self.spill_bytes -= nbytes
+            self._delete_spill_file(waveform, path)
+
+
+    def _enforce_budget(self):
+        # the most recent waveform always stays in memory even if it alone exceeds the budget
+        spills = []
+        while self.memory_bytes > self.max_bytes and len(self.memory) > 1:
+            key, (waveform, nbytes) = self.memory.popitem(last=False)
+            self.memory_bytes -= nbytes
+            self.evictions += 1
+            if self.spill_directory != None and waveform.codes.nbytes <= self.max_spill_bytes:
+                spills.append(self._spill(key, waveform))
+
+        while self.spill_bytes > self.max_spill_bytes and len(self.spilled) > 0:
+            _, (waveform, nbytes, path) = self.spilled.popitem(last=False)
+            self.spill_bytes -= nbytes
+            self._delete_spill_file(waveform, path)
+        return [spill for spill in spills if spill[0] in self.spilled]
+
+
+    def _spill(self, key, waveform):
+        # registered now, the file is written by _write_spill() once the lock is released
+        path = os.path.join(self.spill_directory, f"capture_{os.getpid()}_{self.spill_count}.npy")
+        self.spill_count += 1
+        # a copy, _delete_spill_file() must not drop the codes of a waveform a caller still holds
+        spilled = copy.copy(waveform)
+        spilled._voltages = None
+        spilled._times = None
+        nbytes = waveform.codes.nbytes
+        self.spilled[key] = (spilled, nbytes, path)
+        self.spill_bytes += nbytes
+        self.spills += 1
+        return key, waveform.codes, path
+
+
+    def _write_spill(self, key, codes, path):
+        """Writes a spill file and maps the spilled waveform to it, returns None so the writer does not sync it"""
+        try:
+            np.save(path, codes)
+            mapped = np.load(path, mmap_mode="r")
+        except OSError as error:
+            print("Capture cache failed to spill waveform: " + repr(error))
+            self.remove(key)
+            return None
+        with self.lock:
+            entry = self.spilled.get(key)
+            if entry != None and entry[2] == path:
+                # voltages and times are recomputed from the mapped codes on access
+                spilled = copy.copy(entry[0])
+                spilled.codes = mapped
+                self.spilled[key] = (spilled, entry[1], path)
+                return None
+        # dropped while the file was written
+        del mapped
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+
+    def _delete_spill_file(self, waveform, path):
+        # drop the mapping first, on Windows a mapped file cannot be removed (it stays until the last reader lets go)
+        waveform.codes = None
+        try:
+            os.remove(path)
+        except OSError:
+            pass
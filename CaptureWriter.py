@@ -0,0 +1,173 @@
+import atexit
+import os
+import queue
+import threading
+import time
+
+
+class CaptureWriter():
+    """
+    Background writer for captures so storage latency stays out of the acquisition path.
+    Write jobs are queued (bounded, a full queue blocks the producer), written in batches on a worker thread and
+    synced to disk according to the fsync policy.
+
+    Attributes:
+        fsync : str
+            "never" leaves syncing to the OS, "batch" syncs all files of a batch after writing it, "always" syncs every file
+        batch_size : int
+            Most jobs written per batch
+        put_timeout : float [units seconds]
+            Longest time submit() waits for queue space, None waits as long as needed
+        written : int
+            Jobs written so far
+        failed : int
+            Jobs that raised an exception
+        blocked_time : float [units seconds]
+            Total time producers waited for queue space (backpressure)
+        max_depth : int
+            Deepest the queue has been
+    """
+
+    FSYNC_POLICIES = ("never", "batch", "always")
+
+    def __init__(self, max_queue=32, batch_size=8, fsync="batch", put_timeout=None):
+        """
+        Creates and starts the writer thread
+
+        Args:
+            max_queue (int) : [optional] default=32
+                Jobs queued before submit() blocks
+            batch_size (int) : [optional] default=8
+                Most jobs written per batch
+            fsync (str) : [optional] default="batch"
+                One of "never", "batch", "always"
+            put_timeout (float) : [optional] [units seconds]
+                Longest time submit() waits for queue space, None waits as long as needed
+        """
+        if fsync not in CaptureWriter.FSYNC_POLICIES:
+            raise ValueError("Invalid fsync policy " + str(fsync) + ", must be one of " + str(CaptureWriter.FSYNC_POLICIES))
+        self.fsync = fsync
+        self.batch_size = max(1, batch_size)
+        self.put_timeout = put_timeout
+        self.jobs = queue.Queue(maxsize=max(1, max_queue))
+        self.written = 0
+        self.failed = 0
+        self.blocked_time = 0.0
+        self.max_depth = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="CaptureWriter", daemon=True)
+        self.thread.start()
+        # queued captures are still written if the program exits without closing the writer
+        atexit.register(self.close)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queues a write job, blocks while the queue is full (backpressure)
+
+        Args:
+            function (callable) :
+                Writes the capture and returns the path of the written file (or None), eg. save_raw_data_to_file
+            args, kwargs :
+                Passed to function
+
+        Returns:
+            boolean : true if queued, false if the writer is closed or the queue stayed full for put_timeout
+        """
+        if self.closed:
+            print("Capture writer closed, capture not saved")
+            return False
+        start = time.perf_counter()
+        try:
+            self.jobs.put((function, args, kwargs), timeout=self.put_timeout)
+        except queue.Full:
+            print("Capture writer queue full, capture not saved")
+            return False
+        finally:
+            self.blocked_time += time.perf_counter() - start
+        self.max_depth = max(self.max_depth, self.jobs.qsize())
+        return True
+
+
+    def flush(self):
+        """Blocks until every queued job has been written (and synced according to the fsync policy)"""
+        self.jobs.join()
+
+
+    def close(self):
+        """Writes all queued jobs and stops the writer thread"""
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.jobs.put(None)
+        self.thread.join()
+
+
+    def stats(self):
+        """
+        Returns:
+            dict : queued, written, failed, max_depth, blocked_time
+        """
+        return {
+            "queued": self.jobs.qsize(),
+            "written": self.written,
+            "failed": self.failed,
+            "max_depth": self.max_depth,
+            "blocked_time": self.blocked_time,
+        }
+
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self.jobs.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            paths = []
+            for job in batch:
+                if job is None:
+                    running = False
+                    continue
+                function, args, kwargs = job
+                try:
+                    path = function(*args, **kwargs)
+                    if path != None:
+                        if self.fsync == "always":
+                            sync_file(path)
+                        else:
+                            paths.append(path)
+                    self.written += 1
+                except Exception as error:
+                    self.failed += 1
+                    print("Capture writer failed to save capture: " + repr(error))
+
+            if self.fsync == "batch":
+                for path in paths:
+                    try:
+                        sync_file(path)
+                    except OSError as error:
+                        print("Capture writer failed to sync " + str(path) + ": " + repr(error))
+            for _ in batch:
+                self.jobs.task_done()
+
+
+def sync_file(path):
+    """Flushes a written file to the storage device"""
+    file_descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(file_descriptor)
+    finally:
+        os.close(file_descriptor)
@@ -0,0 +1,116 @@
+"""
+Concurrent bring-up of all bench instruments. Every device connects on its own thread with its own timeout, so bring-up
+takes as long as the slowest device instead of the sum of all of them.
+"""
+import threading
+import time
+
+
+class ConnectResult():
+    """
+    Outcome of connecting one device
+
+    Attributes:
+        name : str
+            The device
+        connected : boolean
+            True if the connect function returned true in time
+        elapsed : float [units seconds]
+            Time the connection took, the timeout if it timed out
+        timed_out : boolean
+            True if the device did not answer within its timeout (its connect keeps running in the background, see
+            on_late of connect_all())
+        error : str
+            Exception raised by the connect function, or why the device was skipped, None otherwise
+    """
+
+    def __init__(self, name, connected=False, elapsed=0.0, timed_out=False, error=None):
+        self.name = name
+        self.connected = connected
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+        self.error = error
+
+    def status(self):
+        if self.connected:
+            return "connected"
+        if self.timed_out:
+            return "timed out"
+        if self.error != None:
+            return self.error
+        return "failed"
+
+    def as_dict(self):
+        return {"name": self.name, "connected": self.connected, "elapsed": self.elapsed,
+                "timed_out": self.timed_out, "error": self.error}
+
+
+def connect_all(connectors, timeouts=None, default_timeout=10.0, on_late=None):
+    """
+    Connects all devices in parallel
+
+    Args:
+        connectors (dict) :
+            device name -> function connecting it and returning true on success, None for a device without a driver
+        timeouts (dict) : [optional]
+            device name -> timeout in seconds
+        default_timeout (float) : [optional] default=10.0 [units seconds]
+            Timeout of devices not in timeouts
+        on_late (callable) : [optional]
+            Called with the ConnectResult of a device that timed out once its connect finishes after all, on the
+            device's thread
+
+    Returns:
+        dict : device name -> ConnectResult, in the order of connectors
+    """
+    timeouts = {} if timeouts == None else timeouts
+    results = {name: ConnectResult(name, error="no driver") for name, connect in connectors.items() if connect == None}
+    done = {}
+    timed_out = set()
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def run(name, connect):
+        try:
+            connected = bool(connect())
+            error = None
+        except Exception as exception:
+            connected = False
+            error = repr(exception)
+        result = ConnectResult(name, connected, time.perf_counter() - start, error=error)
+        with lock:
+            done[name] = result
+            late = name in timed_out
+        events[name].set()
+        if late and on_late != None:
+            on_late(result)
+
+    # daemon threads, a device that hangs past its timeout must not keep the application from exiting
+    events = {name: threading.Event() for name, connect in connectors.items() if connect != None}
+    for name in events:
+        threading.Thread(target=run, args=(name, connectors[name]), name="Connect-" + name, daemon=True).start()
+
+    for name, event in events.items():
+        timeout = timeouts.get(name, default_timeout)
+        event.wait(max(0.0, start + timeout - time.perf_counter()))
+        with lock:
+            if name in done:
+                results[name] = done[name]
+            else:
+                timed_out.add(name)
+                results[name] = ConnectResult(name, elapsed=timeout, timed_out=True)
+    return {name: results[name] for name in connectors}
+
+
+def format_report(results):
+    """
+    Returns:
+        str : one line per device with its outcome and time, and the total bring-up time
+    """
+    lines = ["Connect all:"]
+    for result in results.values():
+        lines.append(f"  {result.name:<12} {result.status():<40} {result.elapsed * 1E3:8.1f} ms")
+    total = max((result.elapsed for result in results.values()), default=0.0)
+    connected = sum(result.connected for result in results.values())
+    lines.append(f"  {connected}/{len(results)} connected in {total * 1E3:.1f} ms")
+    return "\n".join(lines)
@@ -0,0 +1,196 @@
+"""
+Online failure detection for TLP stress sweeps.
+
+Every new SMU leakage point and every pulse I-V point is checked against the failure criteria as it arrives, so a sweep
+can stop stressing a pin within the step it failed in:
+    - absolute leakage: |I| above leakage_max at any check voltage
+    - leakage shift: leakage moved by more than leakage_shift times the baseline (the pre-stress check) at the same voltage
+    - snapback: the pulse voltage collapsed by more than snapback_drop of the highest pulse voltage while the current rose
+"""
+
+
+def tlp_current(charge_voltage, dut_voltage, impedance=50.0):
+    """
+    Current into the DUT of a TLP pulse, from the charge voltage and the measured DUT (plateau) voltage.
+    The line launches half the charge voltage, so I = (V_charge - V_dut) / Z
+
+    Args:
+        charge_voltage (float) : [units V]
+            The TLP charge voltage (stress level)
+        dut_voltage (float) : [units V]
+            Voltage across the DUT during the pulse plateau
+        impedance (float) : [optional] default=50.0 [units ohms]
+            Characteristic impedance of the TLP system
+
+    Returns:
+        float : the DUT current in A
+    """
+    return (charge_voltage - dut_voltage) / impedance
+
+
+class FailureCriteria():
+    """
+    Limits a DUT fails at, a criterion set to None is not checked
+
+    Attributes:
+        leakage_max : float [units A]
+            Largest acceptable leakage magnitude
+        leakage_shift : float
+            Largest acceptable change of the leakage relative to the baseline, eg. 10 allows 10x the baseline current
+        leakage_floor : float [units A]
+            Currents below this are treated as this, so the shift of a near zero baseline is not measured against noise
+        snapback_drop : float
+            Largest acceptable drop of the pulse voltage as a fraction of the highest pulse voltage, while the current rises
+        voltage_resolution : float [units V]
+            Check (setpoint) voltages within this of each other compare against the same baseline point
+    """
+
+    def __init__(self, leakage_max=1E-6, leakage_shift=10.0, leakage_floor=1E-9, snapback_drop=None, voltage_resolution=1E-3):
+        self.leakage_max = leakage_max
+        self.leakage_shift = leakage_shift
+        self.leakage_floor = leakage_floor
+        self.snapback_drop = snapback_drop
+        self.voltage_resolution = voltage_resolution
+
+
+class PinState():
+    """
+    What the detector knows about one pin
+
+    Attributes:
+        baseline : dict
+            check setpoint voltage (rounded to voltage_resolution) -> baseline leakage in A
+        baseline_open : boolean
+            True while leakage points are still taken as baseline (until the first pulse)
+        pulses : list of tuple
+            (level, voltage, current) of every pulse
+        peak_pulse_voltage : float [units V]
+            Highest pulse voltage so far
+        failure : str
+            Why the pin failed, None while it has not
+        failed_level : float [units V]
+            Stress level the pin failed at
+    """
+
+    def __init__(self):
+        self.baseline = {}
+        self.baseline_open = True
+        self.pulses = []
+        self.peak_pulse_voltage = None
+        self.failure = None
+        self.failed_level = None
+        self.level = 0.0
+
+
+class FailureDetector():
+    """
+    Evaluates sweep results per pin as they arrive
+
+    Attributes:
+        criteria : FailureCriteria
+            The limits checked
+        pins : dict
+            pin -> PinState
+    """
+
+    def __init__(self, criteria=None):
+        self.criteria = FailureCriteria() if criteria == None else criteria
+        self.pins = {}
+
+    def state(self, pin):
+        if pin not in self.pins:
+            self.pins[pin] = PinState()
+        return self.pins[pin]
+
+    def failed(self, pin):
+        """Returns true if the pin has failed"""
+        return pin in self.pins and self.pins[pin].failure != None
+
+    def failure(self, pin):
+        """Returns why the pin failed, None if it has not"""
+        return self.pins[pin].failure if pin in self.pins else None
+
+    def _fail(self, state, reason):
+        if state.failure == None:
+            state.failure = reason
+            state.failed_level = state.level
+        return state.failure
+
+    def _voltage_key(self, voltage):
+        return round(voltage / self.criteria.voltage_resolution)
+
+    def add_leakage_point(self, pin, voltage, current, setpoint=None):
+        """
+        Checks one SMU leakage point, points before the pin's first pulse form its baseline
+
+        Args:
+            pin (str) :
+                The pin measured
+            voltage (float) : [units V]
+                The measured check voltage
+            current (float) : [units A]
+                The measured current (OscillaSMU.make_measurement())
+            setpoint (float) : [optional] [units V]
+                The voltage the SMU was set to, points are compared to the baseline point of the same setpoint. The
+                measured voltage is used if not provided, it can differ between baseline and re-check by more than
+                voltage_resolution
+
+        Returns:
+            str : the failure reason if the pin has failed, None otherwise
+        """
+        state = self.state(pin)
+        criteria = self.criteria
+        if state.failure != None:
+            return state.failure
+        magnitude = abs(current)
+        if criteria.leakage_max != None and magnitude > criteria.leakage_max:
+            return self._fail(state, f"leakage {current:.3e} A at {voltage:g} V above {criteria.leakage_max:.3e} A")
+        key = self._voltage_key(voltage if setpoint == None else setpoint)
+        if state.baseline_open:
+            state.baseline[key] = magnitude
+            return None
+        if criteria.leakage_shift != None and key in state.baseline:
+            reference = max(state.baseline[key], criteria.leakage_floor)
+            shift = abs(max(magnitude, criteria.leakage_floor) - reference) / reference
+            if shift > criteria.leakage_shift:
+                return self._fail(state, f"leakage shifted {shift:.1f}x from baseline at {voltage:g} V")
+        return None
+
+    def add_pulse(self, pin, level, voltage, current):
+        """
+        Checks one pulse I-V point and closes the pin's baseline
+
+        Args:
+            pin (str) :
+                The pin stressed
+            level (float) : [units V]
+                The TLP charge voltage
+            voltage (float) : [units V]
+                DUT voltage during the pulse plateau
+            current (float) : [units A]
+                DUT current during the pulse plateau, see tlp_current()
+
+        Returns:
+            str : the failure reason if the pin has failed, None otherwise
+        """
+        state = self.state(pin)
+        state.baseline_open = False
+        state.level = level
+        if state.failure != None:
+            return state.failure
+        drop = self.criteria.snapback_drop
+        if drop != None and state.pulses and state.peak_pulse_voltage > 0:
+            previous_current = state.pulses[-1][2]
+            if current > previous_current and voltage < state.peak_pulse_voltage * (1 - drop):
+                state.pulses.append((level, voltage, current))
+                return self._fail(state, f"snapback to {voltage:.3g} V from {state.peak_pulse_voltage:.3g} V at {level:g} V")
+        state.pulses.append((level, voltage, current))
+        state.peak_pulse_voltage = voltage if state.peak_pulse_voltage == None else max(state.peak_pulse_voltage, voltage)
+        return None
+
+    def summary(self):
+        """
+        Returns:
+            dict : pin -> (failure reason, stress level it failed at), None for pins that passed
+        """
+        return {pin: (state.failure, state.failed_level) if state.failure != None else None for pin, state in self.pins.items()}
@@ -0,0 +1,403 @@
+"""
+Headless runner for automated production runs, without Qt or QML.
+
+Loads a parameter file and a test plan, connects the instruments, runs the plan with the SweepEngine and writes every
+step result to a JSON lines file. Nothing of PySide6 is imported, so it starts in the time the instrument drivers take
+to import and fits into a job scheduler.
+
+With --serve the runner stays up and takes jobs over a local control socket (127.0.0.1 only), one JSON object per line
+in each direction:
+    {"command": "submit", "plan": "plan.json", "parameters": "parameters.json", "journal": "run1.jsonl"}
+        -> {"ok": true, "job": 1}
+    {"command": "status"}                       -> {"ok": true, "state": "running", "job": {...}, "queued": 0, ...}
+    {"command": "status", "job": 1}             -> {"ok": true, "job": {...}}
+    {"command": "stop"}                         stops the running job after its current step
+    {"command": "shutdown"}                     stops the running job and the runner
+Jobs run one after the other on the same instruments, which stay connected between jobs.
+
+Usage:
+    python Headless.py --station station.json --plan plan.json --parameters parameters.json --results results.jsonl
+    python Headless.py --station station.json --serve --port 8765
+    python Headless.py --port 8765 --send '{"command": "status"}'
+The station file describes the instruments like a station of Stations.py (without name and plan), eg.
+{"oscilloscope": "RTO6", "smu": "COM3", "controller": "COM4"}, or {"simulated": true}.
+"""
+import argparse
+import json
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from CampaignJournal import CampaignJournal
+from Stations import DiscoveryCache, connect_station, resolve_stations, result_row
+from TestPlan import DEFAULT_PARAMETERS, compile_plan, expand_plan, load_plan
+
+
+DEFAULT_PORT = 8765
+
+
+def load_parameters(source):
+    """
+    Parameters for a run: DEFAULT_PARAMETERS updated by a parameter file (or dict) of parameter_dictionary values
+
+    Raises:
+        ValueError : the file sets parameters that do not exist
+    """
+    parameters = dict(DEFAULT_PARAMETERS)
+    if source == None:
+        return parameters
+    if isinstance(source, str):
+        with open(source, "r") as file:
+            source = json.load(file)
+    unknown = [key for key in source if key not in parameters]
+    if unknown:
+        raise ValueError(f"Unknown parameters: {unknown}")
+    parameters.update(source)
+    return parameters
+
+
+class Job():
+    """
+    One plan run submitted to the runner
+
+    Attributes:
+        id : int
+            Job number, counting from 1
+        state : str
+            "queued", "running", "done", "stopped" or "error"
+        steps : int
+            Steps of the compiled plan, None until it was compiled
+        completed : int
+            Steps finished so far
+        failures : dict
+            pin -> (failure reason, stress level) of the failed pins
+        error : str
+            Why the job failed, None otherwise
+    """
+
+    def __init__(self, job_id, description):
+        self.id = job_id
+        self.description = description
+        self.state = "queued"
+        self.steps = None
+        self.completed = 0
+        self.failures = {}
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def as_dict(self):
+        plan = self.description.get("plan")
+        return {"id": self.id, "state": self.state, "plan": plan if isinstance(plan, str) else "inline", "steps": self.steps,
+                "completed": self.completed, "failures": self.failures, "error": self.error,
+                "submitted": self.submitted, "started": self.started, "finished": self.finished}
+
+
+class HeadlessRunner():
+    """
+    Runs submitted jobs one after the other on one set of instruments
+
+    Attributes:
+        station : dict
+            The instruments (see Stations.py), with resolved resource names
+        results_path : str
+            Default JSON lines results file of jobs that do not name one
+        jobs : dict
+            job id -> Job
+    """
+
+    def __init__(self, station, results_path="headless_results.jsonl", discovery_cache=None, silent=False):
+        station = dict(station)
+        station.setdefault("name", "headless")
+        station.setdefault("plan", None)
+        self.station = resolve_stations([station], DiscoveryCache() if discovery_cache == None else discovery_cache, silent)[0]
+        self.results_path = results_path
+        self.silent = silent
+        self.instruments = None
+        self.engine = None
+        self.jobs = {}
+        self.current = None
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.shutdown_event = threading.Event()
+        self.worker = None
+
+    def start(self):
+        """Starts the thread running the submitted jobs"""
+        if self.worker == None:
+            self.worker = threading.Thread(target=self._work, name="HeadlessRunner", daemon=True)
+            self.worker.start()
+
+    def submit(self, description):
+        """
+        Queues a job
+
+        Args:
+            description (dict) :
+                "plan" (file or plan dict, required), "parameters" (file or dict) [optional], "journal" (file) [optional],
+                "data_directory" [optional], "results" (file) [optional], "on_failure" [optional]
+
+        Returns:
+            int : the job id
+
+        Raises:
+            ValueError : the job has no plan
+        """
+        if description.get("plan") == None:
+            raise ValueError("Job has no plan")
+        with self.lock:
+            job = Job(len(self.jobs) + 1, description)
+            self.jobs[job.id] = job
+        self.pending.put(job)
+        return job.id
+
+    def stop(self):
+        """Stops the running job after its current step"""
+        engine = self.engine
+        if engine != None:
+            engine.stop()
+
+    def shutdown(self):
+        """Stops the running job, drops queued jobs and ends the worker"""
+        self.shutdown_event.set()
+        self.stop()
+        self.pending.put(None)
+
+    def wait(self, timeout=None):
+        """Waits until the worker ended (after shutdown())"""
+        if self.worker != None:
+            self.worker.join(timeout)
+
+    def status(self, job_id=None):
+        """
+        Returns:
+            dict : the state of the runner, its current job and the number of queued jobs, or the state of one job
+        """
+        with self.lock:
+            if job_id != None:
+                job = self.jobs.get(int(job_id))
+                if job == None:
+                    raise ValueError("No job " + str(job_id))
+                return {"job": job.as_dict()}
+            current = self.current
+            return {
+                "state": "running" if current != None else "stopping" if self.shutdown_event.is_set() else "idle",
+                "job": current.as_dict() if current != None else None,
+                "queued": sum(job.state == "queued" for job in self.jobs.values()),
+                "finished": [job.id for job in self.jobs.values() if job.state in ("done", "stopped", "error")],
+                "connected": self.instruments != None,
+            }
+
+    def connect(self):
+        """Connects the instruments unless they are connected"""
+        if self.instruments == None:
+            self.instruments = connect_station(self.station)
+
+    def close(self):
+        if self.instruments != None:
+            for instrument in self.instruments.values():
+                if instrument != None:
+                    instrument.close()
+            self.instruments = None
+
+    def run_job(self, job):
+        """Compiles and runs one job, writing its results"""
+        from SweepEngine import SweepEngine
+        description = job.description
+        plan = description["plan"]
+        plan = load_plan(plan) if isinstance(plan, str) else plan
+        steps = compile_plan(expand_plan(plan, load_parameters(description.get("parameters"))))
+        job.steps = len(steps)
+        self.connect()
+        results_path = description.get("results", self.results_path)
+        with open(results_path, "a") as results_file:
+
+            def on_result(result):
+                results_file.write(json.dumps(result_row(self.station["name"], result), separators=(",", ":")) + "\n")
+                job.completed += 1
+
+            self.engine = SweepEngine(on_result=on_result, on_failure=description.get("on_failure", "skip_pin"),
+                                      data_directory=description.get("data_directory"), **self.instruments)
+            journal = CampaignJournal(description["journal"]) if description.get("journal") != None else None
+            try:
+                self.engine.run(steps, journal=journal, silent=self.silent)
+            finally:
+                if journal != None:
+                    journal.close()
+        job.failures = {pin: failure for pin, failure in self.engine.detector.summary().items() if failure != None}
+        stopped = self.engine.stop_event.is_set()
+        self.engine = None
+        return "stopped" if stopped and job.completed < job.steps else "done"
+
+    def _work(self):
+        while not self.shutdown_event.is_set():
+            job = self.pending.get()
+            if job == None or self.shutdown_event.is_set():
+                break
+            with self.lock:
+                self.current = job
+                job.state = "running"
+                job.started = time.time()
+            try:
+                state = self.run_job(job)
+            except Exception as error:
+                state = "error"
+                job.error = repr(error)
+                # a job that failed on the instruments leaves them in any state, they are connected again for the next
+                # job (a plan that could not be compiled never reached them)
+                if job.steps != None:
+                    self.close()
+            with self.lock:
+                job.state = state
+                job.finished = time.time()
+                self.current = None
+            if not self.silent:
+                if state == "error":
+                    print(f"Job {job.id} failed: {job.error}")
+                else:
+                    print(f"Job {job.id} {state}: {job.completed}/{job.steps} steps, {len(job.failures)} failed pins")
+        with self.lock:
+            for job in self.jobs.values():
+                if job.state == "queued":
+                    job.state = "stopped"
+        self.close()
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """Serves one control connection, a JSON command per line answered by a JSON reply per line"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            reply = self.server.execute(line)
+            self.wfile.write((json.dumps(reply, default=str) + "\n").encode())
+            self.wfile.flush()
+            if self.server.runner.shutdown_event.is_set():
+                # shutdown() waits for serve_forever(), which runs on another thread than this handler
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    """Local control socket of a HeadlessRunner, bound to 127.0.0.1 so only this host can submit jobs"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, runner, port=DEFAULT_PORT):
+        super().__init__(("127.0.0.1", port), ControlHandler)
+        self.runner = runner
+
+    def execute(self, line):
+        try:
+            command = json.loads(line)
+            name = command.get("command")
+            if name == "submit":
+                return {"ok": True, "job": self.runner.submit(command)}
+            if name == "status":
+                return dict(ok=True, **self.runner.status(command.get("job")))
+            if name == "stop":
+                self.runner.stop()
+                return {"ok": True}
+            if name == "shutdown":
+                self.runner.shutdown()
+                return {"ok": True}
+            return {"ok": False, "error": "unknown command " + str(name)}
+        except (ValueError, AttributeError) as error:
+            return {"ok": False, "error": str(error)}
+
+
+def send_command(command, port=DEFAULT_PORT, timeout=5.0):
+    """
+    Sends one command to a runner's control socket
+
+    Args:
+        command (dict) :
+            The command, eg. {"command": "status"}
+        port (int) : [optional]
+            The control port
+        timeout (float) : [optional] default=5.0 [units seconds]
+            Connection and reply timeout
+
+    Returns:
+        dict : the reply
+    """
+    with socket.create_connection(("127.0.0.1", port), timeout=timeout) as connection:
+        connection.sendall((json.dumps(command) + "\n").encode())
+        reply = b""
+        while not reply.endswith(b"\n"):
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            reply += chunk
+    return json.loads(reply)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run test plans without the GUI")
+    parser.add_argument("--station", default=None, help="JSON instruments of the bench, see Stations.py")
+    parser.add_argument("--simulated", action="store_true", help="run on the simulated instruments")
+    parser.add_argument("--plan", default=None, help="JSON test plan to run")
+    parser.add_argument("--parameters", default=None, help="JSON parameter file (parameter_dictionary values)")
+    parser.add_argument("--journal", default=None, help="campaign journal, resumes an interrupted run of the plan")
+    parser.add_argument("--data-directory", default=None, help="directory pulse captures and S-parameters are saved to")
+    parser.add_argument("--results", default="headless_results.jsonl", help="results file (JSON lines, appended)")
+    parser.add_argument("--discovery-cache", default="visa_discovery.json", help="VISA discovery cache file")
+    parser.add_argument("--serve", action="store_true", help="keep running and take jobs over the control socket")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="control socket port (127.0.0.1)")
+    parser.add_argument("--send", default=None, help="send a JSON command to a running runner and print the reply")
+    args = parser.parse_args(argv)
+
+    if args.send != None:
+        try:
+            print(json.dumps(send_command(json.loads(args.send), args.port), indent=1))
+        except (OSError, ValueError) as error:
+            print("Command failed: " + str(error))
+            return 1
+        return 0
+
+    try:
+        station = {"simulated": True} if args.simulated else {}
+        if args.station != None:
+            with open(args.station, "r") as file:
+                station.update(json.load(file))
+        runner = HeadlessRunner(station, args.results, DiscoveryCache(args.discovery_cache))
+        if args.plan != None:
+            runner.submit({"plan": args.plan, "parameters": args.parameters, "journal": args.journal,
+                           "data_directory": args.data_directory})
+    except (OSError, ValueError) as error:
+        print("Headless runner could not be started: " + str(error))
+        return 1
+
+    if not args.serve:
+        if args.plan == None:
+            print("Nothing to run, give --plan or --serve")
+            return 1
+        runner.pending.put(None)
+        runner.start()
+        try:
+            runner.wait()
+        except KeyboardInterrupt:
+            runner.shutdown()
+            runner.wait()
+        return 0 if all(job.state == "done" for job in runner.jobs.values()) else 1
+
+    runner.start()
+    server = ControlServer(runner, args.port)
+    print(f"Headless runner listening on 127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        runner.shutdown()
+    server.server_close()
+    runner.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
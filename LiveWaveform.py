@@ -0,0 +1,173 @@
+"""
+Latest captured waveforms, decimated for live plotting.
+
+The acquisition side only hands over a reference to each new waveform (publish() is O(1) and never copies or decodes).
+The display side takes a frame at its own, capped rate: the newest waveform is min/max decimated into preallocated
+float32 buffers, one minimum and one maximum per display column so no pulse peak is lost, on the raw codes before
+scaling to volts. Waveforms published between two frames are never decimated at all.
+"""
+import threading
+import numpy as np
+
+
+def min_max_decimate(samples, buckets, out_min=None, out_max=None):
+    """
+    Minimum and maximum of each of buckets equal slices of samples
+
+    Args:
+        samples (numpy array) :
+            The samples, at least buckets long
+        buckets (int) :
+            Number of slices, trailing samples that do not fill a slice are added to the last one
+        out_min, out_max (numpy array) : [optional]
+            Arrays of buckets length the results are written to
+
+    Returns:
+        numpy array, numpy array : per slice minimum and maximum
+    """
+    samples = np.asarray(samples)
+    if len(samples) < buckets:
+        raise ValueError(f"Cannot decimate {len(samples)} samples into {buckets} buckets")
+    width = len(samples) // buckets
+    body = samples[:width * buckets].reshape(buckets, width)
+    out_min = np.min(body, axis=1, out=out_min)
+    out_max = np.max(body, axis=1, out=out_max)
+    tail = samples[width * buckets:]
+    if len(tail):
+        out_min[-1] = min(out_min[-1], tail.min())
+        out_max[-1] = max(out_max[-1], tail.max())
+    return out_min, out_max
+
+
+class LiveWaveformBuffer():
+    """
+    The latest waveform of each channel and its decimated display frame
+
+    Attributes:
+        buckets : int
+            Display columns, a frame has two points (minimum, maximum) per column
+        published : int
+            Waveforms published
+        frames : int
+            Frames taken, published - frames waveforms were never drawn (the display skipped them)
+    """
+
+    def __init__(self, buckets=1000):
+        self.buckets = int(buckets)
+        self.published = 0
+        self.frames = 0
+        # the acquisition side only ever waits for lock, decimation runs under frame_lock
+        self.lock = threading.Lock()
+        self.frame_lock = threading.Lock()
+        # channel -> (version, waveform)
+        self._latest = {}
+        # channel -> version of the last frame taken
+        self._shown = {}
+        self._allocate(self.buckets)
+
+    def _allocate(self, buckets):
+        # interleaved x, y float32 points: min and max of every column
+        self._frame = np.empty((2 * buckets, 2), dtype=np.float32)
+        self._minimum = np.empty(buckets, dtype=np.float32)
+        self._maximum = np.empty(buckets, dtype=np.float32)
+        self._axis = None
+
+    def set_buckets(self, buckets):
+        """Sets the display columns (eg. the plot width in pixels)"""
+        with self.frame_lock:
+            self.buckets = max(1, int(buckets))
+            self._allocate(self.buckets)
+        with self.lock:
+            self._shown = {}
+
+    def publish(self, channel, waveform):
+        """
+        Hands over a new waveform, called by the acquisition side (see Oscilloscope.set_live_view())
+
+        Args:
+            channel (int) :
+                The channel the waveform was captured on
+            waveform (ScaledWaveform) :
+                The waveform, it must not be modified afterwards
+        """
+        with self.lock:
+            self.published += 1
+            self._latest[channel] = (self.published, waveform)
+
+    def clear(self):
+        """Forgets all waveforms, eg. before the memory they are mapped from is freed"""
+        with self.frame_lock, self.lock:
+            self._latest = {}
+            self._shown = {}
+
+    def channels(self):
+        with self.lock:
+            return sorted(self._latest)
+
+    def pending(self, channel):
+        """Returns true if the channel has a waveform that was not taken as a frame yet"""
+        with self.lock:
+            return channel in self._latest and self._latest[channel][0] != self._shown.get(channel)
+
+    def take(self, channel, force=False):
+        """
+        Decimates the newest waveform of a channel into the frame buffer
+
+        Args:
+            channel (int) :
+                The channel
+            force (boolean) : [optional] default=False
+                Decimates even if the waveform was taken before
+
+        Returns:
+            numpy array : (points, 2) float32 x (seconds), y (volts) points, valid until the next take(), None if there
+            is no new waveform
+        """
+        with self.lock:
+            if channel not in self._latest:
+                return None
+            version, waveform = self._latest[channel]
+            if version == self._shown.get(channel) and not force:
+                return None
+            self._shown[channel] = version
+            self.frames += 1
+        with self.frame_lock:
+            return self._decimate(waveform)
+
+    def _decimate(self, waveform):
+        codes = waveform.codes
+        points = len(codes)
+        if points <= 2 * self.buckets:
+            # short records are drawn as they are
+            frame = np.empty((points, 2), dtype=np.float32)
+            frame[:, 0] = np.linspace(waveform.start_time, waveform.stop_time, points)
+            frame[:, 1] = waveform.voltages
+            return frame
+        # min/max commute with the linear scaling, only the decimated codes are converted to volts
+        minimum, maximum = min_max_decimate(codes, self.buckets, self._minimum, self._maximum)
+        if waveform.gain < 0:
+            minimum, maximum = maximum, minimum
+        frame = self._frame
+        frame[0::2, 1] = minimum
+        frame[1::2, 1] = maximum
+        if waveform.gain != 1.0 or waveform.offset != 0.0:
+            frame[:, 1] *= waveform.gain
+            frame[:, 1] += waveform.offset
+        axis = (waveform.start_time, waveform.stop_time, points)
+        if self._axis != axis:
+            # both points of a column at the column's center time
+            step = (waveform.stop_time - waveform.start_time) / max(points - 1, 1)
+            width = (points // self.buckets) * step
+            centers = waveform.start_time + (np.arange(self.buckets) + 0.5) * width
+            frame[0::2, 0] = centers
+            frame[1::2, 0] = centers
+            self._axis = axis
+        return frame
+
+    def stats(self):
+        """
+        Returns:
+            dict : waveforms published, frames taken and waveforms skipped by the display
+        """
+        with self.lock:
+            return {"published": self.published, "frames": self.frames, "skipped": self.published - self.frames}
@@ -1,24 +1,47 @@
 # Copyright (C) 2024 The Qt Company Ltd.
 # SPDX-License-Identifier: LicenseRef-Qt-Commercial OR BSD-3-Clause
 
+import StartupTiming
 import sys
 from pathlib import Path
+from PySide6.QtCore import Qt, QObject
 from PySide6.QtWidgets import QApplication
 from PySide6.QtQml import QQmlApplicationEngine
+StartupTiming.mark("Qt imported")
 
+# instrument drivers are imported by the controller in the background once the window is up
 from peripheralController import PeripheralController
+# registers the WaveformProvider QML type of the live plots (LiveWaveformPlot.qml)
+from WaveformProvider import WaveformProvider
+StartupTiming.mark("PeripheralController imported")
+
+
+def first_frame():
+    StartupTiming.mark("first frame")
+    StartupTiming.print_report()
+
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     QApplication.setOrganizationName("QtProject")
     QApplication.setApplicationName("ESD Modular Test Setup")
     engine = QQmlApplicationEngine()
+    StartupTiming.mark("QApplication created")
 
     engine.addImportPath(Path(__file__).parent)
     engine.loadFromModule("App", "Main")
+    StartupTiming.mark("QML loaded")
 
     if not engine.rootObjects():
         sys.exit(-1)
+    engine.rootObjects()[0].frameSwapped.connect(first_frame, Qt.SingleShotConnection)
+
+    # flushes queued captures and stops the background threads and processes before the program exits
+    peripheral_controller = engine.rootObjects()[0].findChild(QObject, "peripheral_controller")
+    if peripheral_controller != None:
+        app.aboutToQuit.connect(peripheral_controller.peripheral_controller_quit)
+    else:
+        print("Peripheral controller not found, devices are not closed on exit")
 
     exit_code = app.exec()
     del engine
@@ -1,4 +1,71 @@
 from VisaResource import *
+from PulseAnalysis import find_edge_indices
+from WaveformStorage import quantize_voltages, save_compressed
+from WaveformAveraging import RunningAverage
+
+
+# ADC codes per vertical division of the integer transfer formats, the 10 screen divisions span 254 (INT,8) or 65024 (INT,16) codes (pg. 1399)
+INT_CODES_PER_DIVISION = {
+    "INT,8": 25.4,
+    "INT,16": 6502.4,
+}
+
+
+class ScaledWaveform():
+    """
+    Waveform samples as transferred from the scope together with the scaling needed to convert them to volts.
+    For the integer formats the samples are kept as raw codes, voltages are computed in one vectorized pass on first access.
+
+    Attributes:
+        codes : numpy array
+            The samples as transferred, int8/int16 ADC codes or float32 volts for REAL,32
+        gain : float [units volts/code]
+            Volts per code
+        offset : float [units volts]
+            Voltage of code 0
+        start_time : float [units seconds]
+            Time of the first sample relative to the trigger
+        stop_time : float [units seconds]
+            Time of the last sample relative to the trigger
+        data_format : str
+            The transfer format the samples were read in
+    """
+
+    def __init__(self, codes, gain=1.0, offset=0.0, start_time=0.0, stop_time=0.0, data_format="REAL,32"):
+        self.codes = codes
+        self.gain = gain
+        self.offset = offset
+        self.start_time = start_time
+        self.stop_time = stop_time
+        self.data_format = data_format
+        self._voltages = None
+        self._times = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        """Memory held by the samples in bytes (voltages and times are not counted until computed)"""
+        return self.codes.nbytes
+
+    @property
+    def voltages(self):
+        """numpy array : the samples in volts, computed on first access"""
+        if self._voltages is None:
+            if self.data_format == "REAL,32":
+                self._voltages = self.codes
+            else:
+                self._voltages = self.codes.astype(np.float32) * np.float32(self.gain) + np.float32(self.offset)
+        return self._voltages
+
+    @property
+    def times(self):
+        """numpy array : the sample times in seconds, computed on first access"""
+        if self._times is None:
+            self._times = np.linspace(self.start_time, self.stop_time, len(self.codes))
+        return self._times
+
 
 class Oscilloscope(VisaResource):
     """
@@ -17,8 +84,287 @@ class Oscilloscope(VisaResource):
 
     State = Enum('State', [('RUNNING', 0), ('SINGLE', 1), ('STOPPED', 2)])
 
+    TRANSFER_FORMATS = ("REAL,32", "INT,8", "INT,16")
+
+    # substring of the *IDN? response of supported scopes, used to find the scope among the VISA resources
+    IDENTITY = "RTO"
+
     def __init__(self, pyvisa_resource_manager=None):
         super().__init__(pyvisa_resource_manager)
+        self.transfer_format = "REAL,32"
+        # channel -> (scale, offset, position), read from the scope once per configuration
+        self.vertical_settings = {}
+        # summary value name -> measurement slot, see configure_summary_measurements()
+        self.summary_channel = 1
+        self.summary_slots = {}
+        # (start, stop) of the manual export window in seconds, None exports the whole acquisition
+        self.export_window = None
+        # (margin fraction, minimum margin) when the export window follows the detected pulse, None when disabled
+        self.auto_export_window = None
+        # save_compressed() options used for record_to_file, None saves the raw bytes data
+        self.compressed_storage = None
+        # CaptureWriter saving record_to_file captures in the background, None saves them synchronously
+        self.capture_writer = None
+        # CaptureCache recent waveforms are kept in and the sweep step they are cached under, see set_capture_cache()
+        self.capture_cache = None
+        self.capture_step = None
+        # LiveWaveformBuffer every captured waveform is published to for live plotting, see set_live_view()
+        self.live_view = None
+
+
+    def connect(self, device_index = -1, device_id=None, timeout=None):
+        """
+        Connects like VisaResource.connect(), if neither index nor ID is given the first resource identifying as a
+        supported scope (IDENTITY) is used, so no other instrument is preset
+        """
+        self.invalidate_vertical_settings()
+        # connecting presets the scope, which also resets the export range
+        self.export_window = None
+        if device_index == -1 and device_id == None:
+            device_id = self.find_resource(Oscilloscope.IDENTITY, timeout)
+            if device_id == None:
+                print("No oscilloscope found")
+                return False
+        return super().connect(device_index, device_id, timeout)
+
+
+    def custom_write_command(self, command):
+        # a custom command could change the vertical setup
+        self.invalidate_vertical_settings()
+        super().custom_write_command(command)
+
+
+    def set_transfer_format(self, data_format="REAL,32"):
+        """
+        Sets the binary format waveforms are transferred in by record_waveform(). Integer formats transfer the raw ADC codes,
+        INT,8 uses a quarter and INT,16 half the bus bytes and memory of REAL,32. See pg. 1399 of RTO6 UserManual
+
+        Args:
+            data_format (str) : [optional]
+                One of "REAL,32" (default), "INT,8", "INT,16"
+
+        Returns:
+            boolean : true if the format was accepted
+        """
+        data_format = str(data_format).upper().replace(" ", "")
+        if data_format not in Oscilloscope.TRANSFER_FORMATS:
+            print("Invalid transfer format " + data_format + ", must be one of " + str(Oscilloscope.TRANSFER_FORMATS))
+            return False
+        self.transfer_format = data_format
+        return True
+
+
+    def set_export_window(self, start, stop):
+        """
+        Limits waveform transfers to a window around the pulse (region of interest) so only those samples are
+        transferred and decoded. Times are relative to the trigger. See EXPort:WAVeform commands of RTO6 UserManual
+
+        Args:
+            start (float) : [units seconds]
+                Start of the exported window
+            stop (float) : [units seconds]
+                Stop of the exported window
+        """
+        if self.device == None:
+            print("Scope Not Connected")
+            return
+
+        try:
+            start = float(start)
+            stop = float(stop)
+        except ValueError:
+            print("Export window start and stop should be float values, setting export window failed")
+            return
+        if stop <= start:
+            print("Export window stop must be after start, setting export window failed")
+            return
+
+        if self.export_window == (start, stop):
+            return
+        self.device.write("EXPort:WAVeform:SCOPe MANual") # export a manually set range
+        self.device.write(f"EXPort:WAVeform:STARt {start}")
+        self.device.write(f"EXPort:WAVeform:STOP {stop}")
+        self.export_window = (start, stop)
+
+
+    def clear_export_window(self):
+        """Exports the whole acquisition again, see set_export_window()"""
+        if self.device == None:
+            print("Scope Not Connected")
+            return
+        self.device.write("EXPort:WAVeform:SCOPe WFM")
+        self.export_window = None
+
+
+    def set_auto_export_window(self, enabled=True, margin_fraction=0.5, minimum_margin=2E-9):
+        """
+        Makes the export window follow the pulse: after every waveform the window is set to the detected rising and
+        falling edges plus a margin, so the transfer size scales with the pulse width rather than the timebase.
+        If no pulse is found the whole acquisition is exported for the next capture.
+
+        Args:
+            enabled (boolean) : [optional] default=True
+                Enables or disables following the pulse, disabling also clears the export window
+            margin_fraction (float) : [optional] default=0.5
+                Margin on each side as a fraction of the pulse width
+            minimum_margin (float) : [optional] [units seconds] default=2E-9
+                Smallest margin on each side
+        """
+        if enabled:
+            self.auto_export_window = (margin_fraction, minimum_margin)
+        else:
+            self.auto_export_window = None
+            self.clear_export_window()
+
+
+    def update_export_window(self, waveform):
+        """
+        Moves the export window to the pulse found in a waveform, see set_auto_export_window()
+
+        Args:
+            waveform (ScaledWaveform) :
+                The last captured waveform
+
+        Returns:
+            boolean : true if a pulse was found and the window set
+        """
+        if self.auto_export_window == None:
+            return False
+        margin_fraction, minimum_margin = self.auto_export_window
+        # edges are found on the raw codes, converting them to voltages and times would cost more than the search
+        inverted = waveform.data_format != "REAL,32" and waveform.gain < 0
+        rising, falling = find_edge_indices(waveform.codes, inverted=inverted)
+        if rising == None or falling == None:
+            if self.export_window != None:
+                print("No pulse edges found, exporting the whole acquisition")
+                self.clear_export_window()
+            return False
+        interval = (waveform.stop_time - waveform.start_time) / max(len(waveform) - 1, 1)
+        rising = waveform.start_time + rising * interval
+        falling = waveform.start_time + falling * interval
+        margin = max((falling - rising) * margin_fraction, minimum_margin)
+        start, stop = rising - margin, falling + margin
+        # keep the current window while the pulse sits well inside it, avoids rewriting it for every capture
+        if self.export_window != None:
+            current_start, current_stop = self.export_window
+            inside = current_start <= rising - minimum_margin and falling + minimum_margin <= current_stop
+            if inside and (current_stop - current_start) <= 2 * (stop - start):
+                return True
+        self.set_export_window(start, stop)
+        return True
+
+
+    def set_compressed_storage(self, enabled=True, codec="zlib", level=6, chunk_samples=65536):
+        """
+        Selects how record_to_file saves captures: compressed waveform files (.lmaz, see WaveformStorage.py) or the
+        raw bytes data (.lmao). Compressed files hold integer codes in independently decodable chunks so a time window
+        can be read without inflating the whole file. REAL,32 captures are quantized to 16 bit codes over their range.
+
+        Args:
+            enabled (boolean) : [optional] default=True
+                Saves compressed files if true, raw bytes data if false
+            codec (str) : [optional] default="zlib"
+                One of "zlib", "bz2", "lzma"
+            level (int) : [optional] default=6
+                Compression level of the codec
+            chunk_samples (int) : [optional] default=65536
+                Samples per chunk
+        """
+        if enabled:
+            self.compressed_storage = {"codec": codec, "level": level, "chunk_samples": chunk_samples}
+        else:
+            self.compressed_storage = None
+
+
+    def set_capture_writer(self, capture_writer=None):
+        """
+        Saves record_to_file captures through a background CaptureWriter so slow storage does not stretch the
+        acquisition cycle. None saves captures synchronously again
+
+        Args:
+            capture_writer (CaptureWriter) : [optional]
+                The writer captures are queued to
+        """
+        self.capture_writer = capture_writer
+
+
+    def set_capture_cache(self, capture_cache=None):
+        """
+        Keeps every captured waveform in a CaptureCache keyed by (capture_step, channel, timestamp) so recent pulses
+        can be revisited without reloading and parsing their files. None stops caching
+
+        Args:
+            capture_cache (CaptureCache) : [optional]
+                The cache waveforms are added to
+        """
+        self.capture_cache = capture_cache
+
+
+    def set_live_view(self, live_view=None):
+        """
+        Publishes every captured waveform to a LiveWaveformBuffer (see LiveWaveform.py) for live plotting, publishing
+        only hands over the waveform, decimation for display happens on the display side. None stops publishing
+
+        Args:
+            live_view (LiveWaveformBuffer) : [optional]
+                The buffer waveforms are published to
+        """
+        self.live_view = live_view
+
+
+    def set_capture_step(self, step):
+        """Sets the sweep step (eg. the step index or pulse voltage) following waveforms are cached under"""
+        self.capture_step = step
+
+
+    def save_compressed_waveform(self, waveform, path=None):
+        """
+        Saves a waveform to a compressed waveform file with the options of set_compressed_storage()
+
+        Args:
+            waveform (ScaledWaveform) :
+                The captured waveform
+            path (str) : [optional]
+                The save path location and file name *without extension*, ./output if not provided
+
+        Returns:
+            str : the path of the written file
+        """
+        options = self.compressed_storage if self.compressed_storage != None else {}
+        if path == None:
+            path = "./output"
+        if waveform.data_format == "REAL,32":
+            codes, gain, offset = quantize_voltages(waveform.codes)
+        else:
+            codes, gain, offset = waveform.codes, waveform.gain, waveform.offset
+        return save_compressed(path, codes, gain, offset, waveform.start_time, waveform.stop_time, **options)
+
+
+    def invalidate_vertical_settings(self):
+        """Forgets the cached vertical settings, they are queried again before the next integer format waveform"""
+        self.vertical_settings = {}
+
+
+    def get_vertical_settings(self, channel=1, refresh=False):
+        """
+        Returns the vertical scale, offset and position of a channel. Values are queried once and cached until the
+        configuration changes (connect, custom commands or invalidate_vertical_settings())
+
+        Args:
+            channel (default=1 int) : [optional]
+                The channel number
+            refresh (boolean) : [optional] default=False
+                Queries the scope even if cached values exist
+
+        Returns:
+            float, float, float : scale [V/div], offset [V], position [div]
+        """
+        if refresh or channel not in self.vertical_settings:
+            scale = float(self.device.query(f"CHAN{channel}:SCALe?")) # pg. 1462
+            offset = float(self.device.query(f"CHAN{channel}:OFFSet?")) # pg. 1463
+            position = float(self.device.query(f"CHAN{channel}:POSition?")) # pg. 1463
+            self.vertical_settings[channel] = (scale, offset, position)
+        return self.vertical_settings[channel]
 
     def set_state(self, newState):
         """
@@ -179,10 +525,36 @@ class Oscilloscope(VisaResource):
             numpy.array, numpy.array : times, voltages of waveform as numpy arrays
 
         """
+        waveform = self.record_waveform_raw(channel=channel, record_to_file=record_to_file, path=path, silent=silent)
+        if waveform is None:
+            return -1, -1
+
+        return waveform.times, waveform.voltages
+
+
+    def record_waveform_raw(self, channel=1, record_to_file = False, path=None, silent=False):
+        """
+        Same procedure as record_waveform() but returns the samples as transferred in the current transfer format
+        (see set_transfer_format()), conversion to volts is left until the voltages are accessed.
+        Files saved with record_to_file hold the raw block, parse them with the same data_format.
+
+        Args:
+            channel (default=1 int): [optional]
+                The channel that the waveform data is being recorded
+            record_to_file (default=False boolean) : [optional]
+                Records data to a file specified by path parameter
+            path (default=None str) : [optional]
+                If recorded_to_file is specified, file will be saved to this path, provide path and file name but no extension
+            silent (boolean) : [optional] default=False
+                Specifies if status remarks are made to the console, true no remarks are made
+
+        Returns:
+            ScaledWaveform : the recorded waveform, None if the recording failed
+        """
         # Scope Connection Early Return Test
         if self.device == None:
             print("Scope Not Connected")
-            return -1, -1
+            return None
         
         # put scope into single mode 
         self.device.write("SING") # puts scope into single mode (pg. 1434)
@@ -199,9 +571,42 @@ class Oscilloscope(VisaResource):
         if not silent:
             print("Signal triggered reading data from scope...")
 
+        return self.read_waveform_raw(channel=channel, record_to_file=record_to_file, path=path, silent=silent)
+
+
+    def read_waveform_raw(self, channel=1, record_to_file = False, path=None, silent=False):
+        """
+        Transfers and decodes the waveform of the last acquisition without arming the scope again, used by
+        record_waveform_raw() and to fetch the waveform behind a summary acquisition (see record_summary())
+
+        Args:
+            channel (default=1 int): [optional]
+                The channel that the waveform data is being recorded
+            record_to_file (default=False boolean) : [optional]
+                Records data to a file specified by path parameter
+            path (default=None str) : [optional]
+                If recorded_to_file is specified, file will be saved to this path, provide path and file name but no extension
+            silent (boolean) : [optional] default=False
+                Specifies if status remarks are made to the console, true no remarks are made
+
+        Returns:
+            ScaledWaveform : the recorded waveform, None if the recording failed
+        """
+        if self.device == None:
+            print("Scope Not Connected")
+            return None
+
+        data_format = self.transfer_format
+        gain, offset = 1.0, 0.0
+        if data_format != "REAL,32":
+            # volts = (code / codes per division - position) * scale + offset
+            scale, vertical_offset, position = self.get_vertical_settings(channel)
+            gain = scale / INT_CODES_PER_DIVISION[data_format]
+            offset = vertical_offset - position * scale
+
         # after scope has triggered make data queries
         head = self.device.query(f"CHAN{channel}:WAV1:DATA:HEAD?") # request the data size (pg. 1451)
-        self.device.write("FORM REAL,32") # request data in float32 format (pg. 1399)
+        self.device.write(f"FORM {data_format}") # request data in float32 or integer format (pg. 1399)
         self.device.write("EXP:WAV:INCX OFF") # dont include X values (pg. 1452)
         self.device.write(f"CHAN{channel}:WAV1:DATA?") # query data (pg. 1452) 
 
@@ -213,30 +618,264 @@ class Oscilloscope(VisaResource):
         #self.scope.write("FORM ASC")
         #data_str = self.scope.query(f"CHAN{channel}:WAV1:DATA?")
 
-        # save raw data to file
-        if record_to_file:
+        # save raw data to file, compressed captures are saved once decoded
+        if record_to_file and self.compressed_storage == None:
             if not silent:
                 print("Recording Raw Bytes Data to file")
-            save_raw_data_to_file(data=data, path=path)           
+            if self.capture_writer != None:
+                self.capture_writer.submit(save_raw_data_to_file, data=data, path=path)
+            else:
+                save_raw_data_to_file(data=data, path=path)
 
-        voltages = parse_raw_bytes_data(data)
+        with tracer.span("host", "parse_raw_bytes_data"):
+            codes = parse_raw_bytes_data(data, silent=silent, data_format=data_format)
 
-        if len(voltages) < 10:
+        if isinstance(codes, int) or len(codes) < 10:
             print("Data parsing failed, data invalid")
-            return -1, -1
+            return None
 
         np_head = np.fromstring(head, sep=',')
 
         start_time = np_head[0]
         end_time = np_head[1]
-        data_length = int(np_head[2])
 
-        # create numpy arrays for easy data manipulation
-        times = np.linspace(start_time, end_time, data_length)
-
-        return times, voltages
+        waveform = ScaledWaveform(codes, gain, offset, start_time, end_time, data_format)
+        if record_to_file and self.compressed_storage != None:
+            if not silent:
+                print("Recording compressed waveform to file")
+            if self.capture_writer != None:
+                self.capture_writer.submit(self.save_compressed_waveform, waveform, path)
+            else:
+                self.save_compressed_waveform(waveform, path)
+        if self.capture_cache != None:
+            self.capture_cache.put(self.capture_step, channel, waveform)
+        if self.live_view != None:
+            self.live_view.publish(channel, waveform)
+        if self.auto_export_window != None:
+            self.update_export_window(waveform)
+        return waveform
     
 
+    # summary values and the measurement type of the scope measurement engine (MEASurement<m>:MAIN)
+    SUMMARY_MEASUREMENTS = (("amplitude", "AMPLitude"), ("mean", "MEAN"), ("rise_time", "RTIMe"))
+
+    # results at or above this magnitude are the SCPI not-a-number value (9.91E37), the measurement was invalid
+    INVALID_RESULT = 9.9E37
+
+    def configure_summary_measurements(self, channel=1, gate_start=None, gate_stop=None, plateau_start=None, plateau_stop=None,
+                                       first_measurement=1):
+        """
+        Configures the scope measurement engine for summary acquisitions (see record_summary()): pulse amplitude and
+        rise time gated around the pulse, mean gated to the plateau. Uses measurement slots first_measurement to first_measurement+2
+
+        Args:
+            channel (default=1 int) : [optional]
+                The channel that is measured
+            gate_start (float) : [optional] [units seconds]
+                Start of the gate around the pulse, ungated if gate_start or gate_stop is not given
+            gate_stop (float) : [optional] [units seconds]
+                Stop of the gate around the pulse
+            plateau_start (float) : [optional] [units seconds]
+                Start of the plateau window for the mean, the pulse gate is used if not given
+            plateau_stop (float) : [optional] [units seconds]
+                Stop of the plateau window for the mean
+            first_measurement (default=1 int) : [optional]
+                The first of the three measurement slots used
+        """
+        if self.device == None:
+            print("Scope Not Connected")
+            return
+
+        if plateau_start == None or plateau_stop == None:
+            plateau_start, plateau_stop = gate_start, gate_stop
+
+        self.summary_channel = channel
+        self.summary_slots = {}
+        for index, (name, measurement_type) in enumerate(Oscilloscope.SUMMARY_MEASUREMENTS):
+            slot = first_measurement + index
+            self.summary_slots[name] = slot
+            start, stop = (plateau_start, plateau_stop) if name == "mean" else (gate_start, gate_stop)
+
+            self.device.write(f"MEASurement{slot}:ENABle ON")
+            self.device.write(f"MEASurement{slot}:SOURce C{channel}W1")
+            self.device.write(f"MEASurement{slot}:MAIN {measurement_type}")
+            if start != None and stop != None:
+                self.device.write(f"MEASurement{slot}:GATE:MODE ABS")
+                self.device.write(f"MEASurement{slot}:GATE:ABSolute:STARt {start}")
+                self.device.write(f"MEASurement{slot}:GATE:ABSolute:STOP {stop}")
+                self.device.write(f"MEASurement{slot}:GATE ON")
+            else:
+                self.device.write(f"MEASurement{slot}:GATE OFF")
+
+
+    def read_summary(self):
+        """
+        Queries the results of the summary measurements for the last acquisition
+
+        Returns:
+            dict : amplitude [V], mean [V], rise_time [s], nan for invalid results. None if not configured
+        """
+        if self.device == None:
+            print("Scope Not Connected")
+            return None
+        if len(self.summary_slots) == 0:
+            print("Summary measurements not configured, see configure_summary_measurements()")
+            return None
+
+        summary = {}
+        for name, slot in self.summary_slots.items():
+            try:
+                value = float(self.device.query(f"MEASurement{slot}:RESult:ACTual?"))
+            except ValueError:
+                value = float("nan")
+            summary[name] = float("nan") if abs(value) >= Oscilloscope.INVALID_RESULT else value
+        return summary
+
+
+    def record_summary(self, fetch_waveform=False, anomaly_check=None, silent=False):
+        """
+        Summary acquisition: arms the scope, waits for the trigger and returns only the scalar pulse measurements
+        (a few bytes instead of the full waveform). The waveform is only transferred if requested or on an anomaly.
+        Configure the measurements first with configure_summary_measurements()
+
+        Args:
+            fetch_waveform (boolean) : [optional] default=False
+                Always transfers the waveform as well
+            anomaly_check (callable) : [optional]
+                Called with the summary dict, returning true fetches the waveform. Invalid (nan) results are always anomalies
+            silent (boolean) : [optional] default=False
+                Specifies if status remarks are made to the console, true no remarks are made
+
+        Returns:
+            dict, ScaledWaveform : the summary and the waveform (None if not fetched), None, None on failure
+        """
+        if self.device == None:
+            print("Scope Not Connected")
+            return None, None
+
+        self.device.write("SING") # puts scope into single mode (pg. 1434)
+        if not silent:
+            print("Waiting for triggering signal...")
+        while self.check_stopped() == False:
+            time.sleep(0.1)
+
+        summary = self.read_summary()
+        if summary == None:
+            return None, None
+
+        anomaly = any(value != value for value in summary.values())
+        if not anomaly and anomaly_check != None:
+            anomaly = bool(anomaly_check(summary))
+        summary["anomaly"] = anomaly
+
+        waveform = None
+        if fetch_waveform or anomaly:
+            if anomaly and not silent:
+                print("Anomalous pulse measurement, fetching waveform")
+            waveform = self.read_waveform_raw(channel=self.summary_channel, silent=silent)
+        return summary, waveform
+
+
+    def set_averaging(self, count, channel=1):
+        """
+        Sets the scope to average count acquisitions per SINGle (ACQuire:COUNt with the AVERage arithmetic), a count
+        of 1 turns averaging off
+
+        Args:
+            count (int) :
+                Number of acquisitions averaged, 1 to 16777215
+            channel (default=1 int) : [optional]
+                The channel averaged
+        """
+        if self.device == None:
+            print("Scope Not Connected")
+            return
+        count = min(max(int(count), 1), 16777215)
+        self.device.write(f"ACQuire:COUNt {count}") # pg. 1443
+        self.device.write(f"CHANnel{channel}:ARIThmetics " + ("AVERage" if count > 1 else "OFF")) # (pg. reference required here)
+
+
+    def record_scope_averaged_waveform(self, count, channel=1, silent=False):
+        """
+        Averages count acquisitions on the scope and transfers only the averaged waveform. Fastest way to average, but
+        no per-sample variance is available and the count is fixed in advance. Averaging is turned off again afterwards
+
+        Args:
+            count (int) :
+                Number of acquisitions averaged
+            channel (default=1 int) : [optional]
+                The channel that the waveform data is being recorded
+            silent (boolean) : [optional] default=False
+                Specifies if status remarks are made to the console, true no remarks are made
+
+        Returns:
+            ScaledWaveform : the averaged waveform, None if the recording failed
+        """
+        if self.device == None:
+            print("Scope Not Connected")
+            return None
+        self.set_averaging(count, channel)
+        try:
+            return self.record_waveform_raw(channel=channel, silent=silent)
+        finally:
+            self.set_averaging(1, channel)
+
+
+    def record_averaged_waveform(self, max_count, channel=1, tolerance=None, confidence=0.95, min_count=2, silent=False):
+        """
+        Captures the same pulse repeatedly and folds every capture into running per-sample mean and variance arrays
+        (see WaveformAveraging.RunningAverage), memory does not grow with the number of captures. Stops early once the
+        confidence band of every sample is within tolerance.
+        The individual captures are not cached, the capture cache receives the averaged waveform
+
+        Args:
+            max_count (int) :
+                Largest number of captures
+            channel (default=1 int) : [optional]
+                The channel that the waveform data is being recorded
+            tolerance (float) : [optional] [units volts]
+                Half width of the confidence band at which averaging stops, None always takes max_count captures
+            confidence (float) : [optional] default=0.95
+                Confidence level of the band
+            min_count (int) : [optional] default=2
+                Captures taken at least before the convergence check
+            silent (boolean) : [optional] default=False
+                Specifies if status remarks are made to the console, true no remarks are made
+
+        Returns:
+            RunningAverage : mean, variance and confidence band of the captures, None if no capture succeeded
+        """
+        if self.device == None:
+            print("Scope Not Connected")
+            return None
+        average = RunningAverage()
+        capture_cache = self.capture_cache
+        self.capture_cache = None
+        # a window following the pulse would change the record length and alignment between captures
+        auto_export_window = self.auto_export_window
+        self.auto_export_window = None
+        try:
+            for _ in range(int(max_count)):
+                waveform = self.record_waveform_raw(channel=channel, silent=True)
+                if waveform is None:
+                    break
+                average.add_waveform(waveform)
+                if tolerance != None and average.converged(tolerance, confidence, min_count):
+                    break
+        finally:
+            self.capture_cache = capture_cache
+            self.auto_export_window = auto_export_window
+        if average.count == 0:
+            print("Averaging failed, no waveform recorded")
+            return None
+        if not silent:
+            print(f"Averaged {average.count} captures, confidence band within {average.band_half_width(confidence):.4g} V")
+        if self.capture_cache != None:
+            self.capture_cache.put(self.capture_step, channel, ScaledWaveform(average.mean.astype(np.float32), 1.0, 0.0,
+                                                                               average.start_time, average.stop_time))
+        return average
+
+
     def check_stopped(self):
         """
         Checks the status of the oscilloscope to see if its triggered following a command to place it in running mode
@@ -1,6 +1,123 @@
 import xtralien
 import serial
+import threading
 import time
+import numpy as np
+from ScpiTrace import trace_xtralien_device
+
+
+class SampleRingBuffer():
+    """
+    Fixed size ring buffer of timestamped SMU samples, preallocated so streaming never allocates per sample.
+    When the reader falls behind the oldest samples are overwritten and counted as lost.
+
+    Attributes:
+        times : numpy array
+            time.time() of each sample (host clock, taken when its response arrived)
+        voltages, currents : numpy array [units V, A]
+            The measured samples
+        written : int
+            Samples written since creation
+        lost : int
+            Samples overwritten before read_new() returned them
+        events : list of tuple
+            (time, label) of marked events (eg. TLP pulses), see mark_event()
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self.times = np.zeros(self.capacity)
+        self.voltages = np.zeros(self.capacity)
+        self.currents = np.zeros(self.capacity)
+        self.written = 0
+        self.read_position = 0
+        self.lost = 0
+        self.events = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def append(self, times, voltages, currents):
+        """Copies a block of samples into the buffer"""
+        count = len(times)
+        if count > self.capacity:
+            times, voltages, currents = times[-self.capacity:], voltages[-self.capacity:], currents[-self.capacity:]
+            count = self.capacity
+        with self.lock:
+            slots = np.arange(self.written, self.written + count) % self.capacity
+            self.times[slots] = times
+            self.voltages[slots] = voltages
+            self.currents[slots] = currents
+            self.written += count
+
+    def _ordered(self, first, last):
+        slots = np.arange(first, last) % self.capacity
+        return self.times[slots], self.voltages[slots], self.currents[slots]
+
+    def latest(self, count=1):
+        """
+        Returns:
+            numpy array, numpy array, numpy array : times, voltages and currents of the last count samples, oldest first
+        """
+        with self.lock:
+            count = min(count, len(self))
+            return self._ordered(self.written - count, self.written)
+
+    def last_time(self):
+        """Returns the time of the newest sample, -inf if there is none"""
+        with self.lock:
+            return self.times[(self.written - 1) % self.capacity] if self.written else -np.inf
+
+    def read_new(self):
+        """
+        Returns the samples written since the last call, oldest first. Samples that were overwritten before they could
+        be read are added to lost
+
+        Returns:
+            numpy array, numpy array, numpy array : times, voltages, currents
+        """
+        with self.lock:
+            first = max(self.read_position, self.written - self.capacity)
+            self.lost += first - self.read_position
+            self.read_position = self.written
+            return self._ordered(first, self.written)
+
+    def window(self, start, stop):
+        """
+        Returns the buffered samples taken from start to stop (time.time() values), oldest first
+
+        Returns:
+            numpy array, numpy array, numpy array : times, voltages, currents
+        """
+        with self.lock:
+            times, voltages, currents = self._ordered(self.written - len(self), self.written)
+        first, last = np.searchsorted(times, [start, stop])
+        return times[first:last], voltages[first:last], currents[first:last]
+
+    def mark_event(self, timestamp=None, label=None):
+        """Records an event (eg. a TLP pulse) samples can be aligned to, returns its index"""
+        with self.lock:
+            self.events.append((time.time() if timestamp == None else timestamp, label))
+            return len(self.events) - 1
+
+    def event_window(self, event=-1, before=0.0, after=1.0):
+        """
+        The samples around an event, with times relative to it
+
+        Args:
+            event (int) : [optional] default=-1
+                Index of the event, the last one by default
+            before, after (float) : [optional] [units seconds]
+                Time before and after the event included
+
+        Returns:
+            numpy array, numpy array, numpy array : times relative to the event, voltages, currents
+        """
+        event_time = self.events[event][0]
+        times, voltages, currents = self.window(event_time - before, event_time + after)
+        return times - event_time, voltages, currents
+
 
 class OscillaSMU():
     """
@@ -16,10 +133,30 @@ class OscillaSMU():
         scope_name : str
             ID string of scope connected
     """
-    def __init__(self, com_port=1):
+    def __init__(self, com_port=1, device_factory=None):
+        """
+        Initializes smu object with no connection.
+
+        Args:
+            com_port (str) : [optional]
+                The COM port the smu will connect to, eg. 'COM3'
+            device_factory (callable) : [optional]
+                Called with the com port to create the device, xtralien.Device is used if not provided.
+                Provide SimulatedInstruments.SimulatedSmuDevice to run without hardware
+        """
         self.com_port = com_port
         self.device = None
         self.device_name = "No Device Connected!"
+        if device_factory == None:
+            device_factory = xtralien.Device
+        self.device_factory = device_factory
+        # serialises commands of the streaming thread and the caller
+        self.lock = threading.RLock()
+        self.stream_buffer = None
+        self.stream_thread = None
+        self.stream_stop = threading.Event()
+        self.stream_errors = 0
+        self.stream_resyncs = 0
 
     
     def close(self):
@@ -32,13 +169,15 @@ class OscillaSMU():
         Returns:
             none
         """
+        self.stop_streaming()
         if self.device != None:
-            self.device['smu1'].set.voltage(0, response=0)
-            self.device['smu2'].set.voltage(0, response=0)
-            time.sleep(0.1)
-            self.device['smu1'].set.enabled(False, response=0)
-            self.device['smu2'].set.enabled(False, response=0)
-            self.device.close()
+            with self.lock:
+                self.device['smu1'].set.voltage(0, response=0)
+                self.device['smu2'].set.voltage(0, response=0)
+                time.sleep(0.1)
+                self.device['smu1'].set.enabled(False, response=0)
+                self.device['smu2'].set.enabled(False, response=0)
+                self.device.close()
             self.device = None
             self.device_name = "No Device Connected!"
             print("Device Disconnected")
@@ -67,7 +206,9 @@ class OscillaSMU():
             return False
         
         try:
-            self.device_name = "SMU"+str(self.device.cloi.version()) # pg. 6 smu programming guide
+            # the stream thread may have measure commands in flight
+            with self.lock:
+                self.device_name = "SMU"+str(self.device.cloi.version()) # pg. 6 smu programming guide
         except serial.serialutil.SerialException:
             print("Failed to get response from SMU")
             self.close(self)
@@ -106,18 +247,23 @@ class OscillaSMU():
             print("Invalid Com port Specified")
             return
 
+        # the stream of a previous connection must not outlive it
+        self.stop_streaming()
         self.device = None
         # try to connect to device
         try:
-            self.device = xtralien.Device(com_port)
+            self.device = self.device_factory(com_port)
         except serial.serialutil.SerialException:
             print("Failed to connect to COM" + str(com_port))
             return False
         
         self.com_port = com_port
+        # commands are timed while ScpiTrace.tracer is enabled
+        trace_xtralien_device(self.device, com_port)
 
         try:
-            self.device_name = "SMU"+str(self.device.cloi.version()) # pg. 6 smu programming guide
+            with self.lock:
+                self.device_name = "SMU"+str(self.device.cloi.version()) # pg. 6 smu programming guide
         except serial.serialutil.SerialException:
             print("Failed to get response from SMU")
             self.close(self)
@@ -130,6 +276,25 @@ class OscillaSMU():
         """disconnects from any connected SMUs"""
         self.close()
 
+    def connection_lost(self):
+        """
+        Drops the connection of an SMU that was unplugged, close() would try to zero the outputs of a device that is gone
+        """
+        if self.device == None:
+            return
+        # the stream thread must be out of connection.read() before the connection is closed
+        self.stream_stop.set()
+        if self.stream_thread != None and self.stream_thread is not threading.current_thread():
+            self.stream_thread.join(timeout=1.0)
+            self.stream_thread = None
+        try:
+            self.device.close()
+        except (serial.serialutil.SerialException, OSError):
+            pass
+        self.device = None
+        self.device_name = "No Device Connected!"
+        print("SMU on port " + str(self.com_port) + " lost")
+
     def make_measurement(self, voltage, channel="smu1"):
         """
         Given a provided voltage and optionally the channel (default is 'smu1') the smu takes a current and voltage reading
@@ -147,7 +312,8 @@ class OscillaSMU():
         """
         # TODO make check to ensure that provided voltage is within valid range
         try :
-            voltage, current = self.device[channel].oneshot(voltage)[0]
+            with self.lock:
+                voltage, current = self.device[channel].oneshot(voltage)[0]
         except serial.serialutil.SerialException:
             print("SMU: failed to make reading as device has been disconnected")
         return voltage, current
@@ -168,6 +334,219 @@ class OscillaSMU():
 
         """
         try:
-            self.device[channel].set.voltage(voltage, response=0)
+            with self.lock:
+                self.device[channel].set.voltage(voltage, response=0)
         except serial.serialutil.SerialException:
             print("SMU: failed to set voltage as device has been disconnected")
+
+    def set_enabled(self, enabled=True, channel='smu1'):
+        """
+        Turns the output of a channel on or off
+
+        Args:
+            enabled (boolean) : [optional]
+                default enabled=True
+            channel (str) : [optional]
+                default channel='smu1'
+                The channel, either 'smu1' or 'smu2'
+
+        Returns:
+            none
+
+        """
+        try:
+            with self.lock:
+                self.device[channel].set.enabled(enabled, response=0)
+        except serial.serialutil.SerialException:
+            print("SMU: failed to enable output as device has been disconnected")
+
+    def set_range(self, current_range, channel='smu1'):
+        """
+        Sets the current range of a channel, 1 (200 mA) to 5 (20 uA), see TestPlan.SMU_RANGES
+
+        Args:
+            current_range (int) :
+                The range, lower ranges measure larger currents
+            channel (str) : [optional]
+                default channel='smu1'
+                The channel, either 'smu1' or 'smu2'
+
+        Returns:
+            none
+
+        """
+        try:
+            with self.lock:
+                self.device[channel].set.range(int(current_range), response=0)
+        except serial.serialutil.SerialException:
+            print("SMU: failed to set range as device has been disconnected")
+
+    def start_streaming(self, channel='smu1', voltage=None, capacity=200000, batch=64, flush_interval=0.02, pipeline=8):
+        """
+        Measures a channel continuously on a background thread, as fast as the serial link allows, into stream_buffer.
+        The measure command is written to the connection directly, without the xtralien per command delay and response
+        formatting. pipeline commands (newline terminated, so they stay apart in the SMU's input buffer) are written
+        before their responses are read, so the link round trip is paid once per round instead of once per sample, and
+        the responses are parsed a batch at a time. Each sample is timestamped with time.time() halfway between the
+        earliest it can have been taken (its command written, the previous response received) and the arrival of its
+        response, so it can be aligned to pulse events, see mark_pulse() and pulse_window().
+        Other commands (eg. set_voltage()) can be sent while streaming, they are interleaved between rounds.
+
+        Args:
+            channel (str) : [optional]
+                default channel='smu1'
+                The channel, either 'smu1' or 'smu2'
+            voltage (float) : [optional] [units V]
+                Output voltage set before streaming starts, the current output is kept if not provided
+            capacity (int) : [optional]
+                default capacity=200000
+                Samples kept in stream_buffer, older samples are overwritten
+            batch (int) : [optional]
+                default batch=64
+                Responses parsed at once
+            flush_interval (float) : [optional] [units seconds]
+                default flush_interval=0.02
+                Longest time responses wait before they are parsed into stream_buffer
+            pipeline (int) : [optional]
+                default pipeline=8
+                Measure commands in flight per round, 1 waits for every response before the next command
+
+        Returns:
+            boolean : true if streaming started
+        """
+        if self.device == None:
+            print("SMU: cannot stream as no device is connected")
+            return False
+        self.stop_streaming()
+        if voltage != None:
+            self.set_voltage(voltage, channel)
+        self.stream_buffer = SampleRingBuffer(capacity)
+        self.stream_errors = 0
+        self.stream_resyncs = 0
+        self.stream_stop.clear()
+        self.stream_thread = threading.Thread(target=self._stream, args=(channel, int(batch), flush_interval, max(1, int(pipeline))),
+                                              name="smu-stream", daemon=True)
+        self.stream_thread.start()
+        return True
+
+    def stop_streaming(self):
+        """Stops streaming, stream_buffer keeps the samples taken"""
+        if self.stream_thread == None:
+            return
+        self.stream_stop.set()
+        self.stream_thread.join()
+        self.stream_thread = None
+
+    def streaming(self):
+        """Returns true while the streaming thread is running"""
+        return self.stream_thread != None and self.stream_thread.is_alive()
+
+    def _stream(self, channel, batch, flush_interval, pipeline):
+        connection = self.device.connections[0]
+        command = channel + " measure\n"
+        times = np.empty(batch + pipeline)
+        responses = []
+        received = 0.0
+        resync = False
+        flushed = time.perf_counter()
+        while not self.stream_stop.is_set():
+            # a whole round holds the lock, other commands must not read one of its responses
+            with self.lock:
+                try:
+                    written = time.time()
+                    for _ in range(pipeline):
+                        connection.write(command)
+                    for _ in range(pipeline):
+                        response = connection.read()
+                        arrived = time.time()
+                        times[len(responses)] = (max(written, received) + arrived) / 2
+                        received = arrived
+                        responses.append(response)
+                        # a read timeout ('') or a reply that is not a measurement shifts the replies that follow
+                        resync = resync or not response.startswith("[")
+                    if resync:
+                        self._drain(connection, pipeline)
+                        resync = False
+                except (serial.serialutil.SerialException, OSError, AttributeError):
+                    print("SMU: streaming stopped as device has been disconnected")
+                    break
+            if len(responses) >= batch or time.perf_counter() - flushed > flush_interval:
+                self._store(times, responses)
+                responses = []
+                flushed = time.perf_counter()
+        if len(responses):
+            self._store(times, responses)
+
+    def _drain(self, connection, limit):
+        """Drops replies until a read times out, so the next command gets its own reply again"""
+        self.stream_resyncs += 1
+        for _ in range(limit + 1):
+            if connection.read() == "":
+                return
+
+    def _store(self, times, responses):
+        """Parses a batch of '[voltage,current;]' responses into stream_buffer"""
+        count = len(responses)
+        text = "".join(responses).replace("[", "").replace(";]", ",")
+        try:
+            values = np.array(text.split(",")[:-1], dtype=float)
+        except ValueError:
+            values = None
+        if values is not None and len(values) == 2 * count:
+            self.stream_buffer.append(times[:count], values[0::2], values[1::2])
+            return
+        # a malformed response (eg. an error message), parse one at a time and drop the bad ones
+        kept = []
+        for index, response in enumerate(responses):
+            try:
+                voltage, current = response.strip().strip("[];").split(",")
+                kept.append((times[index], float(voltage), float(current)))
+            except ValueError:
+                self.stream_errors += 1
+        if len(kept):
+            kept = np.array(kept)
+            self.stream_buffer.append(kept[:, 0], kept[:, 1], kept[:, 2])
+
+    def mark_pulse(self, timestamp=None, label=None):
+        """
+        Records a pulse event (eg. a TLP pulse) in stream_buffer, streamed samples can be aligned to it with pulse_window()
+
+        Args:
+            timestamp (float) : [optional]
+                time.time() of the pulse, now if not provided
+            label (str) : [optional]
+                Stored with the event, eg. the pulse voltage
+
+        Returns:
+            int : index of the event
+        """
+        if self.stream_buffer == None:
+            raise ValueError("No SMU stream to mark, call start_streaming() first")
+        return self.stream_buffer.mark_event(timestamp, label)
+
+    def pulse_window(self, event=-1, before=0.0, after=1.0, wait=True):
+        """
+        The streamed samples around a pulse event, eg. the leakage current recovering after a TLP pulse
+
+        Args:
+            event (int) : [optional]
+                default event=-1
+                Index of the event returned by mark_pulse(), the last one by default
+            before, after (float) : [optional] [units seconds]
+                default before=0.0, after=1.0
+                Time before and after the pulse included
+            wait (boolean) : [optional]
+                default wait=True
+                Waits until the stream has passed the end of the window
+
+        Returns:
+            numpy array, numpy array, numpy array : times relative to the pulse [units seconds], voltages [units V],
+            currents [units A]
+        """
+        if self.stream_buffer == None:
+            raise ValueError("No SMU stream, call start_streaming() first")
+        end = self.stream_buffer.events[event][0] + after
+        # samples arrive in batches, wait for the first one past the end of the window
+        while wait and self.streaming() and self.stream_buffer.last_time() < end:
+            time.sleep(0.002)
+        return self.stream_buffer.event_window(event, before, after)
@@ -0,0 +1,184 @@
+import threading
+
+
+class PortRole():
+    """
+    USB identity of a device role, a serial port matches if every given field matches
+
+    Attributes:
+        name : str
+            The role, eg. "smu" or "teensy"
+        vid, pid : int
+            USB vendor and product id, None matches any
+        serial_number : str
+            USB serial number, None matches any. Set it to tell apart two devices with the same vid/pid
+        description : str
+            Case insensitive substring of the port description, None matches any
+    """
+
+    def __init__(self, name, vid=None, pid=None, serial_number=None, description=None):
+        self.name = name
+        self.vid = vid
+        self.pid = pid
+        self.serial_number = serial_number
+        self.description = description
+
+    def matches(self, port):
+        """
+        Args:
+            port (serial.tools.list_ports_common.ListPortInfo) :
+                A port as listed by list_ports.comports()
+
+        Returns:
+            boolean : true if the port belongs to this role
+        """
+        if self.vid == None and self.pid == None and self.serial_number == None and self.description == None:
+            return False
+        if self.vid != None and port.vid != self.vid:
+            return False
+        if self.pid != None and port.pid != self.pid:
+            return False
+        if self.serial_number != None and port.serial_number != self.serial_number:
+            return False
+        if self.description != None and self.description.lower() not in str(port.description).lower():
+            return False
+        return True
+
+
+# Teensy USB serial: PJRC vid 0x16C0, pid 0x0483 (https://www.pjrc.com/teensy/usb_serial.html)
+# Xtralien SMU: STM32 virtual COM port, check the vid/pid of your unit in the device manager and adjust if needed
+DEFAULT_ROLES = [
+    PortRole("teensy", vid=0x16C0, pid=0x0483),
+    PortRole("smu", vid=0x0483, pid=0x5740),
+]
+
+
+class PortWatcher():
+    """
+    Watches the serial ports in the background: the port list is enumerated on a thread and cached, so reading it is
+    free, and differences between enumerations (hotplug) are reported to callbacks per device role
+
+    Attributes:
+        roles : PortRole[]
+            Roles ports are matched against, the first matching role is used
+        interval : float [units seconds]
+            Time between enumerations
+        ports : dict
+            device (eg. 'COM3') -> port info of the last enumeration
+        role_ports : dict
+            role name -> device of the port currently matched to it
+    """
+
+    def __init__(self, roles=None, interval=1.0, on_added=None, on_removed=None, list_function=None):
+        """
+        Args:
+            roles (PortRole[]) : [optional]
+                Roles ports are matched against, DEFAULT_ROLES if not given
+            interval (float) : [optional] default=1.0 [units seconds]
+                Time between enumerations
+            on_added (callable) : [optional]
+                Called with (role name, port info) when a port of a role appears, role name is None for unknown ports
+            on_removed (callable) : [optional]
+                Called with (role name, port info) when a port disappears
+            list_function (callable) : [optional]
+                Returns the port infos, serial.tools.list_ports.comports if not given
+        """
+        self.roles = DEFAULT_ROLES if roles == None else roles
+        self.interval = interval
+        self.on_added = on_added
+        self.on_removed = on_removed
+        if list_function == None:
+            from serial.tools import list_ports
+            list_function = list_ports.comports
+        self.list_function = list_function
+        self.ports = {}
+        self.role_ports = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+
+    def start(self):
+        """Enumerates once, reporting ports already connected, then keeps watching on a background thread"""
+        if self.thread != None:
+            return
+        self.stop_event.clear()
+        self.scan()
+        self.thread = threading.Thread(target=self._run, name="PortWatcher", daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        if self.thread == None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+
+    def role_of(self, port):
+        """Returns the name of the first role the port matches, None if it matches none"""
+        for role in self.roles:
+            if role.matches(port):
+                return role.name
+        return None
+
+
+    def scan(self):
+        """
+        Enumerates the ports now and reports the differences to the last enumeration
+
+        Returns:
+            list of (role name, port info) added, list of (role name, port info) removed
+        """
+        try:
+            current = {port.device: port for port in self.list_function()}
+        except OSError as error:
+            print("Serial port enumeration failed: " + repr(error))
+            return [], []
+
+        with self.lock:
+            added = [current[device] for device in current if device not in self.ports]
+            removed = [self.ports[device] for device in self.ports if device not in current]
+            self.ports = current
+            added = [(self.role_of(port), port) for port in added]
+            removed = [(self.role_of(port), port) for port in removed]
+            # roles keep their port while it exists, a role that lost its port takes another matching one
+            self.role_ports = {role: device for role, device in self.role_ports.items() if device in current}
+            for device in sorted(current):
+                role = self.role_of(current[device])
+                if role != None and role not in self.role_ports:
+                    self.role_ports[role] = device
+
+        # removals first so a replugged device that comes back under a new name is reconnected
+        for role, port in removed:
+            self._notify(self.on_removed, role, port)
+        for role, port in added:
+            self._notify(self.on_added, role, port)
+        return added, removed
+
+
+    def port_names(self):
+        """Returns the cached port names (eg. 'COM3'), sorted"""
+        with self.lock:
+            return sorted(port.name for port in self.ports.values())
+
+
+    def port_for(self, role):
+        """Returns the device of the port matched to a role, None if no such device is connected"""
+        with self.lock:
+            return self.role_ports.get(role)
+
+
+    def _notify(self, callback, role, port):
+        if callback == None:
+            return
+        try:
+            callback(role, port)
+        except Exception as error:
+            print("Port watcher callback failed for " + str(port.device) + ": " + repr(error))
+
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.scan()
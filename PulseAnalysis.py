@@ -0,0 +1,215 @@
+"""
+Vectorized analysis of captured TLP pulses (levels, edges, rise time, plateau mean).
+Functions take numpy arrays of sample times [s] and voltages [V] as returned by Oscilloscope.record_waveform()
+"""
+import numpy as np
+
+
+def pulse_levels(voltages):
+    """
+    Finds the base and top level of a pulse, the medians of the samples below and above the mid point of the range
+
+    Args:
+        voltages (numpy array) :
+            The waveform samples
+
+    Returns:
+        float, float : base, top voltage
+    """
+    low = float(np.min(voltages))
+    high = float(np.max(voltages))
+    middle = (low + high) / 2
+    below = voltages[voltages <= middle]
+    above = voltages[voltages > middle]
+    base = float(np.median(below)) if len(below) else low
+    top = float(np.median(above)) if len(above) else high
+    return base, top
+
+
+def crossing_index(samples, level, rising=True, start_index=0):
+    """
+    Finds the first sample position the waveform crosses a level after start_index, linearly interpolated between
+    samples. Works on raw integer codes as well as voltages
+
+    Args:
+        samples (numpy array) :
+            The waveform samples
+        level (float) :
+            The level in the units of the samples
+        rising (boolean) : [optional] default=True
+            Looks for a rising crossing if true, falling if false
+        start_index (int) : [optional]
+            Sample index the search starts from
+
+    Returns:
+        float, int : fractional sample position of the crossing and the index of the sample after it, None, -1 if there
+        is no crossing
+    """
+    above = samples[start_index:] >= level
+    if rising:
+        crossings = np.flatnonzero(~above[:-1] & above[1:])
+    else:
+        crossings = np.flatnonzero(above[:-1] & ~above[1:])
+    if len(crossings) == 0:
+        return None, -1
+    index = int(crossings[0]) + start_index
+    v0, v1 = float(samples[index]), float(samples[index + 1])
+    fraction = (level - v0) / (v1 - v0) if v1 != v0 else 0.0
+    return index + fraction, index + 1
+
+
+def crossing_time(times, voltages, level, rising=True, start_index=0):
+    """
+    Finds the first time the waveform crosses a level after start_index, linearly interpolated between samples
+
+    Args:
+        times (numpy array) :
+            The sample times
+        voltages (numpy array) :
+            The waveform samples
+        level (float) :
+            The voltage level
+        rising (boolean) : [optional] default=True
+            Looks for a rising crossing if true, falling if false
+        start_index (int) : [optional]
+            Sample index the search starts from
+
+    Returns:
+        float, int : crossing time and the index of the sample after the crossing, None, -1 if there is no crossing
+    """
+    position, index = crossing_index(voltages, level, rising, start_index)
+    if position is None:
+        return None, -1
+    t0, t1 = float(times[index - 1]), float(times[index])
+    return t0 + (position - (index - 1)) * (t1 - t0), index
+
+
+def find_edge_indices(samples, fraction=0.5, max_crossings=4, inverted=False):
+    """
+    Finds the rising and falling edge of a pulse as fractional sample positions, see find_edges(). Runs on raw integer
+    codes without converting them to voltages: the level is a fraction of the amplitude, so it is the same for any
+    linear scaling of the samples
+
+    Args:
+        samples (numpy array) :
+            The waveform samples or raw codes
+        fraction (float) : [optional] default=0.5
+            Fraction of the amplitude (base to top) the edges are measured at
+        max_crossings (int) : [optional] default=4
+            Most rising crossings of the level accepted as one (noisy) pulse
+        inverted (boolean) : [optional] default=False
+            Specifies if the samples fall as the voltage rises (codes of a negative gain)
+
+    Returns:
+        float, float : rising and falling edge positions, None for an edge that was not found
+    """
+    base, top = pulse_levels(samples)
+    if inverted:
+        base, top = top, base
+    level = base + fraction * (top - base)
+    above = samples >= level
+    if inverted:
+        rising_crossings = np.count_nonzero(above[:-1] & ~above[1:])
+    else:
+        rising_crossings = np.count_nonzero(~above[:-1] & above[1:])
+    if rising_crossings > max_crossings:
+        return None, None
+    rising, index = crossing_index(samples, level, rising=not inverted)
+    if rising is None:
+        return None, None
+    falling, _ = crossing_index(samples, level, rising=inverted, start_index=index)
+    return rising, falling
+
+
+def find_edges(times, voltages, fraction=0.5, max_crossings=4):
+    """
+    Finds the rising and falling edge of a pulse at a fraction of its amplitude.
+    A waveform crossing the level more than max_crossings times is noise rather than a pulse.
+
+    Args:
+        times (numpy array) :
+            The sample times
+        voltages (numpy array) :
+            The waveform samples
+        fraction (float) : [optional] default=0.5
+            Fraction of the amplitude (base to top) the edges are measured at
+        max_crossings (int) : [optional] default=4
+            Most rising crossings of the level accepted as one (noisy) pulse
+
+    Returns:
+        float, float : rising and falling edge times, None for an edge that was not found
+    """
+    rising, falling = find_edge_indices(voltages, fraction, max_crossings)
+    return sample_time(times, rising), sample_time(times, falling)
+
+
+def sample_time(times, position):
+    """Interpolates the time of a fractional sample position, None stays None"""
+    if position is None:
+        return None
+    index = min(int(position), len(times) - 2)
+    t0, t1 = float(times[index]), float(times[index + 1])
+    return t0 + (position - index) * (t1 - t0)
+
+
+def rise_time(times, voltages, low=0.1, high=0.9):
+    """
+    Measures the rise time of the first rising edge between two fractions of the amplitude (10-90 by default)
+
+    Returns:
+        float : rise time in seconds, nan if the edge was not found
+    """
+    base, top = pulse_levels(voltages)
+    low_time, index = crossing_time(times, voltages, base + low * (top - base), rising=True)
+    if low_time is None:
+        return float("nan")
+    high_time, _ = crossing_time(times, voltages, base + high * (top - base), rising=True, start_index=max(index - 1, 0))
+    if high_time is None:
+        return float("nan")
+    return high_time - low_time
+
+
+def gate_indices(times, gate_start=None, gate_stop=None):
+    """Returns the start and stop sample index of a time gate, the full waveform if no gate is given"""
+    start = 0 if gate_start is None else int(np.searchsorted(times, gate_start, side="left"))
+    stop = len(times) if gate_stop is None else int(np.searchsorted(times, gate_stop, side="right"))
+    return start, max(stop, start)
+
+
+def pulse_summary(times, voltages, gate_start=None, gate_stop=None, plateau_start=None, plateau_stop=None):
+    """
+    Computes the pulse scalars used per sweep step. Amplitude and rise time are taken inside the gate around the pulse,
+    the mean inside the plateau window (the gate if no plateau window is given)
+
+    Args:
+        times (numpy array) :
+            The sample times
+        voltages (numpy array) :
+            The waveform samples
+        gate_start (float) : [optional]
+            Start of the pulse gate in seconds, start of the waveform if not given
+        gate_stop (float) : [optional]
+            Stop of the pulse gate in seconds, end of the waveform if not given
+        plateau_start (float) : [optional]
+            Start of the plateau window in seconds
+        plateau_stop (float) : [optional]
+            Stop of the plateau window in seconds
+
+    Returns:
+        dict : amplitude [V], mean [V], rise_time [s], nan for values that could not be measured
+    """
+    nan = float("nan")
+    start, stop = gate_indices(times, gate_start, gate_stop)
+    if stop - start < 2:
+        amplitude = pulse_rise_time = nan
+    else:
+        base, top = pulse_levels(voltages[start:stop])
+        amplitude = top - base
+        pulse_rise_time = rise_time(times[start:stop], voltages[start:stop])
+
+    if plateau_start is None and plateau_stop is None:
+        plateau_start, plateau_stop = gate_start, gate_stop
+    start, stop = gate_indices(times, plateau_start, plateau_stop)
+    mean = float(np.mean(voltages[start:stop])) if stop > start else nan
+
+    return {"amplitude": amplitude, "mean": mean, "rise_time": pulse_rise_time}
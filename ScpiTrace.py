@@ -0,0 +1,412 @@
+"""
+Optional per-command latency instrumentation for the instrument links.
+
+Every VISA resource opened by VisaResource.connect() and every xtralien connection opened by OscillaSMU.connect() is
+wrapped so that write/query/read_raw (VISA) and command round trips (SMU serial) are timed while tracing is enabled.
+While disabled the wrappers forward straight to the instrument with a single flag check, so they can stay installed.
+
+Usage:
+    import ScpiTrace
+    ScpiTrace.tracer.enable()
+    ... run a sweep ...
+    print(ScpiTrace.tracer.summary())
+    ScpiTrace.tracer.export_chrome_trace("trace.json")   # open in chrome://tracing or https://ui.perfetto.dev
+"""
+import collections
+import contextlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+
+# log spaced latency histogram, HISTOGRAM_BINS_PER_DECADE bins per decade from 1us to 100s
+HISTOGRAM_MIN_EXPONENT = -6
+HISTOGRAM_MAX_EXPONENT = 2
+HISTOGRAM_BINS_PER_DECADE = 10
+HISTOGRAM_BIN_COUNT = (HISTOGRAM_MAX_EXPONENT - HISTOGRAM_MIN_EXPONENT) * HISTOGRAM_BINS_PER_DECADE
+
+
+def histogram_bin(duration):
+    """Returns the histogram bin index of a duration in seconds"""
+    if duration <= 0:
+        return 0
+    index = int((math.log10(duration) - HISTOGRAM_MIN_EXPONENT) * HISTOGRAM_BINS_PER_DECADE)
+    return min(max(index, 0), HISTOGRAM_BIN_COUNT - 1)
+
+
+def histogram_bin_edge(index):
+    """Returns the lower edge in seconds of a histogram bin"""
+    return 10 ** (HISTOGRAM_MIN_EXPONENT + index / HISTOGRAM_BINS_PER_DECADE)
+
+
+def command_keyword(command):
+    """
+    Reduces a command to the keyword used to group statistics, arguments are dropped
+    eg. 'TRIG:LEVel1 0.5' -> 'TRIG:LEVel1', 'smu1 oneshot 1.0' -> 'smu1 oneshot'
+    """
+    tokens = str(command).strip().split()
+    if len(tokens) == 0:
+        return ""
+    if tokens[0].startswith(("smu", "cloi", "vsense", "osc", "mux")):
+        return " ".join(tokens[:2])
+    return tokens[0]
+
+
+class CommandStatistics():
+    """
+    Aggregated statistics of one (device, operation, command keyword)
+
+    Attributes:
+        count : int
+            Number of calls recorded
+        total_time : float [units seconds]
+            Sum of all call durations
+        max_time : float [units seconds]
+            Longest call duration
+        total_bytes : int
+            Bytes transferred (sent and received)
+        histogram : int[]
+            Call counts per log spaced latency bin, see histogram_bin()
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.total_bytes = 0
+        self.histogram = [0] * HISTOGRAM_BIN_COUNT
+
+    def add(self, duration, nbytes):
+        self.count += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.total_bytes += nbytes
+        self.histogram[histogram_bin(duration)] += 1
+
+    def percentile(self, fraction):
+        """Estimates a latency percentile (fraction 0 to 1) from the histogram, returns the upper edge of the bin"""
+        if self.count == 0:
+            return 0.0
+        target = fraction * self.count
+        running = 0
+        for index, bin_count in enumerate(self.histogram):
+            running += bin_count
+            if running >= target:
+                return min(histogram_bin_edge(index + 1), self.max_time)
+        return self.max_time
+
+
+class CommandTracer():
+    """
+    Collects timed instrument commands into per command statistics and a bounded timeline of events
+
+    Attributes:
+        enabled : boolean
+            Commands are only recorded while enabled
+        events : deque
+            Most recent events (device, operation, command, start, duration, bytes, caller, thread id), bounded by max_events
+        statistics : dict
+            CommandStatistics keyed by (device, operation, command keyword)
+    """
+
+    def __init__(self, max_events=100000):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.epoch = time.perf_counter()
+        self.events = collections.deque(maxlen=max_events)
+        self.statistics = {}
+
+    def enable(self, max_events=None):
+        """
+        Starts recording commands
+
+        Args:
+            max_events (int) : [optional]
+                Changes the number of timeline events kept, oldest events are dropped first
+        """
+        if max_events != None:
+            with self.lock:
+                self.events = collections.deque(self.events, maxlen=max_events)
+        self.enabled = True
+
+    def disable(self):
+        """Stops recording commands, collected data is kept"""
+        self.enabled = False
+
+    def reset(self):
+        """Clears all collected events and statistics"""
+        with self.lock:
+            self.events.clear()
+            self.statistics = {}
+            self.epoch = time.perf_counter()
+
+    def record(self, device, operation, command, start, duration, nbytes, caller=None):
+        """
+        Records one timed command, called by the instrument wrappers
+
+        Args:
+            device (str) :
+                Label of the instrument (VISA resource name or COM port)
+            operation (str) :
+                'write', 'query', 'read_raw', 'command' or 'host'
+            command (str) :
+                The command sent to the instrument
+            start (float) :
+                time.perf_counter() at the start of the call
+            duration (float) : [units seconds]
+                Duration of the call
+            nbytes (int) :
+                Bytes transferred by the call
+            caller (str) : [optional]
+                The driver function that made the call, found from the stack if not provided
+        """
+        if caller == None:
+            caller = find_caller()
+        keyword = command_keyword(command)
+        with self.lock:
+            statistics = self.statistics.get((device, operation, keyword))
+            if statistics == None:
+                statistics = self.statistics[(device, operation, keyword)] = CommandStatistics()
+            statistics.add(duration, nbytes)
+            self.events.append((device, operation, str(command), start, duration, nbytes, caller, threading.get_ident()))
+
+    def span(self, device, name):
+        """
+        Context manager timing a block of host side work (eg. parsing) so it shows next to instrument time
+
+        Args:
+            device (str) :
+                Label the work is grouped under eg. 'host'
+            name (str) :
+                Name of the work
+
+        Returns:
+            context manager : does nothing while the tracer is disabled
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._span(device, name)
+
+    @contextlib.contextmanager
+    def _span(self, device, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(device, "host", name, start, time.perf_counter() - start, 0)
+
+    def summary(self):
+        """
+        Summarizes the collected statistics
+
+        Returns:
+            list of dict : one entry per (device, operation, command) sorted by total time, slowest first
+        """
+        with self.lock:
+            items = list(self.statistics.items())
+        report = []
+        for (device, operation, keyword), statistics in items:
+            report.append({
+                "device": device,
+                "operation": operation,
+                "command": keyword,
+                "count": statistics.count,
+                "total_s": statistics.total_time,
+                "mean_s": statistics.total_time / statistics.count,
+                "p50_s": statistics.percentile(0.5),
+                "p95_s": statistics.percentile(0.95),
+                "max_s": statistics.max_time,
+                "bytes": statistics.total_bytes,
+            })
+        report.sort(key=lambda entry: entry["total_s"], reverse=True)
+        return report
+
+    def histograms(self):
+        """
+        Returns the latency histograms
+
+        Returns:
+            dict : keyed by 'device operation command', values are lists of (bin lower edge in seconds, count) for non empty bins
+        """
+        with self.lock:
+            items = list(self.statistics.items())
+        return {
+            " ".join(key): [(histogram_bin_edge(index), count) for index, count in enumerate(statistics.histogram) if count]
+            for key, statistics in items
+        }
+
+    def chrome_trace(self):
+        """
+        Builds the collected timeline in Chrome trace-event format, one track per instrument
+
+        Returns:
+            dict : the trace, serializable with json
+        """
+        with self.lock:
+            events = list(self.events)
+            epoch = self.epoch
+        pid = os.getpid()
+        tracks = {}
+        trace_events = []
+        for device, operation, command, start, duration, nbytes, caller, thread_id in events:
+            if device not in tracks:
+                tracks[device] = len(tracks) + 1
+                trace_events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tracks[device],
+                                     "args": {"name": device}})
+            trace_events.append({
+                "name": command_keyword(command),
+                "cat": operation,
+                "ph": "X",
+                "pid": pid,
+                "tid": tracks[device],
+                "ts": (start - epoch) * 1E6,
+                "dur": duration * 1E6,
+                "args": {"command": command, "bytes": nbytes, "caller": caller, "thread": thread_id},
+            })
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path="./scpi_trace.json"):
+        """
+        Writes the collected timeline to a Chrome trace-event JSON file (chrome://tracing, https://ui.perfetto.dev)
+
+        Args:
+            path (str) : [optional]
+                The save path location and file name
+        """
+        with open(path, "w") as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
+
+
+# frames from these files are skipped when looking for the caller of an instrument command
+_INTERNAL_FILES = ("ScpiTrace.py", "xtralien", "contextlib.py")
+
+
+def find_caller():
+    """Returns 'function (file:line)' of the first stack frame outside the tracing and instrument libraries"""
+    frame = sys._getframe(2)
+    while frame is not None and any(name in frame.f_code.co_filename for name in _INTERNAL_FILES):
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    code = frame.f_code
+    function = getattr(code, "co_qualname", code.co_name)
+    return f"{function} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+# shared tracer used by all instrument wrappers
+tracer = CommandTracer()
+
+
+class TracedVisaResource():
+    """
+    Wraps a pyvisa resource timing write, query and read_raw while the tracer is enabled.
+    All other attributes are forwarded to the wrapped resource.
+    """
+
+    def __init__(self, resource, label=None, command_tracer=None):
+        self.wrapped = resource
+        self.label = label if label != None else str(getattr(resource, "resource_name", "visa"))
+        self.tracer = command_tracer if command_tracer != None else tracer
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def __setattr__(self, name, value):
+        # settings such as timeout belong to the wrapped resource
+        if name in ("wrapped", "label", "tracer"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.wrapped, name, value)
+
+    def write(self, command, *args, **kwargs):
+        if not self.tracer.enabled:
+            return self.wrapped.write(command, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return self.wrapped.write(command, *args, **kwargs)
+        finally:
+            self.tracer.record(self.label, "write", command, start, time.perf_counter() - start, len(command) + 1)
+
+    def query(self, command, *args, **kwargs):
+        if not self.tracer.enabled:
+            return self.wrapped.query(command, *args, **kwargs)
+        start = time.perf_counter()
+        response = ""
+        try:
+            response = self.wrapped.query(command, *args, **kwargs)
+            return response
+        finally:
+            self.tracer.record(self.label, "query", command, start, time.perf_counter() - start,
+                               len(command) + 1 + len(response))
+
+    def read_raw(self, *args, **kwargs):
+        if not self.tracer.enabled:
+            return self.wrapped.read_raw(*args, **kwargs)
+        start = time.perf_counter()
+        data = b""
+        try:
+            data = self.wrapped.read_raw(*args, **kwargs)
+            return data
+        finally:
+            self.tracer.record(self.label, "read_raw", "read_raw", start, time.perf_counter() - start, len(data))
+
+
+class TracedSerialConnection():
+    """
+    Wraps a xtralien connection, a command is timed from its write until the matching read returns. Writes wait in a
+    FIFO, so pipelined commands (several writes before their reads) are matched to their own replies.
+    All other attributes are forwarded to the wrapped connection.
+    """
+
+    def __init__(self, connection, label=None, command_tracer=None):
+        self.wrapped = connection
+        self.label = label if label != None else repr(connection)
+        self.tracer = command_tracer if command_tracer != None else tracer
+        # (command, write time) of the writes whose reply was not read yet, oldest first
+        self.pending = collections.deque()
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def write(self, cmd):
+        # every write is queued, so the FIFO stays in step when tracing is turned on with commands in flight
+        self.pending.append((cmd, time.perf_counter() if self.tracer.enabled else None))
+        return self.wrapped.write(cmd)
+
+    def read(self, wait=True):
+        response = self.wrapped.read(wait)
+        if not self.pending:
+            return response
+        cmd, start = self.pending.popleft()
+        if start is not None:
+            command = str(cmd, "utf-8") if isinstance(cmd, bytes) else cmd
+            self.tracer.record(self.label, "command", command.strip(), start, time.perf_counter() - start,
+                               len(cmd) + len(response or ""))
+        return response
+
+    def close(self):
+        return self.wrapped.close()
+
+
+def trace_xtralien_device(device, label=None, command_tracer=None):
+    """
+    Wraps every connection of a xtralien.Device so its commands are traced
+
+    Args:
+        device (xtralien.Device) :
+            The connected device
+        label (str) : [optional]
+            Label of the device in the trace, eg. the COM port
+
+    Returns:
+        xtralien.Device : the same device
+    """
+    device.connections = [
+        connection if isinstance(connection, TracedSerialConnection)
+        else TracedSerialConnection(connection, label, command_tracer)
+        for connection in device.connections
+    ]
+    return device
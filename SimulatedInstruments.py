@@ -0,0 +1,932 @@
+"""
+Simulated instrument backends so the drivers (VisaResource, Oscilloscope, OscillaSMU) can run without hardware.
+
+The scope side is an in-process stand in for a pyvisa ResourceManager, provide it where a pyvisa resource manager is expected:
+    scope = Oscilloscope(SimulatedResourceManager())
+
+The SMU side builds a real xtralien.Device with a simulated serial connection, provide it as the OscillaSMU device factory:
+    smu = OscillaSMU("COM3", device_factory=SimulatedSmuDevice)
+
+The VNA and spectrum analyzer are further simulated VISA resources, register them with the resource manager:
+    analyzer = SpectrumAnalyzer(SimulatedResourceManager({SIMULATED_SPECTRUM_ID: SimulatedSpectrumAnalyzerResource}))
+
+The relay controller firmware runs on a pseudo-terminal (POSIX only), connect the real driver to its port:
+    teensy = SimulatedTeensy()
+    controller = TeensyController(teensy.port)
+"""
+import collections
+import os
+import re
+import select
+import time
+import threading
+import numpy as np
+import xtralien
+
+from PulseAnalysis import pulse_summary
+from TeensyController import (FrameDecoder, encode_frame, unwrap_seq, ACK_FLAG, CMD_PING, CMD_VERSION, CMD_SET_RELAYS, CMD_GET_RELAYS,
+                              STATUS_OK, STATUS_BAD_COMMAND, STATUS_BAD_PAYLOAD)
+
+
+SIMULATED_SCOPE_ID = "TCPIP0::192.168.0.2::inst0::INSTR"
+SIMULATED_VNA_ID = "TCPIP0::192.168.0.3::inst0::INSTR"
+SIMULATED_SPECTRUM_ID = "USB0::0x1AB1::0x0960::DSA8A000000001::INSTR"
+
+
+class SimulatedScpiResource():
+    """
+    Base of the simulated message based resources: dispatches SCPI commands to a handler table and models the
+    command latency and transfer rate. Subclasses fill handlers with (compiled pattern, handler) pairs, a handler
+    receives the regex match of the header and the argument string and returns the response (bytes are read with
+    read_raw). Unhandled settings are stored and answered when queried.
+    """
+
+    def __init__(self, resource_name, command_latency=0.0, transfer_rate=None):
+        self.resource_name = resource_name
+        self.command_latency = command_latency
+        self.transfer_rate = transfer_rate
+        self.timeout = 2000
+        self.settings = {}
+        self.pending_read = b""
+        self.closed = False
+        self.handlers = []
+
+
+    def close(self):
+        self.closed = True
+
+
+    def write(self, command):
+        """Handles a SCPI command, returns the number of bytes written as pyvisa does"""
+        self._latency()
+        self._dispatch(command)
+        return len(command) + 1
+
+
+    def query(self, command):
+        """Handles a SCPI query, returns the response string"""
+        self._latency()
+        response = self._dispatch(command)
+        if response is None:
+            return ""
+        return str(response) + "\n"
+
+
+    def read_raw(self, size=None):
+        """Returns the pending binary response of the last data query"""
+        data = self.pending_read
+        self.pending_read = b""
+        if self.transfer_rate:
+            time.sleep(len(data) / self.transfer_rate)
+        return data
+
+
+    def _latency(self):
+        if self.command_latency > 0:
+            time.sleep(self.command_latency)
+
+
+    def _dispatch(self, command):
+        command = str(command).strip()
+        header, _, args = command.partition(" ")
+        header = header.upper().lstrip(":")
+        for pattern, handler in self.handlers:
+            match = pattern.fullmatch(header)
+            if match:
+                response = handler(match, args.strip())
+                # data queries hand back their result through read_raw
+                if isinstance(response, bytes):
+                    self.pending_read = response
+                    return None
+                return response
+        # unhandled settings are stored so queries of them are answered
+        if header.endswith("?"):
+            return self.settings.get(header[:-1], "0")
+        self.settings[header] = args.strip()
+        return None
+
+
+class SimulatedScopeResource(SimulatedScpiResource):
+    """
+    In-process stand in for a pyvisa message based resource connected to a R&S RTO6 oscilloscope.
+    Answers the subset of SCPI used by the Oscilloscope driver and produces synthetic TLP pulses for waveform reads.
+
+    Attributes:
+        resource_name : str
+            The VISA resource name the resource was opened with
+        record_length : int
+            Number of waveform points returned per acquisition (ACQuire:POINts)
+        acquisition_time : float [units seconds]
+            Time span of one acquisition (TIMebase:RANGe)
+        trigger_delay : float [units seconds]
+            Time between SINGle and the scope leaving the measuring state
+        command_latency : float [units seconds]
+            Time spent on every write/query, models the network round trip
+        transfer_rate : float [units bytes/second]
+            Throughput of read_raw, None for instantaneous transfers
+        pulse_amplitude : float [units volts]
+            Plateau voltage of the synthetic TLP pulse
+        pulse_width : float [units seconds]
+            Plateau width of the synthetic TLP pulse
+        pulse_rise_time : float [units seconds]
+            10-90 rise (and fall) time of the synthetic TLP pulse
+        pulse_delay : float [units seconds]
+            Start of the pulse edge relative to the trigger point (time 0)
+        noise : float [units volts]
+            Standard deviation of the gaussian noise added to the waveform
+    """
+
+    IDN = "Rohde&Schwarz,RTO6,1802.0001k04/100000,5.50.1.0 (SIMULATED)"
+
+    # bit 4 of the operation condition register is set while the scope is acquiring (pg. 2884-2885)
+    MEASURING_BIT = 0b10000
+
+    def __init__(self, resource_name=SIMULATED_SCOPE_ID, record_length=10000, acquisition_time=1E-6, trigger_delay=0.0,
+                 command_latency=0.0, transfer_rate=None, pulse_amplitude=5.0, pulse_width=100E-9, pulse_rise_time=1E-9,
+                 pulse_delay=0.0, noise=0.01, seed=None):
+        super().__init__(resource_name, command_latency, transfer_rate)
+        self.record_length = int(record_length)
+        self.acquisition_time = float(acquisition_time)
+        self.trigger_delay = trigger_delay
+        self.pulse_amplitude = pulse_amplitude
+        self.pulse_width = pulse_width
+        self.pulse_rise_time = pulse_rise_time
+        self.pulse_delay = pulse_delay
+        self.noise = noise
+
+        self.rng = np.random.default_rng(seed)
+        self.data_format = "REAL,32"
+        self.average_count = 1
+        self.averaging = False
+        self.vertical = {}
+        self.measurements = {}
+        self.armed_at = None
+        self.waveform = None
+
+        # (compiled pattern, handler) checked in order, handlers receive the regex match and the argument string
+        self.handlers = [
+            (r"\*IDN\?", lambda match, args: self.IDN),
+            (r"\*RST|SYST(EM)?:PRES(ET)?", self._preset),
+            (r"\*OPC\?", lambda match, args: "1"),
+            (r"TIM(EBASE)?:RANG(E)?", self._set_acquisition_time),
+            (r"TIM(EBASE)?:RANG(E)?\?", lambda match, args: repr(self.acquisition_time)),
+            (r"ACQ(UIRE)?:POIN(TS)?(:VAL(UE)?)?", self._set_record_length),
+            (r"ACQ(UIRE)?:POIN(TS)?(:VAL(UE)?)?\?", lambda match, args: str(self.record_length)),
+            (r"ACQ(UIRE)?:COUN(T)?", self._set_average_count),
+            (r"ACQ(UIRE)?:COUN(T)?\?", lambda match, args: str(self.average_count)),
+            (r"CHAN(NEL)?(\d)?(:WAV(EFORM)?(\d)?)?:ARIT(HMETICS)?", self._set_arithmetics),
+            (r"SING(LE)?", self._arm),
+            (r"RUN", self._arm),
+            (r"STOP", self._stop),
+            (r"STAT(US)?:OPER(ATION)?:COND(ITION)?\?", self._operation_condition),
+            (r"FORM(AT)?(:DATA)?", self._set_format),
+            (r"FORM(AT)?(:DATA)?\?", lambda match, args: self.data_format),
+            (r"CHAN(NEL)?(\d)?:(SCAL(E)?|OFFS(ET)?|POS(ITION)?)", self._set_vertical),
+            (r"CHAN(NEL)?(\d)?:(SCAL(E)?|OFFS(ET)?|POS(ITION)?)\?", self._get_vertical),
+            (r"MEAS(UREMENT)?(\d*):RES(ULT)?(:ACT(UAL)?)?\?", self._measurement_result),
+            (r"MEAS(UREMENT)?(\d*):(.+)", self._set_measurement),
+            (r"CHAN(NEL)?(\d)?(:WAV(EFORM)?(\d)?)?:DATA:HEAD(ER)?\?", self._data_header),
+            (r"CHAN(NEL)?(\d)?(:WAV(EFORM)?(\d)?)?:DATA(:VAL(UES)?)?\?", self._data_values),
+        ]
+        self.handlers = [(re.compile(pattern), handler) for pattern, handler in self.handlers]
+
+
+    def _preset(self, match, args):
+        self.settings = {}
+        self.data_format = "REAL,32"
+        self.average_count = 1
+        self.averaging = False
+        self.vertical = {}
+        self.measurements = {}
+        self.armed_at = None
+
+
+    def _set_average_count(self, match, args):
+        self.average_count = min(max(int(float(args)), 1), 16777215)
+
+
+    def _set_arithmetics(self, match, args):
+        self.averaging = args.upper().startswith("AVER")
+
+
+    def _set_acquisition_time(self, match, args):
+        self.acquisition_time = min(max(float(args), 250E-12), 50E3)
+
+
+    def _set_record_length(self, match, args):
+        self.record_length = min(max(int(float(args)), 1000), 1000000000)
+
+
+    def _arm(self, match, args):
+        self.armed_at = time.perf_counter()
+        self.waveform = None
+
+
+    def _stop(self, match, args):
+        self.armed_at = None
+
+
+    def _operation_condition(self, match, args):
+        # a SINGle acquires ACQuire:COUNt waveforms
+        if self.armed_at is not None and time.perf_counter() - self.armed_at < self.trigger_delay * self.average_count:
+            return str(self.MEASURING_BIT)
+        return "0"
+
+
+    def _set_format(self, match, args):
+        self.data_format = args.upper().replace(" ", "")
+
+
+    # vertical setup after preset, chosen so the default pulse fits on screen (-1 V to 9 V)
+    DEFAULT_VERTICAL = {"SCALE": 1.0, "OFFSET": 0.0, "POSITION": -4.0}
+
+    def vertical_setting(self, channel, name):
+        return self.vertical.get((channel, name), self.DEFAULT_VERTICAL[name])
+
+
+    def _vertical_name(self, match):
+        name = match.group(3)
+        for full in self.DEFAULT_VERTICAL:
+            if full.startswith(name):
+                return full
+
+
+    def _set_vertical(self, match, args):
+        self.vertical[(int(match.group(2) or 1), self._vertical_name(match))] = float(args)
+
+
+    def _get_vertical(self, match, args):
+        return repr(self.vertical_setting(int(match.group(2) or 1), self._vertical_name(match)))
+
+
+    def time_window(self):
+        """
+        Returns the start and stop time of the acquisition, the trigger point sits in the middle of the acquisition
+
+        Returns:
+            float, float : start and stop time in seconds
+        """
+        return -self.acquisition_time / 2, self.acquisition_time / 2
+
+
+    def export_range(self):
+        """
+        Returns the sample range exported by data queries, the whole record unless a manual export window is set
+        (EXPort:WAVeform:SCOPe MANual with EXPort:WAVeform:STARt/STOP)
+
+        Returns:
+            int, int : start index and stop index (exclusive) of the exported samples
+        """
+        if not self.settings.get("EXP:WAV:SCOP", self.settings.get("EXPORT:WAVEFORM:SCOPE", "WFM")).upper().startswith("MAN"):
+            return 0, self.record_length
+        start, stop = self.time_window()
+        export_start = float(self.settings.get("EXPORT:WAVEFORM:START", self.settings.get("EXP:WAV:STAR", start)))
+        export_stop = float(self.settings.get("EXPORT:WAVEFORM:STOP", self.settings.get("EXP:WAV:STOP", stop)))
+        resolution = (stop - start) / (self.record_length - 1)
+        first = int(np.clip(np.ceil((export_start - start) / resolution - 1E-9), 0, self.record_length - 1))
+        last = int(np.clip(np.floor((export_stop - start) / resolution + 1E-9), first, self.record_length - 1))
+        return first, last + 1
+
+
+    def _data_header(self, match, args):
+        start, stop = self.time_window()
+        first, last = self.export_range()
+        resolution = (stop - start) / (self.record_length - 1)
+        return f"{start + first * resolution:.9E},{start + (last - 1) * resolution:.9E},{last - first},1"
+
+
+    def synthesize_waveform(self):
+        """
+        Builds a synthetic TLP pulse (trapezoid with linear edges and gaussian noise) over the current time window
+
+        Returns:
+            numpy array : float32 voltages of the pulse waveform
+        """
+        start, stop = self.time_window()
+        times = np.linspace(start, stop, self.record_length)
+        # linear edge over 10-90 rise time extends to 0-100 over 1.25x the rise time
+        edge = max(self.pulse_rise_time * 1.25, 1E-15)
+        rising = np.clip((times - self.pulse_delay) / edge, 0, 1)
+        falling = np.clip((self.pulse_delay + edge + self.pulse_width - times) / edge, 0, 1)
+        voltages = self.pulse_amplitude * np.minimum(rising, falling)
+        if self.noise > 0:
+            # averaging on the scope reduces the noise of independent acquisitions by the square root of their number
+            noise = self.noise / np.sqrt(self.average_count) if self.averaging else self.noise
+            voltages = voltages + self.rng.normal(0, noise, self.record_length)
+        return voltages.astype(np.float32)
+
+
+    # codes per vertical division and dtype of the integer transfer formats
+    INT_FORMATS = {"INT,8": (25.4, "i1"), "INT,16": (6502.4, "<i2")}
+
+    def current_waveform(self):
+        """Returns the waveform of the current acquisition, synthesized on first use after arming"""
+        if self.waveform is None or len(self.waveform) != self.record_length:
+            self.waveform = self.synthesize_waveform()
+        return self.waveform
+
+
+    def _set_measurement(self, match, args):
+        slot = int(match.group(2) or 1)
+        setting = match.group(3)
+        if setting.endswith("?"):
+            return self.measurements.get(slot, {}).get(setting[:-1], "0")
+        self.measurements.setdefault(slot, {})[setting] = args.upper()
+
+
+    def _measurement_result(self, match, args):
+        """Evaluates a configured measurement (MAIN AMPL, MEAN or RTIM, optionally gated) on the current waveform"""
+        settings = self.measurements.get(int(match.group(2) or 1), {})
+        main = settings.get("MAIN", "")
+        start, stop = self.time_window()
+        times = np.linspace(start, stop, self.record_length)
+        gate_start = gate_stop = None
+        if settings.get("GATE", "OFF") in ("ON", "1"):
+            gate_start = float(settings.get("GATE:ABSOLUTE:START", settings.get("GATE:ABS:STAR", start)))
+            gate_stop = float(settings.get("GATE:ABSOLUTE:STOP", settings.get("GATE:ABS:STOP", stop)))
+        summary = pulse_summary(times, self.current_waveform(), gate_start, gate_stop)
+        for name, key in (("AMPL", "amplitude"), ("MEAN", "mean"), ("RTIM", "rise_time")):
+            if main.startswith(name):
+                value = summary[key]
+                # invalid measurements answer with the SCPI not-a-number value
+                return "9.91E+37" if value != value else repr(value)
+        return "9.91E+37"
+
+
+    def _data_values(self, match, args):
+        first, last = self.export_range()
+        waveform = self.current_waveform()[first:last]
+        if self.data_format not in self.INT_FORMATS:
+            return definite_length_block(waveform.astype("<f4").tobytes())
+
+        # quantize as the ADC would: codes = ((volts - offset) / scale + position) * codes per division, clipped to the screen
+        channel = int(match.group(2) or 1)
+        codes_per_division, dtype = self.INT_FORMATS[self.data_format]
+        scale = self.vertical_setting(channel, "SCALE")
+        offset = self.vertical_setting(channel, "OFFSET")
+        position = self.vertical_setting(channel, "POSITION")
+        codes = np.rint(((waveform - offset) / scale + position) * codes_per_division)
+        limit = codes_per_division * 5
+        codes = np.clip(codes, -limit, limit).astype(dtype)
+        return definite_length_block(codes.tobytes())
+
+
+def definite_length_block(payload):
+    """
+    Wraps a binary payload in a IEEE 488.2 definite length block (#<digits><length><payload>) with the line terminator
+
+    Args:
+        payload (bytes) :
+            The binary data of the block
+
+    Returns:
+        bytes : the block as the instrument would send it
+    """
+    length = str(len(payload))
+    return b"#" + str(len(length)).encode() + length.encode() + payload + b"\n"
+
+
+class SimulatedVnaResource(SimulatedScpiResource):
+    """
+    In-process stand in for a pyvisa resource connected to a R&S ZNB vector network analyzer.
+    Answers the SCPI used by the VNA driver. The DUT is a shunt capacitance on a 50 ohm line (an ESD protection
+    structure), traces and calibration terms are returned as REAL,32 blocks of interleaved real and imaginary parts.
+
+    Attributes:
+        capacitance : float [units farads]
+            Shunt capacitance of the DUT, change it to model stress damage
+        point_time : float [units seconds]
+            Measurement time per sweep point
+        noise : float
+            Standard deviation of the complex noise added to the S-parameters
+        calibration_date : str
+            Answer of CORR:DATE?, change it to model a new calibration
+        calibration_reads : int
+            Number of calibration term transfers (CORR:CDAT?)
+    """
+
+    IDN = "Rohde-Schwarz,ZNB8-4Port,1311601062100130,3.45.0 (SIMULATED)"
+
+    def __init__(self, resource_name=SIMULATED_VNA_ID, command_latency=0.0, transfer_rate=None, capacitance=1E-12,
+                 point_time=10E-6, noise=1E-4, seed=None):
+        super().__init__(resource_name, command_latency, transfer_rate)
+        self.capacitance = capacitance
+        self.point_time = point_time
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.calibration_date = "2025-06-01,12:00:00"
+        self.calibration_reads = 0
+        self._preset(None, "")
+
+        self.handlers = [
+            (r"\*IDN\?", lambda match, args: self.IDN),
+            (r"\*RST|SYST(EM)?:PRES(ET)?", self._preset),
+            (r"\*OPC\?", self._operation_complete),
+            (r"FORM(AT)?(:DATA)?", self._set_format),
+            (r"SENS(E)?\d*:SWE(EP)?:TYPE", lambda match, args: self._set_sweep("TYPE", args.upper()[:4])),
+            (r"SENS(E)?\d*:FREQ(UENCY)?:STAR(T)?", lambda match, args: self._set_sweep("START", float(args))),
+            (r"SENS(E)?\d*:FREQ(UENCY)?:STOP", lambda match, args: self._set_sweep("STOP", float(args))),
+            (r"SENS(E)?\d*:SWE(EP)?:POIN(TS)?", lambda match, args: self._set_sweep("POINTS", int(float(args)))),
+            (r"SENS(E)?\d*:SEGM(ENT)?:DEL(ETE)?:ALL", self._delete_segments),
+            (r"SENS(E)?\d*:SEGM(ENT)?(\d+):DEF(INE)?", self._define_segment),
+            (r"SENS(E)?\d*:CORR(ECTION)?:DATE\?", lambda match, args: "'" + self.calibration_date + "'"),
+            (r"SENS(E)?\d*:CORR(ECTION)?:STAT(E)?\?", lambda match, args: "1"),
+            (r"SENS(E)?\d*:CORR(ECTION)?:CDAT(A)?\?", self._calibration_data),
+            (r"CALC(ULATE)?\d*:PAR(AMETER)?:DEL(ETE)?:ALL", self._delete_traces),
+            (r"CALC(ULATE)?\d*:PAR(AMETER)?:SDEF(INE)?", self._define_trace),
+            (r"CALC(ULATE)?\d*:PAR(AMETER)?:SEL(ECT)?", self._select_trace),
+            (r"INIT(IATE)?\d*(:IMM(EDIATE)?)?", self._start_sweep),
+            (r"CALC(ULATE)?\d*:DATA\?", self._trace_data),
+        ]
+        self.handlers = [(re.compile(pattern), handler) for pattern, handler in self.handlers]
+
+
+    def _preset(self, match, args):
+        self.settings = {}
+        self.data_format = "ASC"
+        self.sweep = {"TYPE": "LIN", "START": 100E3, "STOP": 8.5E9, "POINTS": 201}
+        self.segments = []
+        self.traces = {"Trc1": "S11"}
+        self.selected = "Trc1"
+        self.sweep_done_at = 0.0
+        self.sweep_data = None
+
+
+    def _set_format(self, match, args):
+        self.data_format = args.upper().replace(" ", "")
+
+
+    def _set_sweep(self, name, value):
+        self.sweep[name] = value
+
+
+    def _delete_segments(self, match, args):
+        self.segments = []
+
+
+    def _define_segment(self, match, args):
+        values = [float(value) for value in args.split(",")]
+        index = int(match.group(3))
+        while len(self.segments) < index:
+            self.segments.append(None)
+        self.segments[index - 1] = (values[0], values[1], int(values[2]))
+
+
+    def frequencies(self):
+        if self.sweep["TYPE"] == "SEGM" and self.segments:
+            return np.concatenate([np.linspace(start, stop, points) for start, stop, points in self.segments])
+        return np.linspace(self.sweep["START"], self.sweep["STOP"], self.sweep["POINTS"])
+
+
+    def _delete_traces(self, match, args):
+        self.traces = {}
+
+
+    def _define_trace(self, match, args):
+        name, parameter = [value.strip().strip("'\"") for value in args.split(",")]
+        self.traces[name] = parameter.upper()
+
+
+    def _select_trace(self, match, args):
+        self.selected = args.strip().strip("'\"")
+
+
+    def _start_sweep(self, match, args):
+        frequencies = self.frequencies()
+        self.sweep_done_at = time.perf_counter() + len(frequencies) * self.point_time
+        # shunt admittance Y = jwC on a Z0 line: S11 = S22 = -Y Z0 / (2 + Y Z0), S21 = S12 = 2 / (2 + Y Z0)
+        y_z0 = 2j * np.pi * frequencies * self.capacitance * 50.0
+        reflection = -y_z0 / (2 + y_z0)
+        transmission = 2 / (2 + y_z0)
+        self.sweep_data = {"S11": reflection, "S22": reflection, "S21": transmission, "S12": transmission}
+
+
+    def _operation_complete(self, match, args):
+        remaining = self.sweep_done_at - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+        return "1"
+
+
+    def complex_block(self, values):
+        if self.noise > 0:
+            values = values + self.rng.normal(0, self.noise, len(values)) + 1j * self.rng.normal(0, self.noise, len(values))
+        interleaved = np.empty(2 * len(values), dtype="<f4")
+        interleaved[0::2] = values.real
+        interleaved[1::2] = values.imag
+        if self.data_format.startswith("REAL,32"):
+            return definite_length_block(interleaved.tobytes())
+        return ",".join(repr(float(value)) for value in interleaved)
+
+
+    def _trace_data(self, match, args):
+        if self.sweep_data is None:
+            self._start_sweep(None, "")
+        return self.complex_block(self.sweep_data[self.traces.get(self.selected, "S11")])
+
+
+    def _calibration_data(self, match, args):
+        self.calibration_reads += 1
+        frequencies = self.frequencies()
+        # small frequency dependent error terms
+        return self.complex_block(1E-3 * np.exp(-1j * frequencies / 1E9) * (1 + frequencies / 1E10))
+
+
+class SimulatedSpectrumAnalyzerResource(SimulatedScpiResource):
+    """
+    In-process stand in for a pyvisa resource connected to a RIGOL DSA800 spectrum analyzer.
+    Answers the SCPI used by the SpectrumAnalyzer driver. The spectrum is a noise floor with one carrier whose shape
+    follows the resolution bandwidth, traces are returned as REAL,32 blocks (dBm).
+
+    Attributes:
+        carrier_frequency : float [units Hz]
+            Frequency of the simulated carrier
+        carrier_level : float [units dBm]
+            Level of the carrier, change it to model emissions
+        noise_floor : float [units dBm]
+            Level of the noise floor
+        sweeps : int
+            Number of sweeps started
+    """
+
+    IDN = "Rigol Technologies,DSA815,DSA8A000000001,00.01.19.00.02 (SIMULATED)"
+
+    def __init__(self, resource_name=SIMULATED_SPECTRUM_ID, command_latency=0.0, transfer_rate=None, sweep_time=10E-3,
+                 carrier_frequency=433.92E6, carrier_level=-30.0, noise_floor=-90.0, seed=None):
+        super().__init__(resource_name, command_latency, transfer_rate)
+        self.default_sweep_time = sweep_time
+        self.carrier_frequency = carrier_frequency
+        self.carrier_level = carrier_level
+        self.noise_floor = noise_floor
+        self.rng = np.random.default_rng(seed)
+        self.sweeps = 0
+        self._preset(None, "")
+
+        self.handlers = [
+            (r"\*IDN\?", lambda match, args: self.IDN),
+            (r"\*RST", self._preset),
+            (r"\*OPC\?", self._operation_complete),
+            (r"FORM(AT)?(:TRAC(E)?)?(:DATA)?", self._set_format),
+            (r"(SENS(E)?:)?FREQ(UENCY)?:STAR(T)?(\?)?", lambda match, args: self._frequency("START", match, args)),
+            (r"(SENS(E)?:)?FREQ(UENCY)?:STOP(\?)?", lambda match, args: self._frequency("STOP", match, args)),
+            (r"(SENS(E)?:)?FREQ(UENCY)?:CENT(ER)?(\?)?", lambda match, args: self._frequency("CENTER", match, args)),
+            (r"(SENS(E)?:)?FREQ(UENCY)?:SPAN(\?)?", lambda match, args: self._frequency("SPAN", match, args)),
+            (r"(SENS(E)?:)?FREQ(UENCY)?:SPAN:FULL", lambda match, args: self._set_span(0.0, 1.5E9)),
+            (r"(SENS(E)?:)?SWE(EP)?:POIN(TS)?(\?)?", lambda match, args: self._setting("POINTS", match, args, int)),
+            (r"(SENS(E)?:)?SWE(EP)?:TIME(\?)?", lambda match, args: self._setting("TIME", match, args, float)),
+            (r"(SENS(E)?:)?BAND(WIDTH)?(:RES(OLUTION)?)?(\?)?", lambda match, args: self._setting("RBW", match, args, float)),
+            (r"INIT(IATE)?(:IMM(EDIATE)?)?", self._start_sweep),
+            (r"TRAC(E)?(:DATA)?\?", self._trace_data),
+        ]
+        self.handlers = [(re.compile(pattern), handler) for pattern, handler in self.handlers]
+
+
+    def _preset(self, match, args):
+        self.settings = {}
+        self.data_format = "ASC"
+        self.sweep = {"START": 0.0, "STOP": 1.5E9, "POINTS": 601, "TIME": self.default_sweep_time, "RBW": 1E6}
+        self.sweep_done_at = 0.0
+        self.trace = None
+
+
+    def _set_format(self, match, args):
+        self.data_format = args.upper().replace(" ", "")
+
+
+    def _setting(self, name, match, args, convert):
+        if match.group(0).endswith("?"):
+            return repr(self.sweep[name])
+        self.sweep[name] = convert(float(args))
+
+
+    def _set_span(self, start, stop):
+        self.sweep["START"], self.sweep["STOP"] = max(0.0, start), stop
+
+
+    def _frequency(self, name, match, args):
+        start, stop = self.sweep["START"], self.sweep["STOP"]
+        values = {"START": start, "STOP": stop, "CENTER": (start + stop) / 2, "SPAN": stop - start}
+        if match.group(0).endswith("?"):
+            return repr(values[name])
+        value = float(args)
+        if name == "START" or name == "STOP":
+            self.sweep[name] = value
+        elif name == "CENTER":
+            # the span shrinks to keep the start frequency positive, as on the analyzer
+            half_span = min(values["SPAN"] / 2, value)
+            self._set_span(value - half_span, value + half_span)
+        else:
+            self._set_span(values["CENTER"] - value / 2, values["CENTER"] + value / 2)
+
+
+    def _start_sweep(self, match, args):
+        self.sweeps += 1
+        self.sweep_done_at = time.perf_counter() + self.sweep["TIME"]
+        frequencies = np.linspace(self.sweep["START"], self.sweep["STOP"], self.sweep["POINTS"])
+        # gaussian resolution filter centered on the carrier, on top of a noisy floor (powers add)
+        carrier = self.carrier_level - 3.01 * ((frequencies - self.carrier_frequency) / (self.sweep["RBW"] / 2)) ** 2
+        floor = self.noise_floor + self.rng.normal(0, 1.0, len(frequencies))
+        self.trace = 10 * np.log10(10 ** (carrier / 10) + 10 ** (floor / 10))
+
+
+    def _operation_complete(self, match, args):
+        remaining = self.sweep_done_at - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+        return "1"
+
+
+    def _trace_data(self, match, args):
+        if self.trace is None:
+            self._start_sweep(None, "")
+        values = self.trace.astype("<f4")
+        if self.data_format.startswith("REAL"):
+            return definite_length_block(values.tobytes())
+        return ",".join(repr(float(value)) for value in values)
+
+
+class SimulatedResourceManager():
+    """
+    In-process stand in for pyvisa.ResourceManager, hands out simulated resources by resource name.
+
+    Attributes:
+        resources : dict
+            Maps resource names to a callable creating the simulated resource (called with the resource name)
+    """
+
+    def __init__(self, resources=None, **scope_options):
+        """
+        Creates the resource manager, by default a single simulated RTO6 is available
+
+        Args:
+            resources (dict) : [optional]
+                Maps resource names to a callable that creates the simulated resource when opened
+            scope_options : [optional]
+                Keyword arguments passed to SimulatedScopeResource for the default scope
+        """
+        if resources == None:
+            resources = {SIMULATED_SCOPE_ID: lambda name: SimulatedScopeResource(name, **scope_options)}
+        self.resources = dict(resources)
+        self.opened = []
+
+
+    def list_resources(self, query="?*::INSTR"):
+        return tuple(self.resources.keys())
+
+
+    def open_resource(self, resource_name, **kwargs):
+        if resource_name not in self.resources:
+            raise ValueError("Simulated resource not found: " + str(resource_name))
+        resource = self.resources[resource_name](resource_name)
+        self.opened.append(resource)
+        return resource
+
+
+    def close(self):
+        for resource in self.opened:
+            resource.close()
+        self.opened = []
+
+
+class SimulatedSmuConnection(xtralien.Connection):
+    """
+    Simulated serial connection to an Ossila Xtralien source measure unit.
+    Responds to the CLOI commands the OscillaSMU driver sends and models the serial link latency.
+    Commands are executed one after the other in the order they were written and their responses queued, so several
+    commands can be in flight (pipelined) like on the real link.
+    The DUT on each channel is a resistor in parallel with a diode.
+
+    Attributes:
+        port : str
+            The COM port the connection was opened on
+        latency : float [units seconds]
+            Fixed round trip time of every command (USB serial and firmware handling)
+        byte_time : float [units seconds]
+            Time to transfer one byte over the link, 10 bits per byte at the baud rate
+        measurement_time : float [units seconds]
+            Additional time a measurement command (oneshot, measure) takes to integrate
+        resistance : float [units ohms]
+            Leakage resistance of the simulated DUT
+        diode_saturation_current : float [units amps]
+            Saturation current of the simulated DUT diode
+        noise : float [units amps]
+            Standard deviation of the gaussian noise on the measured current
+    """
+
+    def __init__(self, port, latency=0.002, baud_rate=115200, measurement_time=0.001, resistance=1E7,
+                 diode_saturation_current=1E-12, noise=1E-10, seed=None):
+        super().__init__()
+        self.port = port
+        self.latency = latency
+        self.byte_time = 10 / baud_rate if baud_rate else 0
+        self.measurement_time = measurement_time
+        self.resistance = resistance
+        self.diode_saturation_current = diode_saturation_current
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.channels = {
+            "smu1": {"voltage": 0.0, "enabled": False, "range": 1},
+            "smu2": {"voltage": 0.0, "enabled": False, "range": 1},
+        }
+        # (arrival time, response) of the commands written, oldest first
+        self.responses = collections.deque()
+        # time.perf_counter() the simulated firmware finishes the commands written so far
+        self.busy_until = 0.0
+        self.command_time = 0.0
+        self.open = True
+
+
+    def dut_current(self, voltage):
+        """Current through the simulated DUT for the given voltage"""
+        current = voltage / self.resistance
+        current += self.diode_saturation_current * (np.exp(min(voltage, 1.5) / 0.02585) - 1)
+        if self.noise > 0:
+            current += self.rng.normal(0, self.noise)
+        return float(current)
+
+
+    def write(self, cmd):
+        if isinstance(cmd, bytes):
+            cmd = str(cmd, "utf-8")
+        with self.lock:
+            if self.byte_time:
+                time.sleep(len(cmd) * self.byte_time)
+            # half the round trip to the firmware, the command waits for the ones before it, then half back
+            self.command_time = 0.0
+            response = self._handle(cmd.strip().split())
+            start = max(time.perf_counter() + self.latency / 2, self.busy_until)
+            self.busy_until = start + self.command_time
+            self.responses.append((self.busy_until + self.latency / 2 + len(response) * self.byte_time, response))
+
+
+    def read(self, wait=True):
+        with self.lock:
+            arrival, response = self.responses.popleft() if self.responses else (time.perf_counter() + self.latency, "")
+        if not wait:
+            return ""
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        return response
+
+
+    def close(self):
+        self.open = False
+
+
+    def _measure(self, channel):
+        state = self.channels[channel]
+        self.command_time += self.measurement_time
+        voltage = state["voltage"] if state["enabled"] else 0.0
+        current = self.dut_current(voltage) if state["enabled"] else 0.0
+        # the xtralien response parser only accepts unsigned exponents for positive powers eg. 1e05
+        return f"[{voltage:.6e},{current:.6e};]\n".replace("e+", "e")
+
+
+    def _handle(self, tokens):
+        if len(tokens) == 0:
+            return ""
+        if tokens[0] == "cloi":
+            if len(tokens) > 1 and tokens[1] == "version":
+                return "1.0.0-sim\n"
+            if len(tokens) > 1 and tokens[1] == "hello":
+                return "Hello World (simulated SMU)\n"
+            return "\n"
+        if tokens[0] not in self.channels:
+            return "Error: unknown module\n"
+
+        channel = tokens[0]
+        state = self.channels[channel]
+        if len(tokens) >= 4 and tokens[1] == "set":
+            if tokens[2] == "voltage":
+                state["voltage"] = float(tokens[3])
+            elif tokens[2] == "enabled":
+                state["enabled"] = tokens[3].lower() in ("true", "1")
+            elif tokens[2] == "range":
+                state["range"] = int(float(tokens[3]))
+            return "OK\n"
+        if len(tokens) >= 3 and tokens[1] == "oneshot":
+            state["voltage"] = float(tokens[2])
+            return self._measure(channel)
+        if len(tokens) >= 2 and tokens[1] == "measure":
+            return self._measure(channel)
+        return "Error: unknown command\n"
+
+    def __repr__(self):
+        return "<Simulated Serial/USB {port} />".format(port=self.port)
+
+
+def SimulatedSmuDevice(com_port, **connection_options):
+    """
+    Creates a xtralien.Device backed by a simulated serial connection, signature matches xtralien.Device so it can be
+    provided to OscillaSMU as device_factory
+
+    Args:
+        com_port (str) :
+            The COM port name, only used to label the connection
+        connection_options : [optional]
+            Keyword arguments passed to SimulatedSmuConnection (latency, baud_rate, measurement_time ...)
+
+    Returns:
+        xtralien.Device : device with the simulated connection attached
+    """
+    device = xtralien.Device()
+    device.add_connection(SimulatedSmuConnection(com_port, **connection_options))
+    return device
+
+
+class SimulatedTeensy():
+    """
+    Relay controller firmware stand in on a pseudo-terminal, speaks the TeensyController frame protocol.
+    Only available on POSIX systems (os.openpty).
+
+    Attributes:
+        port : str
+            Path of the pseudo-terminal to connect the driver to
+        relay_states : int
+            Bit n is the state of relay n + 1
+        latency : float [units seconds]
+            Time the firmware takes to handle a frame (relay driver and USB turnaround)
+        frames : int
+            Frames handled
+        drop_every : int
+            Leaves every n-th frame unacknowledged to exercise retransmission, 0 acknowledges all
+    """
+
+    VERSION = b"sim-1.0"
+
+    def __init__(self, latency=0.0, drop_every=0):
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.latency = latency
+        self.drop_every = drop_every
+        self.relay_states = 0
+        # relay bit -> extended sequence number of the frame that last set it, see TeensyController.unwrap_seq()
+        self.relay_sequences = {}
+        # extended sequence number of the newest frame received
+        self.latest_sequence = None
+        self.frames = 0
+        self.decoder = FrameDecoder()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="SimulatedTeensy", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def _handle(self, seq, command, payload):
+        if command == CMD_VERSION:
+            self.relay_sequences = {}
+            self.latest_sequence = None
+        sequence = unwrap_seq(seq, self.latest_sequence)
+        self.latest_sequence = sequence if self.latest_sequence == None else max(self.latest_sequence, sequence)
+        if command == CMD_PING:
+            return STATUS_OK, b""
+        if command == CMD_VERSION:
+            return STATUS_OK, SimulatedTeensy.VERSION
+        if command == CMD_SET_RELAYS:
+            if len(payload) != 2:
+                return STATUS_BAD_PAYLOAD, b""
+            mask, values = payload[0], payload[1]
+            for bit in range(8):
+                # a late retransmission must not undo a newer state of the same relay
+                if mask & (1 << bit) and sequence > self.relay_sequences.get(bit, -1):
+                    self.relay_states = (self.relay_states & ~(1 << bit)) | (values & (1 << bit))
+                    self.relay_sequences[bit] = sequence
+            return STATUS_OK, b""
+        if command == CMD_GET_RELAYS:
+            return STATUS_OK, bytes((self.relay_states,))
+        return STATUS_BAD_COMMAND, b""
+
+    def _run(self):
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            replies = []
+            for seq, command, payload in self.decoder.feed(data):
+                self.frames += 1
+                if self.drop_every and self.frames % self.drop_every == 0:
+                    continue
+                status, data = self._handle(seq, command, payload)
+                replies.append(encode_frame(seq, command | ACK_FLAG, bytes((status,)) + data))
+            if replies:
+                if self.latency:
+                    time.sleep(self.latency)
+                os.write(self.master, b"".join(replies))
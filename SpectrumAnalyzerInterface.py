@@ -0,0 +1,427 @@
+import threading
+from VisaResource import *
+
+
+class TraceRingBuffer():
+    """
+    Fixed size ring buffer of spectrum traces, preallocated so streaming never allocates per sweep.
+    When the reader falls behind the oldest traces are overwritten and counted as lost.
+
+    Attributes:
+        traces : numpy array
+            capacity x points float32 amplitudes
+        timestamps : numpy array
+            time.time() of each trace
+        written : int
+            Traces written since creation
+        lost : int
+            Traces overwritten before read_new() returned them
+    """
+
+    def __init__(self, capacity, points):
+        self.capacity = int(capacity)
+        self.points = int(points)
+        self.traces = np.zeros((self.capacity, self.points), dtype=np.float32)
+        self.timestamps = np.zeros(self.capacity)
+        self.written = 0
+        self.read_position = 0
+        self.lost = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def append(self, trace, timestamp=None):
+        """Copies a trace into the next slot"""
+        with self.lock:
+            slot = self.written % self.capacity
+            self.traces[slot, :] = trace[:self.points]
+            self.timestamps[slot] = time.time() if timestamp == None else timestamp
+            self.written += 1
+
+    def latest(self, count=1):
+        """
+        Returns:
+            numpy array, numpy array : timestamps and traces of the last count traces, oldest first (copies)
+        """
+        with self.lock:
+            count = min(count, len(self))
+            slots = (np.arange(self.written - count, self.written)) % self.capacity
+            return self.timestamps[slots].copy(), self.traces[slots].copy()
+
+    def read_new(self):
+        """
+        Returns the traces written since the last call, oldest first (copies). Traces that were overwritten before
+        they could be read are added to lost
+
+        Returns:
+            numpy array, numpy array : timestamps, traces
+        """
+        with self.lock:
+            first = max(self.read_position, self.written - self.capacity)
+            self.lost += first - self.read_position
+            slots = np.arange(first, self.written) % self.capacity
+            self.read_position = self.written
+            return self.timestamps[slots].copy(), self.traces[slots].copy()
+
+    def max_hold(self):
+        """Returns the per point maximum over the buffered traces, eg. to spot emissions during a stress run"""
+        with self.lock:
+            return self.traces[:len(self)].max(axis=0) if len(self) else np.empty(0, dtype=np.float32)
+
+
+class SpectrumAnalyzer(VisaResource):
+    """
+    Class for connection to spectrum analyzer using VISA and SCPI commands
+    Commands are for the RIGOL DSA800 series Spectrum Analyzer
+    Reference for this class is the DSA800 Programming Guide, see DeviceManuals
+
+    Child class of VisaResource
+
+    Attributes:
+        trace_points : int
+            Points per trace (SWEep:POINts)
+        frequency_axis : tuple
+            (start, stop, points) the frequencies were computed for, None when a setting changed and it must be read again
+        stream_buffer : TraceRingBuffer
+            Traces captured by start_streaming()
+        lock : threading.RLock
+            Serialises the commands of the streaming thread and the caller, which share one VISA session
+    """
+
+    # substring of the *IDN? response of supported analyzers, used to find the analyzer among the VISA resources
+    IDENTITY = "DSA8"
+
+    Mode = Enum('Mode', [('WRITe', 0), ('MAXHold', 1), ('MINHold', 2), ('VIEW', 3), ('BLANk', 4), ('VIDeoavg', 5), ('POWeravg', 6)])
+
+    def __init__(self, pyvisa_resource_manager=None):
+        super().__init__(pyvisa_resource_manager)
+        self.trace_points = None
+        self.frequency_axis = None
+        self.frequencies = np.empty(0)
+        self.binary_format = False
+        self.stream_buffer = None
+        self.stream_thread = None
+        self.stream_stop = threading.Event()
+        self.stream_sweeps = 0
+        self.stream_errors = 0
+        self.lock = threading.RLock()
+
+
+    def connect(self, device_index = -1, device_id=None, timeout=None):
+        """
+        Connects like VisaResource.connect(), if neither index nor ID is given the first resource identifying as a
+        supported analyzer (IDENTITY) is used
+        """
+        self.stop_streaming()
+        self.frequency_axis = None
+        self.binary_format = False
+        if device_index == -1 and device_id == None:
+            device_id = self.find_resource(SpectrumAnalyzer.IDENTITY, timeout)
+            if device_id == None:
+                print("No spectrum analyzer found")
+                return False
+        if not super().connect(device_index, device_id, timeout):
+            return False
+        self.device.write(":INITiate:CONTinuous OFF") # single sweeps, started by single_sweep() pg. 2-89
+        return True
+
+
+    def close(self):
+        self.stop_streaming()
+        super().close()
+
+
+    def check_connection(self, silent=False):
+        with self.lock:
+            return super().check_connection(silent)
+
+
+    def custom_write_command(self, command):
+        with self.lock:
+            super().custom_write_command(command)
+
+
+    def custom_query_command(self, command):
+        with self.lock:
+            return super().custom_query_command(command)
+
+
+    def _write_setting(self, command):
+        if self.device == None:
+            print("Spectrum Analyzer Not Connected")
+            return
+        # a streamed sweep completes first, the setting applies from the next one
+        with self.lock:
+            self.device.write(command)
+            # frequencies of the trace points are read again on the next trace
+            self.frequency_axis = None
+
+
+    def set_span(self, frequency):
+        """Sets the span frequency in Hz, 0 Hz to 7.5 GHz. Ref: Pg. 2-129 DSA800 Programming Guide"""
+        self._write_setting(f":SENSe:FREQuency:SPAN {frequency}")
+
+
+    def set_span_max(self):
+        """Sets the span to the full span. Ref: Pg. 2-129 DSA800 Programming Guide"""
+        self._write_setting(":SENSe:FREQuency:SPAN:FULL")
+
+
+    def set_center_frequency(self, frequency):
+        """Sets the center frequency in Hz, 0 Hz to 7.5 GHz. Ref: Pg. 2-126 DSA800 Programming Guide"""
+        self._write_setting(f":SENSe:FREQuency:CENTer {frequency}")
+
+
+    def set_start_frequency(self, frequency):
+        """Sets the start frequency in Hz, 0 Hz to 7.5 GHz. Ref: Pg. 2-130 DSA800 Programming Guide"""
+        self._write_setting(f":SENSe:FREQuency:STARt {frequency}")
+
+
+    def set_stop_frequency(self, frequency):
+        """Sets the stop frequency in Hz, 0 Hz to 7.5 GHz. Ref: Pg. 2-131 DSA800 Programming Guide"""
+        self._write_setting(f":SENSe:FREQuency:STOP {frequency}")
+
+
+    def set_bandwidth_resolution(self, resolution):
+        """Sets the resolution bandwidth in Hz, 10 Hz to 1 MHz at 1-3-10 steps. Ref: Pg. 2-106 DSA800 Programming Guide"""
+        self._write_setting(f":SENSe:BANDwidth:RESolution {resolution}")
+
+
+    def set_bandwidth_resolution_auto(self, auto=True):
+        """Lets the analyzer choose the resolution bandwidth. Ref: Pg. 2-106 DSA800 Programming Guide"""
+        self._write_setting(":SENSe:BANDwidth:RESolution:AUTO " + ("ON" if auto else "OFF"))
+
+
+    def set_sweep_count(self, count):
+        """Sets the sweep count, 1 to 9999. Ref: Pg. 2-147 DSA800 Programming Guide"""
+        self._write_setting(f":SENSe:SWEep:COUNt {int(count)}")
+
+
+    def set_sweep_time(self, time_s):
+        """Sets the sweep time in seconds, 20 us to 7500 s. Ref: Pg. 2-148 DSA800 Programming Guide"""
+        self._write_setting(f":SENSe:SWEep:TIME {time_s}")
+
+
+    def set_sweep_points(self, points):
+        """Sets the number of points per trace, 101 to 3001. Ref: DSA800 Programming Guide :SENSe:SWEep:POINts"""
+        self._write_setting(f":SENSe:SWEep:POINts {int(points)}")
+
+
+    def set_average_count(self, count):
+        """Sets the number of trace averages, 1 to 1000. Ref: Pg. 2-147 DSA800 Programming Guide"""
+        self._write_setting(f":SENSe:AVERage:COUNt {int(count)}")
+
+
+    def set_trace_mode(self, mode=Mode.WRITe, trace=1):
+        """
+        Sets the mode of a trace (1 through 3). Ref: pg. 2-195 DSA800 Programming Guide
+
+        Args:
+            mode (SpectrumAnalyzer.Mode) : [optional] default=Mode.WRITe
+                WRITe, MAXHold, MINHold, VIEW, BLANk, VIDeoavg, POWeravg
+            trace (int) : [optional] default=1
+                The trace, 1-3
+        """
+        if trace not in (1, 2, 3):
+            print("Invalid trace " + str(trace) + ", must be 1-3")
+            return
+        self._write_setting(f":TRACe{trace}:MODE {mode.name}")
+
+
+    def clear_all_traces(self):
+        """Turns all traces to BLANk. Ref pg. 2-287 DSA800 Programming Guide"""
+        self._write_setting(":TRACe:CLEar:ALL")
+
+
+    def set_binary_format(self):
+        """Selects REAL,32 trace transfers, once per connection"""
+        with self.lock:
+            if self.binary_format:
+                return
+            self.device.write(":FORMat:TRACe:DATA REAL,32") # pg. 2-64
+            self.binary_format = True
+
+
+    def read_frequencies(self):
+        """
+        Returns the frequency of every trace point, computed from start, stop and points (queried only after a
+        setting changed)
+
+        Returns:
+            numpy array : frequencies in Hz
+        """
+        with self.lock:
+            if self.frequency_axis == None:
+                start = float(self.device.query(":SENSe:FREQuency:STARt?"))
+                stop = float(self.device.query(":SENSe:FREQuency:STOP?"))
+                points = int(float(self.device.query(":SENSe:SWEep:POINts?")))
+                self.frequency_axis = (start, stop, points)
+                self.trace_points = points
+                self.frequencies = np.linspace(start, stop, points)
+            return self.frequencies
+
+
+    def single_sweep(self, timeout=10):
+        """
+        Starts one sweep and waits for it to complete
+
+        Args:
+            timeout (float) : [optional] default=10 [units seconds]
+                Longest time the sweep may take
+
+        Returns:
+            boolean : true if the sweep completed
+        """
+        if self.device == None:
+            print("Spectrum Analyzer Not Connected")
+            return False
+        with self.lock:
+            previous_timeout = self.device.timeout
+            self.device.timeout = int(timeout * 1000)
+            try:
+                self.device.write(":INITiate:IMMediate") # pg. 2-89
+                # *OPC? answers once the sweep is complete, one round trip instead of polling
+                return self.device.query("*OPC?").strip() == "1"
+            except Exception:
+                print("Spectrum analyzer sweep did not complete within " + str(timeout) + " s")
+                return False
+            finally:
+                self.device.timeout = previous_timeout
+
+
+    def read_trace(self, trace=1):
+        """
+        Reads a trace as a REAL,32 block
+
+        Returns:
+            numpy array : float32 amplitudes (dBm), None on failure
+        """
+        with self.lock:
+            self.set_binary_format()
+            self.device.write(f":TRACe:DATA? TRACE{trace}") # pg. 2-188
+            data = self.device.read_raw()
+        with tracer.span("host", "parse_raw_bytes_data"):
+            values = parse_raw_bytes_data(data, silent=True)
+        if isinstance(values, int):
+            return None
+        return values
+
+
+    def record_signal(self, trace=1, record_to_file = False, path=None, silent=False):
+        """
+        Collects the data of a trace and returns it as numpy arrays
+        Procedure:
+        1. Queries for data
+        2. Parses data
+        3. Returns parsed data as numpy arrays
+
+        Refs: pg. 2-64, pg. 2-188 DSA800 Programming Guide
+
+        Args:
+            trace (int) : [optional] default=1
+                The trace that the signal data is being recorded from
+            record_to_file (boolean) : [optional] default=False
+                Records data to a file specified by path parameter
+            path (str) : [optional]
+                If recorded_to_file is specified, file will be saved to this path, provide path and file name but no extension
+            silent (boolean) : [optional] default=False
+                Specifies if status remarks are made to the console, true no remarks are made
+
+        Returns:
+            numpy.array, numpy.array : frequencies [Hz], amplitudes [dBm], -1, -1 on failure
+        """
+        if self.device == None:
+            print("Spectrum Analyzer Not Connected")
+            return -1, -1
+        with self.lock:
+            frequencies = self.read_frequencies()
+            self.set_binary_format()
+            self.device.write(f":TRACe:DATA? TRACE{trace}")
+            data = self.device.read_raw()
+        if not silent:
+            print("Data read complete")
+        if record_to_file:
+            if not silent:
+                print("Recording Raw Bytes Data to file")
+            save_raw_data_to_file(data=data, path=path)
+
+        amplitudes = parse_raw_bytes_data(data, silent=silent)
+        if isinstance(amplitudes, int) or len(amplitudes) != len(frequencies):
+            print("Data parsing failed, data invalid")
+            return -1, -1
+        return frequencies, amplitudes
+
+
+    def record_sweep(self, trace=1, timeout=10, silent=False):
+        """Runs a single sweep and records it, see single_sweep() and record_signal()"""
+        # no streamed sweep may run between this sweep and its trace
+        with self.lock:
+            if not self.single_sweep(timeout):
+                return -1, -1
+            return self.record_signal(trace=trace, silent=silent)
+
+
+    def start_streaming(self, trace=1, capacity=256, timeout=10, max_errors=10):
+        """
+        Sweeps back to back on a background thread and stores every trace in a ring buffer (stream_buffer), so the
+        analyzer's full sweep rate is sustained while the application reads the traces at its own pace.
+        Each sweep costs the sweep trigger, one *OPC? round trip and the trace transfer. Settings and other commands
+        can be sent while streaming, they wait for the sweep in progress (see lock). After a failed sweep the stream
+        waits before retrying, doubling the wait up to 2 s, and stops after max_errors failures in a row.
+
+        Args:
+            trace (int) : [optional] default=1
+                The trace streamed
+            capacity (int) : [optional] default=256
+                Traces kept in the ring buffer
+            timeout (float) : [optional] default=10 [units seconds]
+                Longest time one sweep may take
+            max_errors (int) : [optional] default=10
+                Failed sweeps in a row after which streaming stops
+
+        Returns:
+            TraceRingBuffer : the buffer the traces are written to, None if not connected
+        """
+        if self.device == None:
+            print("Spectrum Analyzer Not Connected")
+            return None
+        self.stop_streaming()
+        self.read_frequencies()
+        self.stream_buffer = TraceRingBuffer(capacity, self.trace_points)
+        self.stream_sweeps = 0
+        self.stream_errors = 0
+        self.stream_stop.clear()
+        self.stream_thread = threading.Thread(target=self._stream, args=(trace, timeout, max_errors), name="SpectrumStream", daemon=True)
+        self.stream_thread.start()
+        return self.stream_buffer
+
+
+    def stop_streaming(self):
+        if self.stream_thread == None:
+            return
+        self.stream_stop.set()
+        self.stream_thread.join()
+        self.stream_thread = None
+
+
+    def _stream(self, trace, timeout, max_errors):
+        failures = 0
+        while not self.stream_stop.is_set():
+            # the sweep and its trace are read in one go, no setting may change in between
+            with self.lock:
+                swept = self.single_sweep(timeout)
+                timestamp = time.time()
+                values = self.read_trace(trace) if swept else None
+            if values is None or len(values) < self.stream_buffer.points:
+                self.stream_errors += 1
+                failures += 1
+                if failures >= max_errors:
+                    print(f"Spectrum analyzer streaming stopped after {failures} failed sweeps")
+                    return
+                # back off instead of retrying a failing analyzer in a tight loop
+                self.stream_stop.wait(min(0.05 * 2 ** (failures - 1), 2.0))
+                continue
+            failures = 0
+            self.stream_buffer.append(values, timestamp)
+            self.stream_sweeps += 1
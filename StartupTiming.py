@@ -0,0 +1,38 @@
+"""
+Startup timing report. Import this module first, the clock starts at import, then mark() each startup phase.
+"""
+import threading
+import time
+
+
+START_TIME = time.perf_counter()
+
+# (label, seconds since START_TIME, thread name)
+marks = []
+marks_lock = threading.Lock()
+
+
+def mark(label):
+    """Records the time a startup phase finished"""
+    with marks_lock:
+        marks.append((label, time.perf_counter() - START_TIME, threading.current_thread().name))
+
+
+def report():
+    """
+    Returns:
+        str : one line per mark, time since start and since the previous mark of the same thread in milliseconds
+    """
+    lines = ["Startup timing [ms]:"]
+    previous = {}
+    with marks_lock:
+        for label, elapsed, thread in marks:
+            delta = elapsed - previous.get(thread, 0.0)
+            previous[thread] = elapsed
+            location = "" if thread == "MainThread" else f" ({thread})"
+            lines.append(f"  {elapsed * 1E3:8.1f}  +{delta * 1E3:7.1f}  {label}{location}")
+    return "\n".join(lines)
+
+
+def print_report():
+    print(report())
@@ -0,0 +1,512 @@
+"""
+Several independent test benches (stations) run concurrently from one host.
+
+Each station is an instrument set (oscilloscope, SMU, relay controller, VNA) with its own test plan, run by a
+SweepEngine in its own worker process, so stations never share an interpreter lock, a VISA session or a serial port and
+adding a bench adds its throughput. Workers send every step result to the coordinator over a queue, the coordinator is
+the only writer of the shared results file (JSON lines) and reports per-station throughput.
+
+VISA discovery (opening every resource and asking *IDN?) is slow, it is done once by the coordinator for all stations
+and kept in a cache file, which later runs reuse while it is younger than its max age.
+
+A station file lists the stations:
+    {
+        "stations": [
+            {"name": "bench1", "plan": "plan.json", "oscilloscope": "RTO6", "smu": "COM3", "controller": "COM4"},
+            {"name": "bench2", "plan": "plan.json", "oscilloscope": "TCPIP0::192.168.0.12::inst0::INSTR", "smu": "COM5",
+             "vna": "ZNB", "journal": "bench2.jsonl", "data_directory": "bench2_data"},
+            {"name": "demo", "plan": "plan.json", "simulated": true}
+        ]
+    }
+VISA instruments are given as a resource name (contains "::") or as a part of their *IDN? response, serial instruments
+by port. "simulated": true runs the station on the simulated instruments (see SimulatedInstruments.py).
+
+Usage:
+    python Stations.py stations.json --results results.jsonl
+    python Stations.py stations.json --discovery-cache visa_cache.json --discovery-max-age 600
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+
+from CampaignJournal import CampaignJournal, journal_values
+from TestPlan import compile_plan, expand_plan, load_plan
+
+
+VISA_INSTRUMENTS = ("oscilloscope", "vna")
+SERIAL_INSTRUMENTS = ("smu", "controller")
+
+
+def is_resource_name(value):
+    """True if value is a VISA resource name (eg. TCPIP0::192.168.0.12::inst0::INSTR) rather than an identity"""
+    return "::" in value
+
+
+def load_stations(path):
+    """
+    Loads and checks a station file
+
+    Returns:
+        dict[] : the stations
+
+    Raises:
+        ValueError : the file is not a valid station file
+    """
+    with open(path, "r") as file:
+        description = json.load(file)
+    stations = description.get("stations") if isinstance(description, dict) else description
+    if not isinstance(stations, list) or len(stations) == 0:
+        raise ValueError("Station file " + str(path) + " lists no stations")
+    names = set()
+    for station in stations:
+        name = station.get("name")
+        if name == None or name in names:
+            raise ValueError("Every station needs a unique name, got " + str(name))
+        names.add(name)
+        if "plan" not in station:
+            raise ValueError("Station " + name + " has no plan")
+    return stations
+
+
+class DiscoveryCache():
+    """
+    VISA resource name -> *IDN? response of the resources found on this host, shared by all stations
+
+    Attributes:
+        path : str
+            Cache file, None keeps the cache in memory only
+        max_age : float [units seconds]
+            A cache file older than this is discovered again
+        resources : dict
+            resource name -> identity
+        discovered : float
+            time.time() of the discovery the resources come from, None before discovery
+    """
+
+    def __init__(self, path=None, max_age=3600.0):
+        self.path = path
+        self.max_age = max_age
+        self.resources = {}
+        self.discovered = None
+
+    def load(self):
+        """Loads the cache file, returns true if it exists and is fresh"""
+        if self.path == None or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "r") as file:
+                cache = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            return False
+        if time.time() - cache.get("discovered", 0) > self.max_age:
+            return False
+        self.resources = cache["resources"]
+        self.discovered = cache["discovered"]
+        return True
+
+    def save(self):
+        """Writes the cache file atomically, so a station starting meanwhile never reads half of it"""
+        if self.path == None:
+            return
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump({"discovered": self.discovered, "resources": self.resources}, file, indent=1)
+        os.replace(temporary_path, self.path)
+
+    def discover(self, resource_manager=None, timeout=2.0, silent=False):
+        """
+        Asks every VISA resource for its identity and saves the cache
+
+        Args:
+            resource_manager (ResourceManager) : [optional]
+                The pyvisa resource manager, a new one if not given
+            timeout (float) : [optional] default=2.0 [units seconds]
+                Open and query timeout per resource
+            silent (boolean) : [optional] default=False
+                Specifies if status remarks are made to the console, true no remarks are made
+        """
+        if resource_manager == None:
+            import pyvisa
+            resource_manager = pyvisa.ResourceManager()
+        start = time.perf_counter()
+        self.resources = {}
+        for resource_name in resource_manager.list_resources():
+            # serial ports (ASRL) are the SMUs and relay controllers, *IDN? would corrupt their streams
+            if resource_name.upper().startswith("ASRL"):
+                continue
+            try:
+                resource = resource_manager.open_resource(resource_name, open_timeout=int(timeout * 1000))
+                resource.timeout = int(timeout * 1000)
+                try:
+                    self.resources[resource_name] = resource.query("*IDN?").strip()
+                finally:
+                    resource.close()
+            except Exception:
+                continue
+        self.discovered = time.time()
+        self.save()
+        if not silent:
+            print(f"Discovered {len(self.resources)} VISA instruments in {(time.perf_counter() - start) * 1E3:.0f} ms")
+
+    def resolve(self, identity, exclude=()):
+        """
+        Returns the resource name of the first resource whose identity contains identity and that is not in exclude,
+        None if there is none
+        """
+        if is_resource_name(identity):
+            return identity
+        for resource_name, resource_identity in self.resources.items():
+            if identity in resource_identity and resource_name not in exclude:
+                return resource_name
+        return None
+
+
+def resolve_stations(stations, cache, silent=False):
+    """
+    Replaces the identities of the stations' VISA instruments by resource names, discovering only if needed
+
+    Returns:
+        dict[] : copies of the stations with resource names
+
+    Raises:
+        ValueError : an instrument was not found, or two stations use the same one
+    """
+    wanted = [station[name] for station in stations if not station.get("simulated", False)
+              for name in VISA_INSTRUMENTS if station.get(name) != None]
+    if any(not is_resource_name(identity) for identity in wanted) and not cache.load():
+        cache.discover(silent=silent)
+    resolved = []
+    used = {}
+    for station in stations:
+        station = dict(station)
+        instruments = VISA_INSTRUMENTS + SERIAL_INSTRUMENTS if not station.get("simulated", False) else ()
+        for name in instruments:
+            if station.get(name) == None:
+                continue
+            if name in VISA_INSTRUMENTS:
+                # benches of the same model each get their own instrument
+                resource_name = cache.resolve(station[name], used)
+                if resource_name == None:
+                    raise ValueError(f"Station {station['name']}: no VISA instrument identifies as {station[name]}")
+                station[name] = resource_name
+            if station[name] in used:
+                raise ValueError(f"Stations {used[station[name]]} and {station['name']} both use {station[name]}")
+            used[station[name]] = station["name"]
+        resolved.append(station)
+    return resolved
+
+
+def connect_station(station):
+    """
+    Connects the instruments of a station, called in the station's worker process
+
+    Returns:
+        dict : instrument name -> connected driver, None for instruments the station does not have
+
+    Raises:
+        RuntimeError : an instrument did not connect
+    """
+    from OscilloscopeInterface import Oscilloscope
+    from OssillaSmu import OscillaSMU
+    instruments = {"oscilloscope": None, "smu": None, "controller": None, "vna": None}
+    if station.get("simulated", False):
+        from SimulatedInstruments import SimulatedResourceManager, SimulatedSmuDevice
+        # simulated stations have a scope and an SMU, unless the station sets them to None
+        if "oscilloscope" not in station or station["oscilloscope"] != None:
+            instruments["oscilloscope"] = Oscilloscope(SimulatedResourceManager(record_length=station.get("record_length", 10000)))
+            if not instruments["oscilloscope"].connect():
+                raise RuntimeError("simulated oscilloscope did not connect")
+        if "smu" not in station or station["smu"] != None:
+            instruments["smu"] = OscillaSMU("COM1", device_factory=SimulatedSmuDevice)
+            if not instruments["smu"].connect():
+                raise RuntimeError("simulated SMU did not connect")
+        return instruments
+
+    resource_manager = None
+    if any(station.get(name) != None for name in VISA_INSTRUMENTS):
+        import pyvisa
+        resource_manager = pyvisa.ResourceManager()
+    timeout = station.get("timeout", 5.0)
+    if station.get("oscilloscope") != None:
+        instruments["oscilloscope"] = Oscilloscope(resource_manager)
+        connected = instruments["oscilloscope"].connect(device_id=station["oscilloscope"], timeout=timeout)
+        if not connected:
+            raise RuntimeError("oscilloscope " + station["oscilloscope"] + " did not connect")
+    if station.get("vna") != None:
+        from VnaInterface import VNA
+        instruments["vna"] = VNA(resource_manager)
+        if not instruments["vna"].connect(device_id=station["vna"], timeout=timeout):
+            raise RuntimeError("VNA " + station["vna"] + " did not connect")
+    if station.get("smu") != None:
+        instruments["smu"] = OscillaSMU(station["smu"])
+        if not instruments["smu"].connect():
+            raise RuntimeError("SMU on " + station["smu"] + " did not connect")
+    if station.get("controller") != None:
+        from TeensyController import TeensyController
+        instruments["controller"] = TeensyController(station["controller"])
+        if not instruments["controller"].connect():
+            raise RuntimeError("controller on " + station["controller"] + " did not connect")
+    return instruments
+
+
+def result_row(station_name, result):
+    """A step result as one row of the shared results file"""
+    step = result.step
+    row = {"station": station_name, "pin": step.pin, "measurement": step.measurement, "level": step.level,
+           "stage": step.stage, "status": result.status, "failure": result.failure, "elapsed": result.elapsed,
+           "restored": result.restored, "time": time.time()}
+    row.update(journal_values(result.values))
+    return row
+
+
+def run_station(station, messages, stop_event):
+    """
+    Worker process of one station: connects its instruments, runs its plan and sends every result to the coordinator
+
+    Args:
+        station (dict) :
+            The station, with resolved resource names (see resolve_stations())
+        messages (multiprocessing.Queue) :
+            Receives (kind, station name, payload) tuples: "started" (number of steps), "result" (row), "done" (pin
+            failures) and "error" (reason)
+        stop_event (multiprocessing.Event) :
+            Set by the coordinator to stop the station after its current step
+    """
+    from SweepEngine import SweepEngine
+    # Ctrl+C reaches every process of the console, the coordinator stops the stations cleanly after their current step
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    name = station["name"]
+    instruments = {}
+    try:
+        plan = load_plan(station["plan"])
+        steps = compile_plan(expand_plan(plan))
+        instruments = connect_station(station)
+
+        def on_result(result):
+            messages.put(("result", name, result_row(name, result)))
+            if stop_event.is_set():
+                engine.stop()
+
+        engine = SweepEngine(on_result=on_result, on_failure=station.get("on_failure", "skip_pin"),
+                             data_directory=station.get("data_directory"), **instruments)
+        journal = CampaignJournal(station["journal"]) if station.get("journal") != None else None
+        messages.put(("started", name, len(steps)))
+        try:
+            engine.run(steps, journal=journal, silent=True)
+        finally:
+            if journal != None:
+                journal.close()
+        messages.put(("done", name, engine.detector.summary()))
+    except Exception as error:
+        messages.put(("error", name, repr(error)))
+    finally:
+        for instrument in instruments.values():
+            if instrument != None:
+                instrument.close()
+
+
+class StationStats():
+    """
+    Progress and throughput of one station
+
+    Attributes:
+        steps : int
+            Steps in the station's plan, None until it started
+        results : dict
+            status -> number of steps with that outcome
+        started, finished : float [units seconds]
+            time.perf_counter() when the station started measuring and when it finished
+        failures : dict
+            pin -> (failure reason, stress level), None for pins that passed
+        error : str
+            Why the station stopped, None if it did not fail
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.steps = None
+        self.results = {}
+        self.started = None
+        self.finished = None
+        self.last_result = None
+        self.failures = {}
+        self.error = None
+
+    @property
+    def completed(self):
+        return sum(self.results.values())
+
+    def elapsed(self):
+        if self.started == None:
+            return 0.0
+        end = self.finished if self.finished != None else self.last_result if self.last_result != None else self.started
+        return max(end - self.started, 0.0)
+
+    def throughput(self):
+        """Returns the steps per second measured so far"""
+        elapsed = self.elapsed()
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+
+class StationCoordinator():
+    """
+    Starts a worker process per station, writes their results to one file and tracks their throughput
+
+    Attributes:
+        stations : dict[]
+            The stations, with resolved resource names
+        results_path : str
+            JSON lines file every step result is appended to
+        stats : dict
+            station name -> StationStats
+    """
+
+    def __init__(self, stations, results_path="station_results.jsonl", discovery_cache=None, silent=False):
+        """
+        Args:
+            stations (dict[]) :
+                The stations (see load_stations())
+            results_path (str) : [optional] default="station_results.jsonl"
+                The shared results file
+            discovery_cache (DiscoveryCache) : [optional]
+                VISA discovery shared by the stations, an in memory cache if not given
+            silent (boolean) : [optional] default=False
+                Specifies if status remarks are made to the console, true no remarks are made
+        """
+        self.discovery_cache = DiscoveryCache() if discovery_cache == None else discovery_cache
+        self.stations = resolve_stations(stations, self.discovery_cache, silent)
+        self.results_path = results_path
+        self.silent = silent
+        self.stats = {station["name"]: StationStats(station["name"]) for station in self.stations}
+        # spawned workers start clean, a forked VISA or serial session of the parent must not be shared
+        self.context = multiprocessing.get_context("spawn")
+        self.stop_event = self.context.Event()
+        self.processes = {}
+
+    def stop(self):
+        """Stops every station after its current step"""
+        self.stop_event.set()
+
+    def handle(self, kind, name, payload, results_file):
+        stats = self.stats[name]
+        now = time.perf_counter()
+        if kind == "started":
+            stats.steps = payload
+            stats.started = now
+        elif kind == "result":
+            results_file.write(json.dumps(payload, separators=(",", ":")) + "\n")
+            stats.results[payload["status"]] = stats.results.get(payload["status"], 0) + 1
+            stats.last_result = now
+        elif kind == "done":
+            stats.failures = payload
+            stats.finished = now
+        elif kind == "error":
+            stats.error = payload
+            stats.finished = now
+            if not self.silent:
+                print(f"Station {name} stopped: {payload}")
+
+    def run(self, report_interval=10.0):
+        """
+        Runs all stations to completion
+
+        Args:
+            report_interval (float) : [optional] default=10.0 [units seconds]
+                Time between progress reports, None for none
+
+        Returns:
+            dict : station name -> StationStats
+        """
+        self.stop_event.clear()
+        messages = self.context.Queue()
+        for station in self.stations:
+            process = self.context.Process(target=run_station, args=(station, messages, self.stop_event),
+                                           name="Station-" + station["name"], daemon=True)
+            process.start()
+            self.processes[station["name"]] = process
+        running = set(self.processes)
+        last_report = time.perf_counter()
+        with open(self.results_path, "a") as results_file:
+            while running:
+                try:
+                    kind, name, payload = messages.get(timeout=0.5)
+                except KeyboardInterrupt:
+                    if not self.silent:
+                        print("Stopping stations after their current step")
+                    self.stop()
+                    continue
+                except queue.Empty:
+                    # a worker that died without a message (eg. killed) must not hang the run
+                    for name in list(running):
+                        if not self.processes[name].is_alive():
+                            self.handle("error", name, f"worker exited with code {self.processes[name].exitcode}", results_file)
+                            running.discard(name)
+                    continue
+                self.handle(kind, name, payload, results_file)
+                if kind in ("done", "error"):
+                    running.discard(name)
+                    results_file.flush()
+                if report_interval != None and not self.silent and time.perf_counter() - last_report > report_interval:
+                    results_file.flush()
+                    print(self.report())
+                    last_report = time.perf_counter()
+        for process in self.processes.values():
+            process.join()
+        return self.stats
+
+    def total_throughput(self):
+        """Returns the steps per second of all stations together, over the time any station was measuring"""
+        active = [stats for stats in self.stats.values() if stats.started != None]
+        if not active:
+            return 0.0
+        start = min(stats.started for stats in active)
+        end = max(stats.started + stats.elapsed() for stats in active)
+        return sum(stats.completed for stats in active) / (end - start) if end > start else 0.0
+
+    def report(self):
+        """
+        Returns:
+            str : one line per station with its progress, throughput and failed pins, and the total throughput
+        """
+        lines = ["Stations:"]
+        for stats in self.stats.values():
+            if stats.error != None:
+                state = "error: " + stats.error
+            elif stats.finished != None:
+                state = "done"
+            else:
+                state = "running" if stats.started != None else "starting"
+            failed = sum(failure != None for failure in stats.failures.values())
+            lines.append(f"  {stats.name:<12} {stats.completed:5d}/{stats.steps or 0:<5d} steps {stats.throughput():8.2f} steps/s "
+                         f"{failed:3d} failed pins  {state}")
+        lines.append(f"  total {self.total_throughput():.2f} steps/s")
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run several test stations concurrently from one host")
+    parser.add_argument("stations", help="JSON station file")
+    parser.add_argument("--results", default="station_results.jsonl", help="shared results file (JSON lines, appended)")
+    parser.add_argument("--discovery-cache", default="visa_discovery.json", help="VISA discovery cache file")
+    parser.add_argument("--discovery-max-age", type=float, default=3600.0, help="seconds a discovery cache stays valid")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="seconds between progress reports")
+    args = parser.parse_args(argv)
+
+    try:
+        stations = load_stations(args.stations)
+        coordinator = StationCoordinator(stations, args.results, DiscoveryCache(args.discovery_cache, args.discovery_max_age))
+    except (OSError, ValueError) as error:
+        print("Stations could not be started: " + str(error))
+        return 1
+    coordinator.run(args.report_interval)
+    print(coordinator.report())
+    return 0 if all(stats.error == None for stats in coordinator.stats.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+"""
+Runs compiled test plans (see TestPlan.py) on the instruments, with online failure detection (see FailureDetection.py).
+
+Settings are only sent when a step needs a different one than is in place. Every leakage point and every pulse is
+evaluated as soon as it is measured: a failing I-V sweep stops at the failing point, and the rest of the pin's steps
+are skipped (on_failure="skip_pin") or the whole run is stopped (on_failure="abort").
+
+With a CampaignJournal (see CampaignJournal.py) every step is journaled as it runs and an interrupted run resumes:
+committed steps are restored from the journal instead of measured again and replayed into the failure detector.
+"""
+import os
+import threading
+import time
+import numpy as np
+
+from CampaignJournal import step_key
+from FailureDetection import FailureDetector, tlp_current
+from PulseAnalysis import pulse_levels
+
+
+class StepResult():
+    """
+    Outcome of one plan step
+
+    Attributes:
+        step : TestPlan.PlanStep
+            The step
+        status : str
+            "done", "failed" (the pin failed during this step), "skipped" (the pin failed earlier) or "error"
+        values : dict
+            Measured values: "points" (setpoint, voltage, current) of an I-V sweep, "voltage" and "current" of a pulse, "s_parameters",
+            and "files" the data was saved to
+        elapsed : float [units seconds]
+            Time the step took including reconfiguration
+        failure : str
+            Why the pin failed, or the error, None otherwise
+    """
+
+    def __init__(self, step, status, values=None, elapsed=0.0, failure=None, restored=False, data_lost=False):
+        self.step = step
+        self.status = status
+        self.values = {} if values == None else values
+        self.elapsed = elapsed
+        self.failure = failure
+        # true if the result was restored from a campaign journal instead of measured
+        self.restored = restored
+        # true if the data files of a restored result are missing or changed
+        self.data_lost = data_lost
+
+    def __repr__(self):
+        return f"StepResult({self.step}, {self.status})"
+
+
+class SweepEngine():
+    """
+    Executes plan steps on the connected instruments
+
+    Attributes:
+        detector : FailureDetector
+            Evaluates the results as they arrive, None runs every step
+        on_failure : str
+            "skip_pin" skips the remaining steps of a failed pin, "abort" stops the run
+        state : dict
+            Configuration dimension -> setting currently in place (see TestPlan.DIMENSIONS)
+        results : StepResult[]
+            Results of the current run
+    """
+
+    FAILURE_POLICIES = ("skip_pin", "abort")
+
+    def __init__(self, oscilloscope=None, smu=None, controller=None, vna=None, detector=None, set_tlp_level=None,
+                 select_pin=None, on_failure="skip_pin", smu_channel="smu1", on_result=None, data_directory=None):
+        """
+        Args:
+            oscilloscope (Oscilloscope) : [optional]
+                Captures the pulses of "tlp" steps
+            smu (OscillaSMU) : [optional]
+                Measures "iv" steps
+            controller (TeensyController) : [optional]
+                Switches the relay path
+            vna (VNA) : [optional]
+                Measures "vna" steps
+            detector (FailureDetector) : [optional]
+                Failure detection, a FailureDetector with the default criteria if not given
+            set_tlp_level (callable) : [optional]
+                Called with the charge voltage when the TLP level changes (there is no TLP supply driver yet)
+            select_pin (callable) : [optional]
+                Called with the pin name when the pin changes (switch matrix or operator prompt)
+            on_failure (str) : [optional] default="skip_pin"
+                "skip_pin" or "abort"
+            smu_channel (str) : [optional] default="smu1"
+                The SMU channel connected to the DUT
+            on_result (callable) : [optional]
+                Called with every StepResult as soon as the step finished
+            data_directory (str) : [optional]
+                Pulse waveforms and S-parameters are saved here (.npz), nothing is saved if not given
+        """
+        if on_failure not in SweepEngine.FAILURE_POLICIES:
+            raise ValueError("Unsupported failure policy " + str(on_failure) + ", must be one of " + str(SweepEngine.FAILURE_POLICIES))
+        self.oscilloscope = oscilloscope
+        self.smu = smu
+        self.controller = controller
+        self.vna = vna
+        self.detector = FailureDetector() if detector == None else detector
+        self.set_tlp_level = set_tlp_level
+        self.select_pin = select_pin
+        self.on_failure = on_failure
+        self.smu_channel = smu_channel
+        self.on_result = on_result
+        self.data_directory = data_directory
+        if data_directory != None:
+            os.makedirs(data_directory, exist_ok=True)
+        self.state = {}
+        self.results = []
+        self.stop_event = threading.Event()
+
+
+    def stop(self):
+        """Stops the run after the current step, can be called from another thread"""
+        self.stop_event.set()
+
+
+    def invalidate_state(self):
+        """Forgets the settings in place, every setting is sent again (eg. after an instrument reconnected)"""
+        self.state = {}
+
+
+    def configure(self, step):
+        """Sends the settings the step needs that are not already in place"""
+        for dimension, setting in step.config.items():
+            if self.state.get(dimension) == setting:
+                continue
+            if dimension == "pin" and self.select_pin != None:
+                self.select_pin(setting)
+            elif dimension == "relay_path" and self.controller != None:
+                self.controller.select_path(setting)
+            elif dimension == "scope_setup" and self.oscilloscope != None:
+                channel, trigger_voltage, resolution, acquisition_time = setting
+                self.oscilloscope.set_acquisition_time(acquisition_time)
+                self.oscilloscope.set_acquisition_record_length(acquisition_time / resolution)
+                self.oscilloscope.set_trigger_voltage(trigger_voltage, channel)
+            elif dimension == "smu_range" and self.smu != None:
+                self.smu.set_range(setting, self.smu_channel)
+            elif dimension == "tlp_level" and self.set_tlp_level != None:
+                self.set_tlp_level(setting)
+            elif dimension == "vna_setup" and self.vna != None:
+                start, stop, resolution = setting
+                self.vna.configure_linear_sweep(start, stop, int(round((stop - start) / resolution)) + 1)
+            self.state[dimension] = setting
+
+
+    def identities(self):
+        """Returns instrument name -> identity (*IDN? or similar) of the instruments the engine uses"""
+        instruments = {"oscilloscope": self.oscilloscope, "smu": self.smu, "controller": self.controller, "vna": self.vna}
+        return {name: str(getattr(instrument, "device_name", type(instrument).__name__))
+                for name, instrument in instruments.items() if instrument != None}
+
+
+    def data_path(self, step):
+        """Returns the data file of a step, None if data is not saved"""
+        if self.data_directory == None:
+            return None
+        return os.path.join(self.data_directory, f"{step.pin}_{step.measurement}_{step.level:g}V_{step.stage}.npz")
+
+
+    def measure_tlp(self, step):
+        channel = step.parameters["osc_trigger_channel"]
+        waveform = self.oscilloscope.record_waveform_raw(channel=channel, silent=True)
+        if waveform is None:
+            raise RuntimeError("pulse capture failed")
+        _, voltage = pulse_levels(waveform.voltages)
+        current = tlp_current(step.level, voltage)
+        failure = self.detector.add_pulse(step.pin, step.level, voltage, current) if self.detector != None else None
+        values = {"voltage": voltage, "current": current}
+        path = self.data_path(step)
+        if path != None:
+            np.savez(path, voltages=waveform.voltages, start_time=waveform.start_time, stop_time=waveform.stop_time)
+            values["files"] = [path]
+        return values, failure
+
+
+    def measure_iv(self, step):
+        parameters = step.parameters
+        voltages = np.arange(parameters["smu_voltage_min"], parameters["smu_voltage_max"] + parameters["smu_voltage_increment"] / 2,
+                             parameters["smu_voltage_increment"])
+        self.smu.set_enabled(True, self.smu_channel)
+        points = []
+        failure = None
+        try:
+            for voltage in voltages:
+                self.smu.set_voltage(float(voltage), self.smu_channel)
+                if parameters["smu_settle_time"] > 0:
+                    time.sleep(parameters["smu_settle_time"])
+                measured_voltage, current = self.smu.make_measurement(float(voltage), self.smu_channel)
+                points.append((float(voltage), measured_voltage, current))
+                if self.detector != None:
+                    failure = self.detector.add_leakage_point(step.pin, measured_voltage, current, float(voltage))
+                    # the remaining points would only stress a failed part further
+                    if failure != None:
+                        break
+        finally:
+            self.smu.set_voltage(0, self.smu_channel)
+        return {"points": points}, failure
+
+
+    def measure_vna(self, step):
+        frequencies, s_parameters = self.vna.measure_s_parameters()
+        if s_parameters == None:
+            raise RuntimeError("S-parameter measurement failed")
+        values = {"frequencies": frequencies, "s_parameters": s_parameters}
+        path = self.data_path(step)
+        if path != None:
+            np.savez(path, frequencies=frequencies, **s_parameters)
+            values["files"] = [path]
+        return values, None
+
+
+    def restore(self, step, record):
+        """Rebuilds the result of a journaled step and replays it into the failure detector"""
+        values = record.get("values", {})
+        if self.detector != None and record["status"] != "skipped":
+            if step.measurement == "tlp" and "voltage" in values:
+                self.detector.add_pulse(step.pin, step.level, values["voltage"], values["current"])
+            elif step.measurement == "iv":
+                for setpoint, voltage, current in values.get("points", []):
+                    self.detector.add_leakage_point(step.pin, voltage, current, setpoint)
+        return StepResult(step, record["status"], values, record.get("elapsed", 0.0), record.get("failure"), restored=True)
+
+
+    def run_step(self, step):
+        """
+        Configures and measures one step
+
+        Returns:
+            StepResult : the outcome
+        """
+        start = time.perf_counter()
+        if self.detector != None and self.detector.failed(step.pin):
+            return StepResult(step, "skipped", failure=self.detector.failure(step.pin))
+        instrument = {"tlp": self.oscilloscope, "iv": self.smu, "vna": self.vna}[step.measurement]
+        if instrument == None:
+            return StepResult(step, "error", failure="no instrument for " + step.measurement)
+        try:
+            self.configure(step)
+            measure = {"tlp": self.measure_tlp, "iv": self.measure_iv, "vna": self.measure_vna}[step.measurement]
+            values, failure = measure(step)
+        except Exception as error:
+            # the instrument state is unknown after a failed command
+            self.invalidate_state()
+            return StepResult(step, "error", elapsed=time.perf_counter() - start, failure=repr(error))
+        status = "done" if failure == None else "failed"
+        return StepResult(step, status, values, time.perf_counter() - start, failure)
+
+
+    def run(self, steps, journal=None, silent=False):
+        """
+        Runs steps in order until all are done, the run is stopped or (on_failure="abort") a pin fails
+
+        Args:
+            steps (PlanStep[]) :
+                Steps in run order, eg. from TestPlan.compile_plan()
+            journal (CampaignJournal) : [optional]
+                Journals every step, steps it already holds are restored instead of run (opened for steps if needed)
+            silent (boolean) : [optional] default=False
+                Specifies if status remarks are made to the console, true no remarks are made
+
+        Returns:
+            StepResult[] : a result per step that was started, skipped steps included
+        """
+        self.stop_event.clear()
+        self.results = []
+        identities = self.identities()
+        if journal != None:
+            if journal.plan == None:
+                journal.open(steps, silent=silent)
+            journal.check_identities(identities, silent=silent)
+            # nothing sent before the restart can be assumed to be in place
+            self.invalidate_state()
+        for step in steps:
+            if self.stop_event.is_set():
+                if not silent:
+                    print("Sweep stopped")
+                break
+            record = journal.committed.get(step_key(step)) if journal != None else None
+            if record != None:
+                result = self.restore(step, record)
+                result.data_lost = step_key(step) in journal.data_lost
+            else:
+                if journal != None and not (self.detector != None and self.detector.failed(step.pin)):
+                    journal.begin(step)
+                result = self.run_step(step)
+                # errors are not committed, the step runs again on resume
+                if journal != None and result.status != "error":
+                    journal.commit(step, result, dict(self.state), identities)
+            self.results.append(result)
+            if self.on_result != None:
+                self.on_result(result)
+            if result.status == "failed":
+                if not silent:
+                    print(f"Pin {step.pin} failed at {step.level:g} V: {result.failure}")
+                if self.on_failure == "abort":
+                    break
+            elif result.status == "error" and not silent:
+                print(f"Step {step} failed: {result.failure}")
+        return self.results
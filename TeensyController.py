@@ -0,0 +1,502 @@
+"""
+Driver for the Teensy relay controller over USB serial with a compact binary framed protocol.
+
+Frame (both directions):
+    0xA5 0x5A | seq (u8) | command (u8) | length (u8) | payload (length bytes) | CRC-16/CCITT-FALSE of seq..payload (u16 LE)
+
+Every command frame is acknowledged by a frame with the same sequence number and command | 0x80, its payload starts with
+a status byte (0 = ok). Commands are pipelined: send() returns immediately and several frames can be in flight,
+wait() collects an acknowledgement and retransmits frames that were not acknowledged in time.
+
+A retransmitted frame can arrive after newer ones, so the controller keeps the sequence number of the frame that last
+set each relay and only applies a relay state from a newer frame. The 8 bit sequence numbers wrap, so both sides extend
+them to a counter that never wraps, relative to the newest frame seen (see unwrap_seq()): frames in flight are at most
+128 apart, while the frame that last set a relay can be arbitrarily old. CMD_VERSION, sent on connect, resets this
+ordering state.
+"""
+import binascii
+import struct
+import threading
+import time
+import serial
+
+
+SYNC = b"\xA5\x5A"
+HEADER_LENGTH = 5 # sync, seq, command, length
+MAX_PAYLOAD = 255
+ACK_FLAG = 0x80
+
+CMD_PING = 0x01
+CMD_VERSION = 0x02
+CMD_SET_RELAYS = 0x03 # payload: mask (u8), states (u8), only relays in the mask change
+CMD_GET_RELAYS = 0x04 # acknowledgement payload: status, states (u8)
+
+STATUS_OK = 0
+STATUS_BAD_COMMAND = 1
+STATUS_BAD_PAYLOAD = 2
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF)"""
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def unwrap_seq(seq, reference):
+    """
+    Extends an 8 bit sequence number to a counter that never wraps
+
+    Args:
+        seq (int) :
+            The sequence number of a frame (modulo 256)
+        reference (int) :
+            Extended sequence number of the newest frame seen, None if there is none
+
+    Returns:
+        int : the extended sequence number closest to reference (at most 128 before, 127 after) that matches seq
+    """
+    if reference == None:
+        return seq
+    delta = (seq - reference) & 0xFF
+    return reference + (delta - 256 if delta >= 128 else delta)
+
+
+def encode_frame(seq, command, payload=b""):
+    """
+    Returns:
+        bytes : the frame
+    """
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError("Payload too long: " + str(len(payload)) + " bytes")
+    body = struct.pack("<BBB", seq & 0xFF, command, len(payload)) + bytes(payload)
+    return SYNC + body + struct.pack("<H", crc16(body))
+
+
+class FrameDecoder():
+    """
+    Incremental frame parser, bytes are fed as they arrive. Frames with a bad CRC are dropped and the parser
+    resynchronises on the next sync word.
+
+    Attributes:
+        crc_errors : int
+            Frames dropped for a bad CRC
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.crc_errors = 0
+
+    def feed(self, data):
+        """
+        Returns:
+            list of (seq, command, payload) : the frames completed by data
+        """
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(SYNC)
+            if start < 0:
+                # keep a trailing first sync byte, the second may still arrive
+                del self.buffer[:max(0, len(self.buffer) - 1)]
+                return frames
+            del self.buffer[:start]
+            if len(self.buffer) < HEADER_LENGTH:
+                return frames
+            length = self.buffer[4]
+            end = HEADER_LENGTH + length + 2
+            if len(self.buffer) < end:
+                return frames
+            body = bytes(self.buffer[2:HEADER_LENGTH + length])
+            if struct.unpack("<H", self.buffer[end - 2:end])[0] != crc16(body):
+                self.crc_errors += 1
+                # skip this sync word only, a real frame may start inside the corrupted one
+                del self.buffer[:2]
+                continue
+            del self.buffer[:end]
+            frames.append((body[0], body[1], body[3:]))
+
+
+class TeensyController():
+    """
+    Relay controller on a Teensy microcontroller
+
+    Attributes:
+        com_port : str
+            The serial port of the Teensy, eg. 'COM4'
+        device : serial.Serial
+            The open port, None if not connected
+        device_name : str
+            Firmware version string of the connected controller
+        relay_states : dict
+            relay number (1-4) -> state last acknowledged by the controller
+        timeout : float [units seconds]
+            Time an acknowledgement is waited for before the frame is retransmitted
+        retries : int
+            Retransmissions of an unacknowledged frame before it fails
+        max_in_flight : int
+            Frames sent without waiting for their acknowledgement before send() blocks
+        failures : int
+            Frames that were rejected or never acknowledged
+    """
+
+    RELAY_COUNT = 4
+
+    # relay states of the measurement paths, relay 1 connects the DUT to the TLP and relay 2 to the SMU
+    # adjust to the wiring of the test fixture
+    RELAY_PATHS = {
+        "tlp": {1: True, 2: False},
+        "smu": {1: False, 2: True},
+        "open": {1: False, 2: False},
+    }
+
+    def __init__(self, com_port=None, serial_factory=None, baud_rate=115200, timeout=0.1, retries=2, max_in_flight=16):
+        """
+        Initializes the controller object with no connection.
+
+        Args:
+            com_port (str) : [optional]
+                The serial port the controller will connect to
+            serial_factory (callable) : [optional]
+                Called with (port, baud rate) to open the port, serial.Serial if not given
+            baud_rate (int) : [optional] default=115200
+                Ignored by the Teensy USB serial, which always runs at USB speed
+            timeout (float) : [optional] default=0.1 [units seconds]
+                Acknowledgement timeout per attempt
+            retries (int) : [optional] default=2
+                Retransmissions of an unacknowledged frame
+            max_in_flight (int) : [optional] default=16
+                Most unacknowledged frames, at most 128 so sequence numbers are never reused while in flight
+        """
+        self.com_port = com_port
+        self.serial_factory = serial_factory
+        self.baud_rate = baud_rate
+        self.timeout = timeout
+        self.retries = retries
+        self.max_in_flight = min(max_in_flight, 128)
+        self.device = None
+        self.device_name = "No Device Connected!"
+        self.relay_states = {relay: False for relay in range(1, TeensyController.RELAY_COUNT + 1)}
+        # relay number -> extended sequence number of the acknowledged frame the state came from
+        self.relay_sequences = {}
+
+        self.decoder = FrameDecoder()
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        # extended sequence number of the next frame, the frame carries it modulo 256
+        self.sequence = 0
+        self.failures = 0
+        # seq -> [frame, command, send time, attempts, response collected by wait(), extended sequence number]
+        self.pending = {}
+        # seq -> (command, status, data) of acknowledgements not collected by wait() yet
+        self.responses = {}
+        self.reader = None
+        self.running = False
+
+
+    def set_com_port(self, com_port):
+        self.com_port = com_port
+
+
+    def connect(self, com_port=None):
+        """
+        Opens the serial port, starts the reader thread and reads the firmware version
+
+        Args:
+            com_port (str) : [optional]
+                The serial port, the one given before if not provided
+
+        Returns:
+            boolean : true if the controller answered
+        """
+        if com_port != None:
+            self.com_port = com_port
+        if self.com_port == None:
+            print("No controller port specified")
+            return False
+        self.close()
+
+        try:
+            if self.serial_factory != None:
+                self.device = self.serial_factory(self.com_port, self.baud_rate)
+            else:
+                self.device = serial.Serial(self.com_port, self.baud_rate, timeout=0.01)
+        except serial.serialutil.SerialException:
+            print("Failed to connect to controller on " + str(self.com_port))
+            self.device = None
+            return False
+
+        self.decoder = FrameDecoder()
+        self.relay_sequences = {}
+        self.running = True
+        self.reader = threading.Thread(target=self._read_loop, name="TeensyReader", daemon=True)
+        self.reader.start()
+
+        version = self.request(CMD_VERSION)
+        if version == None:
+            print("Failed to get response from controller on " + str(self.com_port))
+            self.close()
+            return False
+        self.device_name = "Teensy " + version.decode(errors="replace")
+        states = self.request(CMD_GET_RELAYS)
+        if states != None and len(states) > 0:
+            self._store_states(0xFF, states[0])
+        print("Successfully connected to controller on port: " + str(self.com_port))
+        return True
+
+
+    def close(self):
+        """Closes the connection, frames still in flight are abandoned"""
+        self.running = False
+        if self.device != None:
+            try:
+                self.device.close()
+            except (serial.serialutil.SerialException, OSError):
+                pass
+        if self.reader != None:
+            self.reader.join(timeout=1.0)
+            self.reader = None
+        self.device = None
+        self.device_name = "No Device Connected!"
+        with self.condition:
+            self.pending.clear()
+            self.responses.clear()
+            self.condition.notify_all()
+
+
+    def check_connection(self, silent=False):
+        """
+        Pings the controller
+
+        Returns:
+            boolean: true if the controller answered
+        """
+        if self.device == None:
+            if not silent:
+                print("No Controller Connected")
+            return False
+        if self.request(CMD_PING) == None:
+            print("Failed to get response from controller")
+            return False
+        if not silent:
+            print("Connected to: " + self.device_name)
+        return True
+
+
+    def send(self, command, payload=b"", collect=True):
+        """
+        Sends a command frame without waiting for its acknowledgement (pipelining), blocks only while
+        max_in_flight frames are unacknowledged
+
+        Args:
+            command (int) :
+                One of the CMD_ values
+            payload (bytes) : [optional]
+                The command arguments
+            collect (boolean) : [optional] default=True
+                Keeps the acknowledgement for wait() if true, otherwise it is only checked (see flush())
+
+        Returns:
+            int : the sequence number to wait() for, None if not connected
+        """
+        if self.device == None:
+            return None
+        with self.condition:
+            while len(self.pending) >= self.max_in_flight and self.running:
+                if not self.condition.wait(self.timeout * (self.retries + 1)):
+                    self._retransmit_expired()
+            sequence = self.sequence
+            self.sequence += 1
+            seq = sequence & 0xFF
+            frame = encode_frame(seq, command, payload)
+            self.pending[seq] = [frame, command, time.perf_counter(), 1, collect, sequence]
+        self._write(frame)
+        return seq
+
+
+    def wait(self, seq, timeout=None):
+        """
+        Waits for the acknowledgement of a frame, retransmitting it when it is not acknowledged in time
+
+        Args:
+            seq (int) :
+                Sequence number returned by send()
+            timeout (float) : [optional] [units seconds]
+                Time per attempt, self.timeout if not given
+
+        Returns:
+            bytes : the acknowledgement data after the status byte, None if it failed or was never acknowledged
+        """
+        if seq == None:
+            return None
+        timeout = self.timeout if timeout == None else timeout
+        with self.condition:
+            while seq not in self.responses:
+                if seq not in self.pending:
+                    return None
+                entry = self.pending[seq]
+                remaining = entry[2] + timeout - time.perf_counter()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                if entry[3] > self.retries:
+                    del self.pending[seq]
+                    self.failures += 1
+                    self.condition.notify_all()
+                    print("Controller did not acknowledge command " + hex(entry[1]))
+                    return None
+                entry[2] = time.perf_counter()
+                entry[3] += 1
+                self._write(entry[0])
+            command, status, data = self.responses.pop(seq)
+        if status != STATUS_OK:
+            print("Controller rejected command " + hex(command) + " with status " + str(status))
+            return None
+        return data
+
+
+    def request(self, command, payload=b""):
+        """Sends a command and waits for its acknowledgement, see wait()"""
+        return self.wait(self.send(command, payload))
+
+
+    def flush(self):
+        """
+        Waits until every frame in flight has been acknowledged or has failed, acknowledgements not collected by
+        wait() yet are discarded
+
+        Returns:
+            boolean : true if no frame failed since the last flush
+        """
+        with self.condition:
+            for seq in list(self.pending):
+                self.pending[seq][4] = False
+        with self.condition:
+            while len(self.pending) > 0 and self.running:
+                if not self.condition.wait(self.timeout):
+                    self._retransmit_expired()
+            self.responses.clear()
+            failures = self.failures
+            self.failures = 0
+        return failures == 0
+
+
+    def set_relays(self, states, wait=True):
+        """
+        Sets several relays in one frame
+
+        Args:
+            states (dict) :
+                relay number (1-4) -> state (true closes the relay), relays not given keep their state
+            wait (boolean) : [optional] default=True
+                Waits for the acknowledgement if true, otherwise returns once the frame is sent (see flush())
+
+        Returns:
+            boolean : true if acknowledged (or sent when not waiting)
+        """
+        mask = 0
+        values = 0
+        for relay, state in states.items():
+            if not 1 <= relay <= TeensyController.RELAY_COUNT:
+                raise ValueError("Invalid relay " + str(relay))
+            mask |= 1 << (relay - 1)
+            if state:
+                values |= 1 << (relay - 1)
+        seq = self.send(CMD_SET_RELAYS, bytes((mask, values)), collect=wait)
+        if seq == None:
+            print("Controller Not Connected")
+            return False
+        if not wait:
+            return True
+        return self.wait(seq) != None
+
+
+    def set_relay(self, relay, state, wait=True):
+        return self.set_relays({relay: state}, wait)
+
+
+    def select_path(self, path, wait=True):
+        """
+        Switches the relays to a measurement path in one frame
+
+        Args:
+            path (str) :
+                A key of RELAY_PATHS, eg. "tlp" or "smu"
+        """
+        return self.set_relays(TeensyController.RELAY_PATHS[path], wait)
+
+
+    def get_relays(self):
+        """
+        Reads the relay states from the controller
+
+        Returns:
+            dict : relay number -> state, None if the controller did not answer
+        """
+        data = self.request(CMD_GET_RELAYS)
+        if data == None or len(data) < 1:
+            return None
+        self._store_states(0xFF, data[0])
+        return dict(self.relay_states)
+
+
+    def _store_states(self, mask, values, sequence=None):
+        for relay in self.relay_states:
+            bit = 1 << (relay - 1)
+            if mask & bit and (sequence == None or sequence > self.relay_sequences.get(relay, -1)):
+                self.relay_states[relay] = bool(values & bit)
+                if sequence != None:
+                    self.relay_sequences[relay] = sequence
+
+
+    def _write(self, frame):
+        with self.write_lock:
+            try:
+                self.device.write(frame)
+            except (serial.serialutil.SerialException, OSError, AttributeError):
+                # the reader notices the lost port, wait() times out
+                pass
+
+
+    def _retransmit_expired(self):
+        # called with the condition held while send() is blocked on a full window
+        now = time.perf_counter()
+        for seq, entry in list(self.pending.items()):
+            if now - entry[2] < self.timeout:
+                continue
+            if entry[3] > self.retries:
+                del self.pending[seq]
+                self.failures += 1
+                print("Controller did not acknowledge command " + hex(entry[1]))
+            else:
+                entry[2] = now
+                entry[3] += 1
+                self._write(entry[0])
+
+
+    def _read_loop(self):
+        while self.running:
+            try:
+                data = self.device.read(max(1, self.device.in_waiting))
+            except (serial.serialutil.SerialException, OSError, TypeError, AttributeError):
+                if self.running:
+                    print("Controller connection lost")
+                break
+            if not data:
+                continue
+            for seq, command, payload in self.decoder.feed(data):
+                if not command & ACK_FLAG:
+                    continue
+                with self.condition:
+                    entry = self.pending.pop(seq, None)
+                    if entry == None:
+                        # late acknowledgement of a retransmitted or abandoned frame
+                        continue
+                    status = payload[0] if len(payload) else STATUS_BAD_PAYLOAD
+                    if status == STATUS_OK and entry[1] == CMD_SET_RELAYS:
+                        mask, values = entry[0][HEADER_LENGTH + 0], entry[0][HEADER_LENGTH + 1]
+                        self._store_states(mask, values, entry[5])
+                    if entry[4]:
+                        self.responses[seq] = (entry[1], status, bytes(payload[1:]))
+                    elif status != STATUS_OK:
+                        self.failures += 1
+                        print("Controller rejected command " + hex(entry[1]) + " with status " + str(status))
+                    self.condition.notify_all()
@@ -0,0 +1,406 @@
+"""
+Declarative test plans and a compiler that orders their steps to minimize instrument reconfiguration.
+
+A plan is JSON (or a dict) of groups of pins, each with the measurements to run and parameter_dictionary overrides:
+    {
+        "name": "HBM qualification",
+        "parameters": {"tlp_voltage_min": 500, "tlp_voltage_max": 2000, "tlp_voltage_increment": 500},
+        "groups": [
+            {"pins": ["IO1", "IO2", "IO3"], "measurements": ["tlp", "iv"]},
+            {"pins": ["VDD"], "measurements": ["tlp", "iv", "vna"], "parameters": {"smu_current_max": 0.002}}
+        ]
+    }
+
+"tlp" is the stress: one pulse per level from tlp_voltage_min to tlp_voltage_max. Every other measurement ("iv" leakage
+sweep, "vna" S-parameter check) runs once before the first pulse (the baseline, unless "baseline": false) and after
+every level. Per pin the stress must stay ascending and every check must run after its level and before the next one,
+all other orderings are free: the compiler interleaves pins so steps that share a configuration (pin, relay path, scope
+setup, SMU range, TLP charge voltage, VNA sweep) run back to back.
+
+Usage:
+    python TestPlan.py plan.json                              estimate naive and compiled runtime
+    python TestPlan.py plan.json --costs bench_results.json   with costs measured by AcquisitionBenchmark.py
+    python TestPlan.py plan.json --list                       print the compiled step order
+"""
+import argparse
+import json
+import sys
+import numpy as np
+
+
+DEFAULT_PARAMETERS = {
+    "osc_trigger_channel": 1,
+    "osc_trigger_voltage": 1,
+    "osc_waveform_resolution": 0.001,
+    "osc_acquisition_time": 1.0,
+
+    "smu_voltage_max": 5.0,
+    "smu_voltage_min": 0.0,
+    "smu_voltage_increment": 0.1,
+    "smu_settle_time": 0.01,
+    "smu_current_max": 0.02,
+
+    "tlp_voltage_max": 2000,
+    "tlp_voltage_min": 500,
+    "tlp_voltage_increment": 500,
+
+    "vna_freq_max": 1000000,
+    "vna_freq_min": 100000,
+    "vna_freq_resolution": 1000
+}
+
+MEASUREMENTS = ("tlp", "iv", "vna")
+
+# relay path (TeensyController.RELAY_PATHS) each measurement needs, the VNA sees the DUT with both paths open
+RELAY_PATH = {"tlp": "tlp", "iv": "smu", "vna": "open"}
+
+# configuration dimensions, in the order they are applied before a step
+DIMENSIONS = ("pin", "relay_path", "scope_setup", "smu_range", "tlp_level", "vna_setup")
+
+# Xtralien SMU current ranges (range -> full scale current in A), the most sensitive range covering smu_current_max is used
+SMU_RANGES = {5: 20E-6, 4: 200E-6, 3: 2E-3, 2: 20E-3, 1: 200E-3}
+
+# seconds per operation: reconfiguring a dimension and running a measurement.
+# Estimates for a typical bench, replace them with measured values (costs_from_benchmark(), a --costs file)
+DEFAULT_COSTS = {
+    "pin": 0.1,            # switch matrix / probe selection
+    "relay_path": 0.005,   # relay command and contact settling
+    "scope_setup": 0.05,   # trigger and timebase setup
+    "smu_range": 0.02,     # range change and settling
+    "tlp_level": 1.0,      # charging the TLP supply to a new voltage
+    "vna_setup": 0.1,      # sweep setup
+    "tlp_pulse": 0.2,      # one pulse and waveform capture
+    "iv_point": 0.005,     # one SMU measurement, without the settle time
+    "vna_sweep": 0.05,     # one S-parameter check
+}
+
+
+def smu_range_for(current_max):
+    """Returns the most sensitive SMU range whose full scale covers current_max, range 1 if none does"""
+    for smu_range in sorted(SMU_RANGES, reverse=True):
+        if SMU_RANGES[smu_range] >= current_max:
+            return smu_range
+    return 1
+
+
+def stress_levels(parameters):
+    """Returns the TLP voltages from tlp_voltage_min to tlp_voltage_max (inclusive) in tlp_voltage_increment steps"""
+    low, high, step = parameters["tlp_voltage_min"], parameters["tlp_voltage_max"], parameters["tlp_voltage_increment"]
+    if step <= 0 or high < low:
+        raise ValueError(f"Invalid TLP voltage range {low} to {high} in steps of {step}")
+    return [float(level) for level in np.arange(low, high + step / 2, step)]
+
+
+def sweep_points(parameters):
+    """Returns the number of SMU voltages of an I-V sweep"""
+    low, high, step = parameters["smu_voltage_min"], parameters["smu_voltage_max"], parameters["smu_voltage_increment"]
+    if step <= 0 or high < low:
+        raise ValueError(f"Invalid SMU voltage range {low} to {high} in steps of {step}")
+    return int(round((high - low) / step)) + 1
+
+
+class PlanStep():
+    """
+    One measurement of a compiled plan
+
+    Attributes:
+        pin : str
+            The pin measured
+        measurement : str
+            "tlp", "iv" or "vna"
+        level : float [units V]
+            TLP level of the pulse, for checks the level last applied to the pin (0 for the baseline)
+        stage : int
+            Position in the pin's sequence, a pin's stages run in order and steps within a stage in any order
+        parameters : dict
+            The parameter_dictionary the step runs with
+        config : dict
+            dimension -> setting the step needs, dimensions it does not care about are absent
+        index : int
+            Position in the uncompiled (plan) order
+    """
+
+    def __init__(self, pin, measurement, level, stage, parameters, index):
+        self.pin = pin
+        self.measurement = measurement
+        self.level = level
+        self.stage = stage
+        self.parameters = parameters
+        self.index = index
+        self.config = {"pin": pin, "relay_path": RELAY_PATH[measurement]}
+        if measurement == "tlp":
+            self.config["scope_setup"] = (parameters["osc_trigger_channel"], parameters["osc_trigger_voltage"],
+                                          parameters["osc_waveform_resolution"], parameters["osc_acquisition_time"])
+            self.config["tlp_level"] = level
+        elif measurement == "iv":
+            self.config["smu_range"] = smu_range_for(parameters["smu_current_max"])
+        elif measurement == "vna":
+            self.config["vna_setup"] = (parameters["vna_freq_min"], parameters["vna_freq_max"], parameters["vna_freq_resolution"])
+
+    def __repr__(self):
+        return f"PlanStep({self.pin}, {self.measurement}, {self.level:g} V, stage {self.stage})"
+
+    def duration(self, costs):
+        """Returns the estimated run time of the measurement itself in seconds, without reconfiguration"""
+        if self.measurement == "tlp":
+            return costs["tlp_pulse"]
+        if self.measurement == "iv":
+            return sweep_points(self.parameters) * (costs["iv_point"] + self.parameters["smu_settle_time"])
+        return costs["vna_sweep"]
+
+    def as_dict(self):
+        return {"pin": self.pin, "measurement": self.measurement, "level": self.level, "stage": self.stage,
+                "parameters": self.parameters}
+
+
+def load_plan(path):
+    """Reads a JSON plan file"""
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def expand_plan(plan, base_parameters=None):
+    """
+    Expands a plan into its steps in plan order: group by group, pin by pin, stage by stage
+
+    Args:
+        plan (dict) :
+            The plan, see the module docstring
+        base_parameters (dict) : [optional]
+            parameter_dictionary the plan's overrides apply to, DEFAULT_PARAMETERS if not given
+
+    Returns:
+        PlanStep[] : the steps
+    """
+    base = dict(DEFAULT_PARAMETERS if base_parameters == None else base_parameters)
+    plan_parameters = plan.get("parameters", {})
+    groups = plan.get("groups", [])
+    if not groups:
+        raise ValueError("Test plan has no groups")
+
+    steps = []
+    next_stage = {}
+    for group_index, group in enumerate(groups):
+        parameters = dict(base)
+        for overrides in (plan_parameters, group.get("parameters", {})):
+            unknown = [key for key in overrides if key not in base]
+            if unknown:
+                raise ValueError(f"Unknown parameters in group {group_index}: {unknown}")
+            parameters.update(overrides)
+        measurements = group.get("measurements", ["tlp", "iv"])
+        unknown = [measurement for measurement in measurements if measurement not in MEASUREMENTS]
+        if unknown:
+            raise ValueError(f"Unknown measurements in group {group_index}: {unknown}, must be from {MEASUREMENTS}")
+        if not group.get("pins"):
+            raise ValueError(f"Group {group_index} has no pins")
+
+        checks = [measurement for measurement in measurements if measurement != "tlp"]
+        # a stage is a set of steps without order constraints between them
+        stages = []
+        if checks and group.get("baseline", True):
+            stages.append([("check", measurement, 0.0) for measurement in checks])
+        if "tlp" in measurements:
+            for level in stress_levels(parameters):
+                stages.append([("stress", "tlp", level)])
+                if checks:
+                    stages.append([("check", measurement, level) for measurement in checks])
+
+        for pin in group["pins"]:
+            pin = str(pin)
+            # a pin listed in several groups continues after its earlier stages
+            stage = next_stage.get(pin, 0)
+            for stage_steps in stages:
+                for _, measurement, level in stage_steps:
+                    steps.append(PlanStep(pin, measurement, level, stage, parameters, len(steps)))
+                stage += 1
+            next_stage[pin] = stage
+    check_stress_order(steps)
+    return steps
+
+
+def check_stress_order(steps):
+    """Raises ValueError if the TLP levels of a pin are not ascending in the given order"""
+    last_level = {}
+    for step in steps:
+        if step.measurement != "tlp":
+            continue
+        if step.level < last_level.get(step.pin, -np.inf):
+            raise ValueError(f"Stress on pin {step.pin} is not ascending: {step.level:g} V after {last_level[step.pin]:g} V")
+        last_level[step.pin] = step.level
+
+
+def transition_cost(state, config, costs):
+    """Returns the reconfiguration time from state (dimension -> current setting) to the configuration a step needs"""
+    return sum(costs[dimension] for dimension, setting in config.items() if state.get(dimension) != setting)
+
+
+def compile_plan(steps, costs=None):
+    """
+    Orders the steps to minimize reconfiguration while keeping every pin's stages in order.
+    Greedy: the next step is the ready step (in the current stage of its pin) that is cheapest to configure from the
+    current instrument state, ties go to plan order
+
+    Args:
+        steps (PlanStep[]) :
+            Steps as returned by expand_plan()
+        costs (dict) : [optional]
+            Operation costs, DEFAULT_COSTS if not given
+
+    Returns:
+        PlanStep[] : the steps in run order
+    """
+    costs = DEFAULT_COSTS if costs == None else costs
+    stages = {}
+    for step in steps:
+        stages.setdefault(step.pin, {}).setdefault(step.stage, []).append(step)
+    pending = {pin: [pin_stages[stage] for stage in sorted(pin_stages)] for pin, pin_stages in stages.items()}
+
+    ordered = []
+    state = {}
+    while pending:
+        ready = [step for pin_stages in pending.values() for step in pin_stages[0]]
+        step = min(ready, key=lambda step: (transition_cost(state, step.config, costs), step.index))
+        ordered.append(step)
+        state.update(step.config)
+        pin_stages = pending[step.pin]
+        pin_stages[0].remove(step)
+        if not pin_stages[0]:
+            pin_stages.pop(0)
+            if not pin_stages:
+                del pending[step.pin]
+    return ordered
+
+
+def estimate_runtime(steps, costs=None, skip_unchanged=True):
+    """
+    Estimates the run time of steps in the given order
+
+    Args:
+        steps (PlanStep[]) :
+            The steps in run order
+        costs (dict) : [optional]
+            Operation costs, DEFAULT_COSTS if not given
+        skip_unchanged (boolean) : [optional] default=True
+            Settings already in place are not sent again. False models a runner reconfiguring everything every step
+
+    Returns:
+        dict : "total" run time [units seconds], "measurement" time, "reconfiguration" time and "changes" per dimension
+    """
+    costs = DEFAULT_COSTS if costs == None else costs
+    state = {}
+    changes = {dimension: 0 for dimension in DIMENSIONS}
+    measurement = 0.0
+    reconfiguration = 0.0
+    for step in steps:
+        for dimension, setting in step.config.items():
+            if skip_unchanged and state.get(dimension) == setting:
+                continue
+            changes[dimension] += 1
+            reconfiguration += costs[dimension]
+        state.update(step.config)
+        measurement += step.duration(costs)
+    return {"total": measurement + reconfiguration, "measurement": measurement, "reconfiguration": reconfiguration,
+            "changes": changes, "steps": len(steps)}
+
+
+def costs_from_benchmark(results, costs=None):
+    """
+    Takes the operation costs the benchmarks measure from AcquisitionBenchmark.py results, other costs are kept
+
+    Args:
+        results (dict) :
+            Benchmark results (name -> {"value": ...}) or a results file as written by AcquisitionBenchmark.py
+        costs (dict) : [optional]
+            Costs to update, DEFAULT_COSTS if not given
+
+    Returns:
+        dict : the costs
+    """
+    costs = dict(DEFAULT_COSTS if costs == None else costs)
+    results = results.get("results", results)
+
+    def value(name):
+        entry = results.get(name)
+        return None if entry == None else entry.get("value")
+
+    measured = {
+        "iv_point": (value("smu_make_measurement_points_per_s"), lambda points_per_s: 1 / points_per_s),
+        "tlp_pulse": (value("sweep_step_ms"), lambda milliseconds: milliseconds * 1E-3),
+        "vna_sweep": (value("vna_s_parameter_check_ms"), lambda milliseconds: milliseconds * 1E-3),
+    }
+    for name, (measured_value, convert) in measured.items():
+        if measured_value:
+            costs[name] = convert(measured_value)
+    # the benchmark times the relay command, contacts still need their settling time
+    relay_command = value("relay_path_switch_acked_us")
+    if relay_command:
+        costs["relay_path"] = DEFAULT_COSTS["relay_path"] + relay_command * 1E-6
+    return costs
+
+
+def load_costs(path):
+    """Reads operation costs from JSON, either a costs dict or AcquisitionBenchmark.py results"""
+    with open(path, "r") as file:
+        data = json.load(file)
+    if "results" in data:
+        return costs_from_benchmark(data)
+    costs = dict(DEFAULT_COSTS)
+    costs.update(data)
+    return costs
+
+
+def compare_plans(plan, base_parameters=None, costs=None):
+    """
+    Estimates a plan run naively (plan order, everything reconfigured every step), in plan order skipping unchanged
+    settings, and compiled
+
+    Returns:
+        dict : "naive", "plan_order" and "compiled" estimates (see estimate_runtime()) and the compiled "steps"
+    """
+    steps = expand_plan(plan, base_parameters)
+    compiled = compile_plan(steps, costs)
+    return {
+        "naive": estimate_runtime(steps, costs, skip_unchanged=False),
+        "plan_order": estimate_runtime(steps, costs),
+        "compiled": estimate_runtime(compiled, costs),
+        "steps": compiled,
+    }
+
+
+def format_comparison(comparison, name="Test plan"):
+    """
+    Returns:
+        str : the estimates of compare_plans() as text
+    """
+    lines = [f"{name}: {comparison['compiled']['steps']} steps"]
+    for label in ("naive", "plan_order", "compiled"):
+        estimate = comparison[label]
+        changes = ", ".join(f"{dimension} {count}" for dimension, count in estimate["changes"].items() if count)
+        lines.append(f"  {label:<11} {estimate['total']:9.1f} s  (measurement {estimate['measurement']:.1f} s, "
+                     f"reconfiguration {estimate['reconfiguration']:.1f} s: {changes})")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile a test plan and estimate its runtime")
+    parser.add_argument("plan", help="JSON test plan")
+    parser.add_argument("--costs", default=None, help="JSON operation costs or AcquisitionBenchmark.py results")
+    parser.add_argument("--list", action="store_true", help="print the compiled step order")
+    parser.add_argument("--output", default=None, help="write the compiled steps as JSON")
+    args = parser.parse_args(argv)
+
+    plan = load_plan(args.plan)
+    costs = DEFAULT_COSTS if args.costs == None else load_costs(args.costs)
+    comparison = compare_plans(plan, costs=costs)
+    print(format_comparison(comparison, plan.get("name", args.plan)))
+    if args.list:
+        for position, step in enumerate(comparison["steps"]):
+            print(f"{position:5d}  {step.pin:<10} {step.measurement:<4} {step.level:8g} V")
+    if args.output != None:
+        with open(args.output, "w") as file:
+            json.dump([step.as_dict() for step in comparison["steps"]], file, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,12 @@ import pyvisa
 from enum import Enum
 import time
 import numpy as np
+from ScpiTrace import tracer, TracedVisaResource
+
+
+def is_serial_resource(resource_name):
+    """True for VISA serial port resources (ASRL), eg. 'ASRL3::INSTR'"""
+    return str(resource_name).upper().startswith("ASRL")
 
 
 def bytes_to_float32(four_bytes):
@@ -51,11 +57,54 @@ def bytes_to_float32(four_bytes):
         return sign*(2**exponent)*fraction
 
 
-def parse_raw_bytes_data(raw_data=None, path="./output.lmao", silent=False):
+# numpy dtypes of the binary block formats, byte order is little endian (FORMat:BORDer LSBFirst, pg. 1399)
+BLOCK_DTYPES = {
+    "REAL,32": np.dtype("<f4"),
+    "INT,8": np.dtype("i1"),
+    "INT,16": np.dtype("<i2"),
+}
+
+
+def parse_block_header(data):
+    """
+    Finds the payload of a IEEE 488.2 binary block: #<n><length><payload> or #(<length>)<payload>
+    The indefinite form #0<payload> is also accepted, its payload ends before the line terminator
+
+    Args:
+        data (bytes) :
+            The raw block as read from the device
+
+    Returns:
+        int, int : start index and length in bytes of the payload, -1, -1 if data is not a binary block
+    """
+    if len(data) < 2 or data[0] != ord('#'):
+        return -1, -1
+
+    if data[1] == ord('('):
+        # length given in parenthesis
+        paren_end = data.find(b')', 2)
+        if paren_end < 0:
+            return -1, -1
+        return paren_end + 1, int(data[2:paren_end])
+
+    length_length = int(chr(data[1]))
+    if length_length == 0:
+        # indefinite length, runs to the line terminator
+        end = len(data) - 1 if data[-1:] == b'\n' else len(data)
+        return 2, end - 2
+
+    start = 2 + length_length
+    data_length = int(data[2:start])
+    # never read past the received data if the transfer was cut short
+    return start, min(data_length, len(data) - start)
+
+
+def parse_raw_bytes_data(raw_data=None, path="./output.lmao", silent=False, data_format="REAL,32"):
     """
     Parses raw waveform data retrieved from the oscilloscope in the REAL,32 described on pg. 1399 of the R&S RTO6 UserManual 
     Adhering to 32-Bit IEEE 754 Floating Point Format 
     or from the RIGOL DSA800 series Spectrum Analyzer in Real
+    INT,8 and INT,16 blocks are decoded to their raw integer codes, see Oscilloscope.record_waveform_raw() for scaling
 
     Args:
         raw_data (bytes) : [optional]
@@ -64,72 +113,47 @@ def parse_raw_bytes_data(raw_data=None, path="./output.lmao", silent=False):
             The save file containing the scope waveform data
         silent (boolean) : [optional] default=False
             Specifies if status remarks are made to the console, true no remarks are made
+        data_format (str) : [optional] default="REAL,32"
+            The block format the data was transferred in, one of BLOCK_DTYPES ("REAL,32", "INT,8", "INT,16")
 
     Returns:
-        numpy array : the decoded float values of the waveform points
+        numpy array : the decoded values of the waveform points (float32 for REAL,32, integer codes for INT formats)
 
     """
     data = None
-    if raw_data == None:
+    if raw_data is None:
         try:
             raw_file = open(path, "rb")
         except FileNotFoundError:
             print("Raw Data file not found")
             return -1
-        data = bytes(raw_file.read())
+        data = raw_file.read()
         raw_file.close()
+    elif isinstance(raw_data, (bytes, bytearray, memoryview)):
+        data = raw_data
     else:
         data = bytes(raw_data)
 
-    byte_index = 0
-    length_length = -1
-    data_length = -1
-    paren_end = -1
-    if data[byte_index] == ord('#'): # and len(data)>10:
-        # very start of byte string
-        # move past '#'
-        byte_index += 1
-        # check to see if there are parentsis
-        if data[byte_index] == ord('('):
-            paren_end = byte_index
-            parenthesis = True
-            while data[paren_end] != ord(')'):
-                paren_end += 1
-            length_length = int(str(data[byte_index+1:paren_end]))
-            byte_index = paren_end + 1
-        else:
-            # no parenthesis
-            length_length = int(chr(data[byte_index]))
-            byte_index += 1
-        
-
-        #data_length = int(str(data[byte_index:byte_index+length_length])[2:-1])
+    if data_format not in BLOCK_DTYPES:
+        print("Unsupported data format " + str(data_format))
+        return -1
+    dtype = BLOCK_DTYPES[data_format]
 
-        byte_index += length_length
-    else:
+    byte_index, data_length = parse_block_header(data)
+    if byte_index < 0:
         print("Data Receive failed")
         return -1
     
     if not silent:
             print("Data read successful")
-    
-    # Trim of head leaving only 4-byte float chunks
-    data = data[byte_index:-1]
         
-    samples = len(data)/4
-    samples = int(samples)
-
-    data_floats = []
+    samples = data_length // dtype.itemsize
 
     if not silent:
             print("Parsing data...")
 
-    for byte in range(samples):
-        #four_bytes = data[byte*4:(byte*4)+4]
-        data_floats.append(bytes_to_float32(data[byte*4:(byte*4)+4]))
-
-    # create numpy arrays for easy data manipulation
-    values = np.asarray(data_floats)
+    # decode the whole block in one vectorized pass, astype makes a native byte order (writable) copy
+    values = np.frombuffer(data, dtype=dtype, count=samples, offset=byte_index).astype(dtype.newbyteorder("="))
 
     return values
 
@@ -143,6 +167,9 @@ def save_raw_data_to_file(data, path=None):
             The raw data that will be saved to path
         path (str) : [optional]
             The save path location and file name *without extension*
+
+    Returns:
+        str : the path of the written file
     """
     if path != None:
         save_path = path + ".lmao"
@@ -151,6 +178,7 @@ def save_raw_data_to_file(data, path=None):
     output_file = open(save_path, "wb")
     output_file.write(data)
     output_file.close()
+    return save_path
 
 
 class VisaResource():
@@ -257,7 +285,31 @@ class VisaResource():
         return self.rm.list_resources()
         
 
-    def connect(self, device_index = -1, device_id=None):
+    def find_resource(self, identity, timeout=None):
+        """
+        Returns the name of the first VISA resource whose *IDN? response contains identity, None if there is none.
+        Serial (ASRL) resources are not probed, they are the SMU and relay controller ports, which may be opened by
+        their own drivers at the same time and would receive *IDN? in their byte streams
+        """
+        for resource_name in self.rm.list_resources():
+            if is_serial_resource(resource_name):
+                continue
+            try:
+                open_options = {} if timeout == None else {"open_timeout": int(timeout * 1000)}
+                resource = self.rm.open_resource(resource_name, **open_options)
+                if timeout != None:
+                    resource.timeout = int(timeout * 1000)
+                try:
+                    if identity in resource.query("*IDN?"):
+                        return resource_name
+                finally:
+                    resource.close()
+            except Exception:
+                continue
+        return None
+
+
+    def connect(self, device_index = -1, device_id=None, timeout=None):
         """
         Connects to a resource (oscilloscope/spectrum analyzer) by index in available resource list or by ID
         If not index or device ID is specified connection is made to first resource; device_index = 0 
@@ -267,10 +319,14 @@ class VisaResource():
                 The resource index from list of available resources that should be connected to
             device_id (str): [optional]
                 The resource ID that should be connected to
+            timeout (float) : [optional] [units seconds]
+                Timeout for opening the resource and the identification query, the VISA default if not given
 
         Returns:
             Bool : If connection fails returns false. If connection is successful returns true 
         """
+        # resource discovery is slow (it probes every interface), list once per connection attempt
+        resources = list(self.rm.list_resources())
 
         # check if no parameters are provided and default to first in list
         if device_index == -1 and device_id == None:
@@ -279,33 +335,39 @@ class VisaResource():
         # check to see if provided ID is valid if so set index
         elif device_id != None:
             try:
-                device_index = self.rm.list_resources().index(device_id)
+                device_index = resources.index(device_id)
             except ValueError:
                 print("Could not find specified ID from available resources")
                 device_index = 0
 
         # no provided ID, check to see if index is valid before trying to connect
-        if(len(self.rm.list_resources()) <= device_index):
+        if(len(resources) <= device_index):
             print("Invalid device index " + str(device_index))
             print("Please specify from this list")
-            for index in range(len(self.rm.list_resources())):
-                print(f"{index}: {self.rm.list_resources()[index]}")
+            for index in range(len(resources)):
+                print(f"{index}: {resources[index]}")
             return False
         
         # get device ID
-        device_id = self.rm.list_resources()[device_index]
+        device_id = resources[device_index]
 
         # connect to device
-        self.device = self.rm.open_resource(device_id)
+        open_options = {} if timeout == None else {"open_timeout": int(timeout * 1000)}
+        self.device = self.rm.open_resource(device_id, **open_options)
 
         if (self.device == None):
             print("Failed to connect to " + device_id)
             return False
+        if timeout != None:
+            self.device.timeout = int(timeout * 1000) # pyvisa timeouts are in ms
+
+        # commands are timed while ScpiTrace.tracer is enabled
+        self.device = TracedVisaResource(self.device, device_id)
 
-        time.sleep(0.1)
+        # no fixed settle delay, the identification query waits up to the timeout for the device to answer
         try:
             self.device_name = self.device.query("*IDN?") # pg. reference required here
-            print("Connected to oscilloscope: " + self.device_name)
+            print("Connected to: " + self.device_name)
 
         except:
             print("Failed to get response from " + device_id)
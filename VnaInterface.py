@@ -0,0 +1,312 @@
+from VisaResource import *
+
+
+def segment_frequencies(segments):
+    """
+    Stimulus frequencies of a segmented sweep, points are spaced linearly within each segment including both ends
+
+    Args:
+        segments (list of tuple) :
+            (start [Hz], stop [Hz], points, ...) per segment
+
+    Returns:
+        numpy array : the frequencies in Hz
+    """
+    return np.concatenate([np.linspace(segment[0], segment[1], int(segment[2])) for segment in segments])
+
+
+def magnitude_db(values):
+    """Magnitude of complex S-parameters in dB"""
+    return 20 * np.log10(np.maximum(np.abs(values), 1E-15))
+
+
+def compare_s_parameters(before, after):
+    """
+    Compares two S-parameter measurements of the same DUT (eg. before and after stress)
+
+    Args:
+        before (dict) :
+            S-parameter name -> complex numpy array, as returned by VNA.measure_s_parameters()
+        after (dict) :
+            The same S-parameters measured on the same sweep
+
+    Returns:
+        dict : S-parameter name -> largest magnitude change in dB over the sweep
+    """
+    return {name: float(np.max(np.abs(magnitude_db(after[name]) - magnitude_db(before[name]))))
+            for name in before if name in after}
+
+
+class VNA(VisaResource):
+    """
+    Class for connection to a vector network analyzer using VISA and SCPI commands
+    Commands are for the R&S®ZNB/ZNL Vector Network Analyzers | Rohde & Schwarz
+    Reference for this class is available here https://www.rohde-schwarz.com/manual/r-s-znb-znbt-user-manual-manuals-gb1_78701-29151.html
+
+    Child class of VisaResource
+
+    Traces are transferred as binary REAL,32 blocks of interleaved real and imaginary parts and decoded with
+    parse_raw_bytes_data() straight into complex numpy arrays. Sweep and trace setups are only sent when they change and
+    calibration data is only read again when the active calibration changed.
+
+    Attributes:
+        frequencies : numpy array [units Hz]
+            Stimulus frequencies of the configured sweep, computed on the host
+        sweep_setup : tuple
+            The sweep configuration last sent, setup commands are skipped if it is unchanged
+        traces : dict
+            S-parameter name -> trace name defined on the analyzer
+        calibration : dict
+            (error term, port 1, port 2) -> complex numpy array of the cached calibration data
+        calibration_signature : str
+            Date and state of the calibration the cache was read for
+    """
+
+    # substring of the *IDN? response of supported analyzers, used to find the VNA among the VISA resources
+    IDENTITY = "ZN"
+
+    def __init__(self, pyvisa_resource_manager=None, channel=1):
+        super().__init__(pyvisa_resource_manager)
+        self.channel = channel
+        self.frequencies = np.empty(0)
+        self.sweep_setup = None
+        self.traces = {}
+        self.calibration = {}
+        self.calibration_signature = None
+        self.binary_format = False
+
+
+    def connect(self, device_index = -1, device_id=None, timeout=None):
+        """
+        Connects like VisaResource.connect(), if neither index nor ID is given the first resource identifying as a
+        supported analyzer (IDENTITY) is used
+        """
+        # connecting presets the analyzer, nothing configured before is still set up
+        self.sweep_setup = None
+        self.traces = {}
+        self.binary_format = False
+        self.calibration = {}
+        self.calibration_signature = None
+        if device_index == -1 and device_id == None:
+            device_id = self.find_resource(VNA.IDENTITY, timeout)
+            if device_id == None:
+                print("No network analyzer found")
+                return False
+        if not super().connect(device_index, device_id, timeout):
+            return False
+        self.device.write(f"INIT{self.channel}:CONT OFF") # single sweeps, started by sweep() (pg. reference required here)
+        return True
+
+
+    def set_binary_format(self):
+        """Selects little endian REAL,32 blocks for all data transfers, once per connection"""
+        if self.binary_format:
+            return
+        self.device.write("FORM REAL,32") # (pg. reference required here)
+        self.device.write("FORM:BORD SWAP") # little endian, as parse_raw_bytes_data() expects
+        self.binary_format = True
+
+
+    def configure_linear_sweep(self, start, stop, points, bandwidth=1000):
+        """
+        Sets a linear frequency sweep, nothing is sent if it is already configured
+
+        Args:
+            start (float) : [units Hz]
+                Start frequency
+            stop (float) : [units Hz]
+                Stop frequency
+            points (int) :
+                Number of sweep points
+            bandwidth (float) : [optional] default=1000 [units Hz]
+                IF bandwidth
+        """
+        setup = ("LIN", float(start), float(stop), int(points), float(bandwidth))
+        if self.device == None:
+            print("VNA Not Connected")
+            return
+        if setup == self.sweep_setup:
+            return
+        self.device.write(f"SENS{self.channel}:SWE:TYPE LIN")
+        self.device.write(f"SENS{self.channel}:FREQ:STAR {start}")
+        self.device.write(f"SENS{self.channel}:FREQ:STOP {stop}")
+        self.device.write(f"SENS{self.channel}:SWE:POIN {int(points)}")
+        self.device.write(f"SENS{self.channel}:BAND {bandwidth}")
+        self.sweep_setup = setup
+        self.frequencies = np.linspace(start, stop, int(points))
+
+
+    def configure_segments(self, segments, power=-10):
+        """
+        Sets a segmented sweep: dense points where the DUT response changes, sparse elsewhere, so a full check needs
+        fewer points than a linear sweep of the same resolution. Nothing is sent if it is already configured
+
+        Args:
+            segments (list of tuple) :
+                (start [Hz], stop [Hz], points, IF bandwidth [Hz]) per segment, the bandwidth is optional (1 kHz)
+            power (float) : [optional] default=-10 [units dBm]
+                Source power of all segments
+        """
+        segments = [(float(segment[0]), float(segment[1]), int(segment[2]), float(segment[3]) if len(segment) > 3 else 1000.0)
+                    for segment in segments]
+        setup = ("SEGM", tuple(segments), float(power))
+        if self.device == None:
+            print("VNA Not Connected")
+            return
+        if setup == self.sweep_setup:
+            return
+        self.device.write(f"SENS{self.channel}:SEGM:DEL:ALL")
+        for index, (start, stop, points, bandwidth) in enumerate(segments, start=1):
+            # start, stop, points, power, segment time (0 = automatic), unused, IF bandwidth
+            self.device.write(f"SENS{self.channel}:SEGM{index}:DEF {start},{stop},{points},{power},0,0,{bandwidth}")
+        self.device.write(f"SENS{self.channel}:SWE:TYPE SEGM")
+        self.sweep_setup = setup
+        self.frequencies = segment_frequencies(segments)
+
+
+    def configure_traces(self, parameters=("S11", "S21", "S12", "S22")):
+        """
+        Defines one trace per S-parameter, nothing is sent if these traces are already defined
+
+        Args:
+            parameters (tuple of str) : [optional]
+                The S-parameters, eg. ("S11", "S21")
+        """
+        if self.device == None:
+            print("VNA Not Connected")
+            return
+        if tuple(self.traces) == tuple(parameters):
+            return
+        self.device.write(f"CALC{self.channel}:PAR:DEL:ALL")
+        self.traces = {}
+        for parameter in parameters:
+            trace = "Trc_" + parameter
+            self.device.write(f"CALC{self.channel}:PAR:SDEF '{trace}','{parameter}'")
+            self.traces[parameter] = trace
+
+
+    def sweep(self, timeout=30):
+        """
+        Runs one sweep and waits for it to complete
+
+        Args:
+            timeout (float) : [optional] default=30 [units seconds]
+                Longest time the sweep may take
+
+        Returns:
+            boolean : true if the sweep completed
+        """
+        if self.device == None:
+            print("VNA Not Connected")
+            return False
+        previous_timeout = self.device.timeout
+        self.device.timeout = int(timeout * 1000)
+        try:
+            self.device.write(f"INIT{self.channel}:IMM")
+            # *OPC? answers once the sweep is complete, one round trip instead of polling
+            return self.device.query("*OPC?").strip() == "1"
+        except Exception:
+            print("VNA sweep did not complete within " + str(timeout) + " s")
+            return False
+        finally:
+            self.device.timeout = previous_timeout
+
+
+    def read_block(self, command):
+        """Sends a data query and decodes the REAL,32 block answer into a complex numpy array, None on failure"""
+        self.set_binary_format()
+        self.device.write(command)
+        data = self.device.read_raw()
+        with tracer.span("host", "parse_raw_bytes_data"):
+            values = parse_raw_bytes_data(data, silent=True, data_format="REAL,32")
+        if isinstance(values, int) or len(values) % 2 != 0:
+            print("VNA data parsing failed for " + command)
+            return None
+        # interleaved real, imaginary float32 pairs are a complex64 array, no copy
+        return values.view(np.complex64)
+
+
+    def read_trace(self, parameter):
+        """
+        Reads the complex data of one S-parameter of the last sweep
+
+        Returns:
+            numpy array : complex64 values per sweep point, None on failure
+        """
+        if self.device == None:
+            print("VNA Not Connected")
+            return None
+        if parameter not in self.traces:
+            self.configure_traces(tuple(self.traces) + (parameter,))
+        self.device.write(f"CALC{self.channel}:PAR:SEL '{self.traces[parameter]}'")
+        return self.read_block(f"CALC{self.channel}:DATA? SDAT")
+
+
+    def measure_s_parameters(self, parameters=("S11", "S21", "S12", "S22"), timeout=30):
+        """
+        Sweeps once and reads all requested S-parameters, the pre/post stress check
+
+        Args:
+            parameters (tuple of str) : [optional]
+                The S-parameters to measure
+            timeout (float) : [optional] default=30 [units seconds]
+                Longest time the sweep may take
+
+        Returns:
+            numpy array, dict : frequencies [Hz], S-parameter name -> complex numpy array. None, None on failure
+        """
+        if self.device == None:
+            print("VNA Not Connected")
+            return None, None
+        self.configure_traces(parameters)
+        if not self.sweep(timeout):
+            return None, None
+        results = {}
+        for parameter in parameters:
+            values = self.read_trace(parameter)
+            if values is None:
+                return None, None
+            results[parameter] = values
+        return self.frequencies, results
+
+
+    def read_calibration_signature(self):
+        """
+        Returns a string identifying the active calibration: its date, whether correction is on and the sweep it is
+        read on (the analyzer interpolates the error terms to the sweep points)
+        """
+        date = self.device.query(f"SENS{self.channel}:CORR:DATE?").strip()
+        state = self.device.query(f"SENS{self.channel}:CORR:STAT?").strip()
+        return date + "|" + state + "|" + str(self.sweep_setup)
+
+
+    def read_calibration(self, terms=(("DIRECTIVITY", 1, 0), ("SRCMATCH", 1, 0), ("REFLTRACK", 1, 0)), refresh=False):
+        """
+        Reads calibration error terms. The terms are cached, while the calibration signature (one short query) is
+        unchanged the cached data is returned without transferring it again
+
+        Args:
+            terms (tuple) : [optional]
+                (error term, port 1, port 2) per term, eg. ("DIRECTIVITY", 1, 0) or ("TRANSTRACK", 1, 2)
+            refresh (boolean) : [optional] default=False
+                Reads the terms even if the calibration did not change
+
+        Returns:
+            dict : (error term, port 1, port 2) -> complex numpy array, None if not connected or a read failed
+        """
+        if self.device == None:
+            print("VNA Not Connected")
+            return None
+        signature = self.read_calibration_signature()
+        if refresh or signature != self.calibration_signature:
+            self.calibration = {}
+            self.calibration_signature = signature
+        for term in terms:
+            if term in self.calibration:
+                continue
+            name, port_1, port_2 = term
+            values = self.read_block(f"SENS{self.channel}:CORR:CDAT? '{name}',{port_1},{port_2}")
+            if values is None:
+                return None
+            self.calibration[term] = values
+        return {term: self.calibration[term] for term in terms}
@@ -0,0 +1,139 @@
+"""
+Averaging of repeated captures of the same pulse with a fixed memory footprint.
+
+Each capture is folded into running per-sample mean and variance arrays (Welford's algorithm), so averaging any number
+of captures holds two float64 arrays of the record length instead of every capture. The standard error of the mean
+gives per-sample confidence bands, and converged() tells when the band is narrow enough to stop capturing.
+"""
+from statistics import NormalDist
+import numpy as np
+
+
+def z_score(confidence):
+    """Two sided standard normal quantile of a confidence level, eg. 1.96 for 0.95"""
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+class RunningAverage():
+    """
+    Running per-sample mean and variance of waveforms of equal length
+
+    Attributes:
+        count : int
+            Number of waveforms added
+        mean : numpy array
+            Per-sample mean (float64), None until the first waveform is added
+        m2 : numpy array
+            Per-sample sum of squared differences from the mean (Welford), variance = m2 / (count - 1)
+        start_time, stop_time : float [units seconds]
+            Time of the first and last sample of the first waveform added
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.start_time = 0.0
+        self.stop_time = 0.0
+        self._delta = None
+
+    def __len__(self):
+        return 0 if self.mean is None else len(self.mean)
+
+    @property
+    def nbytes(self):
+        """Memory held by the running statistics in bytes, independent of count"""
+        return 0 if self.mean is None else self.mean.nbytes + self.m2.nbytes + self._delta.nbytes
+
+    def add(self, voltages, start_time=None, stop_time=None):
+        """
+        Folds one waveform into the running statistics
+
+        Args:
+            voltages (numpy array) :
+                The samples of the waveform in volts, all waveforms must have the same length
+            start_time, stop_time (float) : [optional] [units seconds]
+                Time window of the waveform, kept from the first waveform added
+        """
+        voltages = np.asarray(voltages)
+        if self.mean is None:
+            self.mean = np.zeros(len(voltages))
+            self.m2 = np.zeros(len(voltages))
+            self._delta = np.empty(len(voltages))
+            if start_time != None:
+                self.start_time = start_time
+            if stop_time != None:
+                self.stop_time = stop_time
+        elif len(voltages) != len(self.mean):
+            raise ValueError(f"Waveform has {len(voltages)} samples, the average has {len(self.mean)}")
+        self.count += 1
+        # in place: delta = x - mean, mean += delta / n, m2 += delta * (x - mean)
+        np.subtract(voltages, self.mean, out=self._delta)
+        self.mean += self._delta / self.count
+        self.m2 += self._delta * (voltages - self.mean)
+
+    def add_waveform(self, waveform):
+        """Folds a ScaledWaveform into the running statistics"""
+        self.add(waveform.voltages, waveform.start_time, waveform.stop_time)
+
+    @property
+    def times(self):
+        """numpy array : the sample times in seconds"""
+        return np.linspace(self.start_time, self.stop_time, len(self))
+
+    def variance(self):
+        """Returns the per-sample sample variance, None until two waveforms were added"""
+        if self.count < 2:
+            return None
+        return self.m2 / (self.count - 1)
+
+    def standard_deviation(self):
+        """Returns the per-sample standard deviation of the captures, None until two waveforms were added"""
+        variance = self.variance()
+        return None if variance is None else np.sqrt(variance)
+
+    def standard_error(self):
+        """Returns the per-sample standard error of the mean, None until two waveforms were added"""
+        variance = self.variance()
+        return None if variance is None else np.sqrt(variance / self.count)
+
+    def confidence_band(self, confidence=0.95):
+        """
+        Per-sample confidence band of the mean (normal approximation)
+
+        Args:
+            confidence (float) : [optional] default=0.95
+                Confidence level of the band
+
+        Returns:
+            numpy array, numpy array : lower and upper band in volts, None, None until two waveforms were added
+        """
+        error = self.standard_error()
+        if error is None:
+            return None, None
+        half_width = z_score(confidence) * error
+        return self.mean - half_width, self.mean + half_width
+
+    def band_half_width(self, confidence=0.95):
+        """Returns the widest half width of the confidence band over all samples in volts, inf until two waveforms were added"""
+        error = self.standard_error()
+        if error is None:
+            return np.inf
+        return float(z_score(confidence) * error.max())
+
+    def converged(self, tolerance, confidence=0.95, min_count=2):
+        """
+        Returns true when the mean of every sample is known to within tolerance volts at the given confidence
+
+        Args:
+            tolerance (float) : [units volts]
+                Largest acceptable half width of the confidence band
+            confidence (float) : [optional] default=0.95
+                Confidence level of the band
+            min_count (int) : [optional] default=2
+                Waveforms averaged at least, the variance estimate of very few captures is unreliable
+        """
+        return self.count >= max(min_count, 2) and self.band_half_width(confidence) <= tolerance
+
+    def reset(self):
+        self.__init__()
@@ -0,0 +1,128 @@
+from PySide6.QtCore import QObject, QTimer, Property, Signal, Slot, QByteArray
+from PySide6.QtQml import QmlElement
+
+# numpy and LiveWaveform are only needed once frames arrive, the buffer is attached by PeripheralController.load_drivers()
+
+QML_IMPORT_NAME = "WaveformProvider"
+QML_IMPORT_MAJOR_VERSION = 1
+
+
+@QmlElement
+class WaveformProvider(QObject):
+    """
+    Hands the live waveform of one scope channel to QML at a capped frame rate.
+
+    A timer on the GUI thread takes a frame from the LiveWaveformBuffer the oscilloscope publishes to, only if a new
+    waveform arrived, and emits frameChanged. QML reads the frame in bulk: samples() returns the interleaved float32
+    x, y points as a QByteArray (an ArrayBuffer in QML, read with new Float32Array()), updateSeries() replaces the points
+    of a QtCharts XY series from numpy arrays. No Python object is created per point.
+    """
+
+    frameChanged = Signal()
+    settingsChanged = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.live_view = None
+        self._channel = 1
+        self._max_fps = 30.0
+        self._buckets = 1000
+        self._frame = None
+        self._frame_count = 0
+        self._bytes = QByteArray()
+        self._range = (0.0, 0.0, 0.0, 0.0)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update_frame)
+        self.timer.start(int(1000 / self._max_fps))
+
+    def set_live_view(self, live_view):
+        """Sets the LiveWaveformBuffer frames are taken from, None stops updates"""
+        self.live_view = live_view
+        if live_view != None:
+            live_view.set_buckets(self._buckets)
+
+    @Slot()
+    def update_frame(self):
+        """Takes a frame if a new waveform arrived, called by the timer at most maxFps times a second"""
+        if self.live_view == None:
+            return
+        self.show_frame(self.live_view.take(self._channel))
+
+    def show_frame(self, frame):
+        if frame is None:
+            return
+        self._frame = frame
+        self._bytes = QByteArray(frame.tobytes())
+        self._range = (float(frame[0, 0]), float(frame[-1, 0]), float(frame[:, 1].min()), float(frame[:, 1].max()))
+        self._frame_count += 1
+        self.frameChanged.emit()
+
+    @Slot(result=QByteArray)
+    def samples(self):
+        """
+        Called by QML
+
+        Returns the points of the current frame as interleaved float32 x (seconds), y (volts) bytes
+        """
+        return self._bytes
+
+    @Slot(QObject)
+    def updateSeries(self, series):
+        """
+        Called by QML
+
+        Replaces the points of a QtCharts XY series (LineSeries) with the current frame in one call
+        """
+        if self._frame is None:
+            return
+        if not hasattr(series, "replaceNp"):
+            print("Series does not take numpy points, use samples() instead")
+            return
+        series.replaceNp(self._frame[:, 0], self._frame[:, 1])
+
+    def get_channel(self):
+        return self._channel
+
+    def set_channel(self, channel):
+        if channel != self._channel:
+            self._channel = int(channel)
+            self.settingsChanged.emit()
+            if self.live_view != None:
+                # the channel's latest waveform is shown right away, not with its next capture
+                self.show_frame(self.live_view.take(self._channel, force=True))
+
+    def get_max_fps(self):
+        return self._max_fps
+
+    def set_max_fps(self, max_fps):
+        self._max_fps = max(1.0, float(max_fps))
+        self.timer.setInterval(int(1000 / self._max_fps))
+        self.settingsChanged.emit()
+
+    def get_buckets(self):
+        return self._buckets
+
+    def set_buckets(self, buckets):
+        """Display columns, eg. the plot width in pixels, a frame has two points per column"""
+        buckets = max(1, int(buckets))
+        if buckets != self._buckets:
+            self._buckets = buckets
+            if self.live_view != None:
+                self.live_view.set_buckets(buckets)
+            self.settingsChanged.emit()
+
+    def get_frame_count(self):
+        return self._frame_count
+
+    def get_point_count(self):
+        return 0 if self._frame is None else len(self._frame)
+
+    channel = Property(int, get_channel, set_channel, notify=settingsChanged)
+    maxFps = Property(float, get_max_fps, set_max_fps, notify=settingsChanged)
+    buckets = Property(int, get_buckets, set_buckets, notify=settingsChanged)
+    frameCount = Property(int, get_frame_count, notify=frameChanged)
+    pointCount = Property(int, get_point_count, notify=frameChanged)
+    xMin = Property(float, lambda self: self._range[0], notify=frameChanged)
+    xMax = Property(float, lambda self: self._range[1], notify=frameChanged)
+    yMin = Property(float, lambda self: self._range[2], notify=frameChanged)
+    yMax = Property(float, lambda self: self._range[3], notify=frameChanged)
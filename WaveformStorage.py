@@ -0,0 +1,259 @@
+"""
+Compressed waveform storage (.lmaz) with independently decodable chunks.
+
+Samples are stored as integer codes with a gain and offset (volts = code * gain + offset). Each chunk of codes is
+delta encoded, byte shuffled (all low bytes, then all high bytes, ...) and compressed with a stdlib codec, so a time
+window is read by inflating only the chunks it overlaps.
+
+File layout:
+    b"LMAZ1\\n" | chunk 0 | chunk 1 | ... | JSON index | uint64 index length | b"LMAZIDX\\n"
+"""
+import bz2
+import json
+import lzma
+import os
+import struct
+import zlib
+import numpy as np
+
+
+MAGIC = b"LMAZ1\n"
+INDEX_MAGIC = b"LMAZIDX\n"
+EXTENSION = ".lmaz"
+
+CODECS = {
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    "bz2": (lambda data, level: bz2.compress(data, max(1, level)), bz2.decompress),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+
+def quantize_voltages(voltages, resolution=None):
+    """
+    Converts voltages to integer codes, volts = code * gain + offset
+
+    Args:
+        voltages (numpy array) :
+            The waveform samples in volts
+        resolution (float) : [optional] [units volts]
+            Volts per code, by default the sample range is spread over 16 bit codes. Use the scope's vertical
+            resolution (eg. scale / 6502.4 for a 16 bit ADC) so no information is lost
+
+    Returns:
+        numpy array, float, float : codes (int16, or int32 if the range needs it), gain, offset
+    """
+    low = float(np.min(voltages))
+    high = float(np.max(voltages))
+    offset = (low + high) / 2
+    if resolution == None:
+        resolution = (high - low) / 65000 if high > low else 1.0
+    codes = np.rint((voltages - offset) / resolution)
+    limit = max(abs(float(codes.min())), abs(float(codes.max())))
+    dtype = np.int16 if limit < 32767 else np.int32
+    return codes.astype(dtype), resolution, offset
+
+
+def encode_chunk(codes, codec="zlib", level=6):
+    """Delta encodes, byte shuffles and compresses one chunk of codes"""
+    deltas = np.empty_like(codes)
+    deltas[0] = codes[0]
+    # integer subtraction wraps around, the cumulative sum on decode wraps back
+    np.subtract(codes[1:], codes[:-1], out=deltas[1:])
+    shuffled = deltas.view(np.uint8).reshape(-1, codes.dtype.itemsize).T.tobytes()
+    return CODECS[codec][0](shuffled, level)
+
+
+def decode_chunk(data, dtype, count, codec="zlib"):
+    """Inverse of encode_chunk(), returns the codes of the chunk"""
+    dtype = np.dtype(dtype)
+    shuffled = np.frombuffer(CODECS[codec][1](data), dtype=np.uint8)
+    deltas = shuffled.reshape(dtype.itemsize, count).T.copy().view(dtype).reshape(count)
+    return np.cumsum(deltas, dtype=dtype)
+
+
+def save_compressed(path, codes, gain=1.0, offset=0.0, start_time=0.0, stop_time=0.0, chunk_samples=65536, codec="zlib", level=6):
+    """
+    Writes integer codes to a compressed waveform file
+
+    Args:
+        path (str) :
+            The save path location and file name *without extension*
+        codes (numpy array) :
+            Integer samples, see quantize_voltages() for voltages
+        gain (float) : [optional] [units volts/code]
+            Volts per code
+        offset (float) : [optional] [units volts]
+            Voltage of code 0
+        start_time (float) : [optional] [units seconds]
+            Time of the first sample
+        stop_time (float) : [optional] [units seconds]
+            Time of the last sample
+        chunk_samples (int) : [optional] default=65536
+            Samples per independently decodable chunk
+        codec (str) : [optional] default="zlib"
+            One of "zlib", "bz2", "lzma"
+        level (int) : [optional] default=6
+            Compression level of the codec
+
+    Returns:
+        str : the path of the written file
+    """
+    if codec not in CODECS:
+        raise ValueError("Unsupported codec " + str(codec) + ", must be one of " + str(tuple(CODECS)))
+    codes = np.ascontiguousarray(codes)
+    if codes.dtype.kind != "i":
+        raise ValueError("Codes must be integers, see quantize_voltages()")
+    dtype = codes.dtype.newbyteorder("<")
+    codes = codes.astype(dtype, copy=False)
+
+    save_path = path + EXTENSION
+    chunks = []
+    with open(save_path, "wb") as output_file:
+        output_file.write(MAGIC)
+        for first in range(0, len(codes), chunk_samples):
+            chunk = codes[first:first + chunk_samples]
+            data = encode_chunk(chunk, codec, level)
+            chunks.append([output_file.tell(), len(data), first, len(chunk)])
+            output_file.write(data)
+        index = json.dumps({
+            "dtype": dtype.str,
+            "gain": gain,
+            "offset": offset,
+            "samples": len(codes),
+            "start_time": start_time,
+            "stop_time": stop_time,
+            "codec": codec,
+            "chunks": chunks,
+        }).encode()
+        output_file.write(index)
+        output_file.write(struct.pack("<Q", len(index)))
+        output_file.write(INDEX_MAGIC)
+    return save_path
+
+
+def save_compressed_voltages(path, voltages, start_time=0.0, stop_time=0.0, resolution=None, **options):
+    """Quantizes voltages (see quantize_voltages()) and writes them with save_compressed(), returns the path written"""
+    codes, gain, offset = quantize_voltages(voltages, resolution)
+    return save_compressed(path, codes, gain, offset, start_time, stop_time, **options)
+
+
+class CompressedWaveformReader():
+    """
+    Reads compressed waveform files, only the chunks overlapping the requested range are decompressed
+
+    Attributes:
+        path : str
+            The file being read
+        samples : int
+            Number of samples in the file
+        gain, offset : float
+            volts = code * gain + offset
+        start_time, stop_time : float [units seconds]
+            Time of the first and last sample
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        if self.file.read(len(MAGIC)) != MAGIC:
+            self.file.close()
+            raise ValueError("Not a compressed waveform file: " + str(path))
+        self.file.seek(-(8 + len(INDEX_MAGIC)), os.SEEK_END)
+        index_length = struct.unpack("<Q", self.file.read(8))[0]
+        if self.file.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            self.file.close()
+            raise ValueError("Compressed waveform file is incomplete: " + str(path))
+        self.file.seek(-(8 + len(INDEX_MAGIC) + index_length), os.SEEK_END)
+        index = json.loads(self.file.read(index_length))
+
+        self.dtype = np.dtype(index["dtype"])
+        self.gain = index["gain"]
+        self.offset = index["offset"]
+        self.samples = index["samples"]
+        self.start_time = index["start_time"]
+        self.stop_time = index["stop_time"]
+        self.codec = index["codec"]
+        self.chunks = index["chunks"]
+        self.chunk_starts = np.array([chunk[2] for chunk in self.chunks], dtype=np.int64)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def read_codes(self, start=0, stop=None):
+        """
+        Reads the integer codes of samples start to stop (exclusive)
+
+        Returns:
+            numpy array : the codes
+        """
+        stop = self.samples if stop == None else min(stop, self.samples)
+        start = max(0, start)
+        if stop <= start:
+            return np.empty(0, dtype=self.dtype)
+        first_chunk = int(np.searchsorted(self.chunk_starts, start, side="right")) - 1
+        last_chunk = int(np.searchsorted(self.chunk_starts, stop - 1, side="right")) - 1
+        parts = []
+        for offset, nbytes, first, count in self.chunks[first_chunk:last_chunk + 1]:
+            self.file.seek(offset)
+            codes = decode_chunk(self.file.read(nbytes), self.dtype, count, self.codec)
+            parts.append(codes[max(start - first, 0):stop - first])
+        return np.concatenate(parts)
+
+    def read(self, start=0, stop=None):
+        """Reads samples start to stop (exclusive) in volts"""
+        return self.read_codes(start, stop).astype(np.float32) * np.float32(self.gain) + np.float32(self.offset)
+
+    def sample_index(self, sample_time):
+        """Index of the sample at or after a time"""
+        if self.samples < 2 or self.stop_time == self.start_time:
+            return 0
+        resolution = (self.stop_time - self.start_time) / (self.samples - 1)
+        return int(np.clip(np.ceil((sample_time - self.start_time) / resolution - 1E-9), 0, self.samples))
+
+    def read_time_window(self, window_start, window_stop):
+        """
+        Reads the samples between two times
+
+        Args:
+            window_start (float) : [units seconds]
+                Start of the window
+            window_stop (float) : [units seconds]
+                Stop of the window
+
+        Returns:
+            numpy array, numpy array : times, voltages of the samples in the window
+        """
+        start = self.sample_index(window_start)
+        stop = self.sample_index(window_stop)
+        if stop < self.samples and self.sample_time(stop) <= window_stop:
+            stop += 1
+        voltages = self.read(start, stop)
+        return self.sample_time(np.arange(start, start + len(voltages))), voltages
+
+    def sample_time(self, index):
+        if self.samples < 2:
+            return self.start_time + 0 * index
+        return self.start_time + index * (self.stop_time - self.start_time) / (self.samples - 1)
+
+
+def load_compressed(path):
+    """
+    Reads a whole compressed waveform file
+
+    Args:
+        path (str) :
+            The compressed waveform file
+
+    Returns:
+        numpy array, numpy array : times, voltages
+    """
+    with CompressedWaveformReader(path) as reader:
+        voltages = reader.read()
+        times = np.linspace(reader.start_time, reader.stop_time, reader.samples)
+    return times, voltages
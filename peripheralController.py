@@ -1,13 +1,11 @@
-from PySide6.QtCore import (QAbstractListModel, QEnum, Qt, QModelIndex, Slot, QByteArray)
+from PySide6.QtCore import (QAbstractListModel, QEnum, Qt, QModelIndex, QObject, Slot, QByteArray, QTimer)
 from PySide6.QtQml import QmlElement
 
-import pyvisa
-from VisaResource import VisaResource
-from OscilloscopeInterface import Oscilloscope
-from OssillaSmu import OscillaSMU
-import xtralien
-import serial
-from serial.tools import list_ports
+import threading
+import time
+import StartupTiming
+from CaptureWriter import CaptureWriter
+# pyvisa, xtralien, serial, numpy and the drivers are imported by load_drivers(), see PeripheralController.__init__
 
 QML_IMPORT_NAME = "PeripheralController"
 QML_IMPORT_MAJOR_VERSION = 1
@@ -18,16 +16,34 @@ class PeripheralController(QAbstractListModel):
         super().__init__(parent)
 
         # --DEVICES and helper variables--
-        # create global resource manager to use for all potential visa devices (many the VNA)
-        self.visa_resource_manager = pyvisa.ResourceManager()
-        self.oscilloscope = Oscilloscope(self.visa_resource_manager)
-
-        self.smu = OscillaSMU()
+        # the VISA resource manager and the drivers are created by load_drivers(), in the background once the event
+        # loop runs (after the window is shown) or on first use, whichever comes first
+        self._visa_resource_manager = None
+        self._oscilloscope = None
+        self._smu = None
+        self.capture_cache = None
+        self.drivers_lock = threading.Lock()
+        # captures recorded to file are written in the background, flushed on quit
+        self.capture_writer = CaptureWriter()
         self.com_ports = [] # a list of strings for active com ports eg. 'COM2'
-
-        self.vna = None
-
-        self.microcontroller = None
+        # watches the serial ports in the background and connects devices recognised by USB vid/pid, see load_drivers()
+        self.port_watcher = None
+        self.controller_port = None
+        # seconds each device may take to connect in connectAllDevices()
+        self.connect_timeouts = {"osc": 5.0, "smu": 5.0, "vna": 5.0, "powersupply": 5.0, "teensy": 2.0}
+        # steps of the last test plan compiled by compileTestPlan(), in run order
+        self.compiled_plan = []
+        # live plots (WaveformProvider) attached by QML, fed from live_view once the drivers are loaded
+        self.live_view = None
+        self.waveform_providers = []
+        # AcquisitionClient of the acquisition process, None while captures are taken in this process
+        self.acquisition = None
+        self.acquisition_timer = None
+        self.latest_capture = None
+
+        self._vna = None
+
+        self._microcontroller = None
 
         # this list should hold if devices are connected or not
         self.device_activity_dict = {
@@ -74,12 +90,110 @@ class PeripheralController(QAbstractListModel):
             "powersupply_charge_voltage": 2000,
             "tlp_rise_time": "1ns"
         }
+
+        QTimer.singleShot(0, self.load_drivers_in_background)
         # END CONSTRUCTOR
 
+    """----------------- Lazy Driver Loading ----------------"""
+    def load_drivers(self):
+        """
+        Imports the instrument stacks and creates the VISA resource manager and the drivers, once.
+        Blocks until loading finished if it is running on another thread.
+        """
+        with self.drivers_lock:
+            if self._oscilloscope != None:
+                return
+            start = time.perf_counter()
+            import pyvisa
+            from OscilloscopeInterface import Oscilloscope
+            from OssillaSmu import OscillaSMU
+            from TeensyController import TeensyController
+            from VnaInterface import VNA
+            from CaptureCache import CaptureCache
+            StartupTiming.mark("driver modules imported")
+
+            # create global resource manager to use for all potential visa devices (many the VNA)
+            self._visa_resource_manager = pyvisa.ResourceManager()
+            StartupTiming.mark("VISA resource manager created")
+            oscilloscope = Oscilloscope(self._visa_resource_manager)
+            oscilloscope.set_capture_writer(self.capture_writer)
+            # recent waveforms kept in memory for the GUI and online analysis, older ones spilled to memory mapped files
+            # (written on the capture writer thread)
+            self.capture_cache = CaptureCache(max_bytes=256E6, spill_directory="", writer=self.capture_writer)
+            oscilloscope.set_capture_cache(self.capture_cache)
+            # captures are handed to the live plots by reference, they decimate at their own frame rate
+            from LiveWaveform import LiveWaveformBuffer
+            self.live_view = LiveWaveformBuffer()
+            oscilloscope.set_live_view(self.live_view)
+            for provider in self.waveform_providers:
+                provider.set_live_view(self.live_view)
+            self._smu = OscillaSMU()
+            self._microcontroller = TeensyController()
+            self._vna = VNA(self._visa_resource_manager)
+            self._oscilloscope = oscilloscope
+            StartupTiming.mark("drivers created")
+
+            from PortWatcher import PortWatcher
+            self.port_watcher = PortWatcher(on_added=self.port_added, on_removed=self.port_removed)
+            self.port_watcher.start()
+            StartupTiming.mark("serial ports watched")
+            print(f"Instrument drivers loaded in {(time.perf_counter() - start) * 1E3:.0f} ms")
+
+    def load_drivers_in_background(self):
+        threading.Thread(target=self.load_drivers, name="DriverLoader", daemon=True).start()
+
+    def port_added(self, role, port):
+        """Called by the port watcher (on its thread) when a serial port appears, connects devices of known roles"""
+        if role == "smu" and not self._smu.check_connection(silent=True):
+            print("SMU detected on " + port.device + ", connecting")
+            self._smu.set_com_port(port.device)
+            self.device_activity_dict["smu"] = 1 if self._smu.connect() else 0
+        elif role == "teensy" and self._microcontroller.device == None:
+            print("Controller detected on " + port.device + ", connecting")
+            self.controller_port = port.device
+            self.device_activity_dict["teensy"] = 1 if self._microcontroller.connect(port.device) else 0
+
+    def port_removed(self, role, port):
+        """Called by the port watcher (on its thread) when a serial port disappears"""
+        if role == "smu" and self._smu.com_port == port.device:
+            self._smu.connection_lost()
+            self.device_activity_dict["smu"] = 0
+        elif role == "teensy" and self.controller_port == port.device:
+            print("Controller on " + port.device + " lost")
+            self._microcontroller.close()
+            self.controller_port = None
+            self.device_activity_dict["teensy"] = 0
+
+    @property
+    def visa_resource_manager(self):
+        self.load_drivers()
+        return self._visa_resource_manager
+
+    @property
+    def oscilloscope(self):
+        self.load_drivers()
+        return self._oscilloscope
+
+    @property
+    def smu(self):
+        self.load_drivers()
+        return self._smu
+
+    @property
+    def vna(self):
+        self.load_drivers()
+        return self._vna
+
+    @property
+    def microcontroller(self):
+        self.load_drivers()
+        return self._microcontroller
+
     """----------------- General Application Functions ----------------"""
     def peripheral_controller_quit(self):
         """
         Cleans up when closing the peripheral controller and/or ending the program.
+        Connected to QApplication.aboutToQuit by Main.py, queued captures are written before the program exits.
 
         Args:
             None
@@ -88,14 +202,22 @@ class PeripheralController(QAbstractListModel):
             None
 
     """
-        if self.oscilloscope != None:
-            self.oscilloscope.close()
-        if self.smu != None:
-            self.smu.close()
-        if self.vna != None:
-            self.vna.close()
-        if self.microcontroller != None:
-            self.microcontroller.close()
+        if self.port_watcher != None:
+            self.port_watcher.stop()
+        self.stopAcquisitionProcess()
+        # drivers that were never loaded have nothing to close
+        if self._oscilloscope != None:
+            self._oscilloscope.close()
+        if self._smu != None:
+            self._smu.close()
+        if self._vna != None:
+            self._vna.close()
+        if self._microcontroller != None:
+            self._microcontroller.close()
+        if self.capture_writer != None:
+            self.capture_writer.close()
+        if self.capture_cache != None:
+            self.capture_cache.clear()
 
 
     """----------------- Parameter Updating Signal Receivers -------------"""
@@ -248,21 +370,27 @@ class PeripheralController(QAbstractListModel):
     """
     Following functions ONLY called by Main.qml to respond to refresh events to update reNlayText
     """
+    def relay_text(self, relay):
+        # the last state acknowledged by the controller, no serial traffic
+        if self._microcontroller == None or self._microcontroller.device == None:
+            return f"Relay {relay} (re{relay}lay)"
+        return f"Relay {relay}: " + ("Closed" if self._microcontroller.relay_states[relay] else "Open")
+
     @Slot(result=str)
     def mainGridMenu_getRe1layText(self):
-        return "Relay 1 (re1lay)"
+        return self.relay_text(1)
     
     @Slot(result=str)
     def mainGridMenu_getRe2layText(self):
-        return "Relay 2 (re2lay)"
+        return self.relay_text(2)
     
     @Slot(result=str)
     def mainGridMenu_getRe3layText(self):
-        return "Relay 3 (re3lay)"
+        return self.relay_text(3)
     
     @Slot(result=str)
     def mainGridMenu_getRe4layText(self):
-        return "Relay 4 (re4lay)"
+        return self.relay_text(4)
     
     @Slot(int)
     def mainGridMenu_getSmuPortNum(self, port_num_index):
@@ -288,11 +416,9 @@ class PeripheralController(QAbstractListModel):
         # early return if no com port devices are connected
         if len(self.com_ports)<=0:
             return
-        # TODO set_com_port hasn't been written yet
-        # self.controller.set_com_port(self.com_ports[port_num_index])
+        self.microcontroller.set_com_port(self.com_ports[port_num_index])
         print("Attempting connection to controller on COM port: " + str(port_num_index))
-        # TODO set_com_port hasn't been written yet
-        #self.controller.connect(com_port=1)
+        self.device_activity_dict["teensy"] = 1 if self.microcontroller.connect() else 0
 
 
     # ---------------- Main Grid Menu Buttons -----------------
@@ -303,19 +429,18 @@ class PeripheralController(QAbstractListModel):
         """
         print("Controller Refresh clicked")
 
-        # TODO VERY POORLY WRITTEN CODE necessary functions for microcontroller haven't been written yet
-        connect = False
-        if self.microcontroller == None:
-            # the microcontroller (teensy?) is not connected do connection procedure
-            connect = True
+        if not self.microcontroller.check_connection(silent=True):
+            #do connection procedure, on the port the watcher recognised the teensy on if there is one
+            if self.port_watcher != None and self.port_watcher.port_for("teensy") != None:
+                self.microcontroller.set_com_port(self.port_watcher.port_for("teensy"))
+            if self.microcontroller.connect():
+                self.device_activity_dict["teensy"] = 1
+                print("Attempted and succeeded to connect to Controller")
+            else:
+                self.device_activity_dict["teensy"] = 0
+                print("Attempted and failed to connect to Controller")
         else:
-            # the microcontroller is theoretically connected so check this 
-            connect = not self.microcontroller.check_connection(self, silent=True)
-
-        if connect:
-            #do connection procedure
-            #self.microcontroller.connect() hasn't been written yet
-            pass
+            self.device_activity_dict["teensy"] = 1
 
     @Slot()
     def mainGridMenu_smuRefresh(self):
@@ -347,7 +472,26 @@ class PeripheralController(QAbstractListModel):
         Attempts connection to VNA
         """
         print("VNA Refresh clicked")
-        print("MORE CODE MUST BE WRITTEN HERE TO IMPLEMENT THIS FEATURE")
+
+        if not self.vna.check_connection(silent=True):
+            #do connection procedure, the vna is found among the visa resources by its identification
+            if self.vna.connect(timeout=self.connect_timeouts["vna"]):
+                self.device_activity_dict["vna"] = 1
+                print("Attempted and succeeded to connect to VNA")
+            else:
+                self.device_activity_dict["vna"] = 0
+                print("Attempted and failed to connect to VNA")
+                return
+        else:
+            self.device_activity_dict["vna"] = 1
+        self.configure_vna_sweep()
+
+    def configure_vna_sweep(self):
+        """Sets the VNA sweep from vna_freq_min/max/resolution of the parameter dictionary"""
+        start = self.parameter_dictionary["vna_freq_min"]
+        stop = self.parameter_dictionary["vna_freq_max"]
+        points = int(round((stop - start) / self.parameter_dictionary["vna_freq_resolution"])) + 1
+        self.vna.configure_linear_sweep(start, stop, max(points, 2))
 
     @Slot()
     def mainGridMenu_oscRefresh(self):
@@ -371,6 +515,161 @@ class PeripheralController(QAbstractListModel):
             self.device_activity_dict["osc"] = 1
 
     
+    @Slot(result=str)
+    def connectAllDevices(self):
+        """
+        Slot for QML, no control calls it yet
+
+        Connects every device with a driver in parallel, each with its own timeout (see ConnectAll.py), updates
+        device_activity_dict and returns the report of outcomes and timings
+        """
+        from ConnectAll import connect_all, format_report
+
+        def connect_smu():
+            port = self.port_watcher.port_for("smu") if self.port_watcher != None else None
+            if port != None:
+                self.smu.set_com_port(port)
+            return self.smu.check_connection(silent=True) or self.smu.connect()
+
+        def connect_controller():
+            port = self.port_watcher.port_for("teensy") if self.port_watcher != None else None
+            if port != None:
+                self.microcontroller.set_com_port(port)
+            return self.microcontroller.check_connection(silent=True) or self.microcontroller.connect()
+
+        def connect_vna():
+            return self.vna.check_connection(silent=True) or self.vna.connect(timeout=self.connect_timeouts["vna"])
+
+        def connect_oscilloscope():
+            # connect() finds the scope by its *IDN? (Oscilloscope.IDENTITY) instead of opening the first resource
+            return self.oscilloscope.check_connection(silent=True) or self.oscilloscope.connect(timeout=self.connect_timeouts["osc"])
+
+        connectors = {
+            "osc": connect_oscilloscope,
+            "smu": connect_smu,
+            "vna": connect_vna,
+            "powersupply": None,
+            "teensy": connect_controller,
+        }
+        # load the drivers first so loading is not counted against any device's timeout
+        self.load_drivers()
+        def late_connection(result):
+            # a device that timed out may still connect, the report above showed it as timed out
+            self.device_activity_dict[result.name] = 1 if result.connected else 0
+            print(f"{result.name} {result.status()} after {result.elapsed * 1E3:.1f} ms (timed out before)")
+
+        results = connect_all(connectors, self.connect_timeouts, on_late=late_connection)
+        for name, result in results.items():
+            self.device_activity_dict[name] = 1 if result.connected else 0
+        report = format_report(results)
+        print(report)
+        return report
+
+
+    @Slot(QObject)
+    def attachWaveformProvider(self, provider):
+        """
+        Called by QML
+
+        Feeds a WaveformProvider (live plot) with the captured waveforms, see LiveWaveform.py
+        """
+        self.waveform_providers.append(provider)
+        if self.live_view != None:
+            provider.set_live_view(self.live_view)
+
+
+    @Slot(bool, result=bool)
+    def startAcquisitionProcess(self, simulated=False):
+        """
+        Slot for QML, no control calls it yet
+
+        Moves oscilloscope capture and analysis into a separate process (see AcquisitionProcess.py), so decoding and
+        analysis no longer compete with the GUI. Captures arrive through shared memory and are shown in the live plots,
+        the latest one is kept in latest_capture. The oscilloscope connection of this process is closed, the worker
+        connects the first resource identifying as an oscilloscope (Oscilloscope.IDENTITY) or the simulated one
+
+        Returns:
+            boolean : true if the acquisition process is running
+        """
+        if self.acquisition != None:
+            return True
+        from AcquisitionProcess import AcquisitionClient
+        self.load_drivers()
+        # only one process can hold the VISA session
+        self._oscilloscope.close()
+        if simulated:
+            station = {"simulated": True, "smu": None}
+        else:
+            # the worker connects by resource name, an unknown name would fall back to the first resource and preset it
+            resource_name = self._oscilloscope.find_resource(self._oscilloscope.IDENTITY)
+            if resource_name == None:
+                print("Acquisition process could not be started: no oscilloscope found")
+                self.device_activity_dict["osc"] = 0
+                return False
+            station = {"oscilloscope": resource_name}
+        try:
+            acquisition = AcquisitionClient(station)
+        except (OSError, ValueError) as error:
+            print("Acquisition process could not be started: " + str(error))
+            return False
+        if not acquisition.start():
+            acquisition.close()
+            return False
+        self.acquisition = acquisition
+        self.device_activity_dict["osc"] = 1
+        # captures are mapped, not copied, into the live plots at most 30 times a second
+        self.acquisition_timer = QTimer(self)
+        self.acquisition_timer.timeout.connect(self.poll_acquisition)
+        self.acquisition_timer.start(33)
+        return True
+
+
+    def poll_acquisition(self):
+        for capture in self.acquisition.poll():
+            self.latest_capture = capture
+            if self.live_view != None:
+                self.live_view.publish(capture.channel, capture)
+
+
+    @Slot()
+    def stopAcquisitionProcess(self):
+        """
+        Slot for QML, no control calls it yet, also called on quit
+
+        Ends the acquisition process, captures are taken in this process again after the oscilloscope reconnects
+        """
+        if self.acquisition == None:
+            return
+        self.acquisition_timer.stop()
+        self.acquisition_timer = None
+        # the live plots must not read the freed shared memory
+        if self.live_view != None:
+            self.live_view.clear()
+        self.latest_capture = None
+        self.acquisition.close()
+        self.acquisition = None
+        self.device_activity_dict["osc"] = 0
+
+
+    @Slot(str, result=str)
+    def compileTestPlan(self, plan_path):
+        """
+        Compiles a JSON test plan on top of the saved parameters (parameter_dictionary) and returns the naive and
+        compiled runtime estimates, see TestPlan.py. The compiled steps are kept in compiled_plan
+        """
+        from TestPlan import load_plan, compare_plans, format_comparison
+        try:
+            plan = load_plan(plan_path)
+            comparison = compare_plans(plan, self.parameter_dictionary)
+        except (OSError, ValueError) as error:
+            print("Test plan could not be compiled: " + str(error))
+            return "Test plan could not be compiled: " + str(error)
+        self.compiled_plan = comparison["steps"]
+        report = format_comparison(comparison, plan.get("name", plan_path))
+        print(report)
+        return report
+
+
     # ------------------- Data Functions ----------------------
     @Slot()
     def refreshComPorts(self):
@@ -380,6 +679,12 @@ class PeripheralController(QAbstractListModel):
         Sets self.com_ports list to the currently connected com ports
         Please see: https://pyserial.readthedocs.io/en/latest/tools.html
         """
+        if self.port_watcher != None:
+            # enumerate now rather than waiting for the watcher, connects any device that was just plugged in
+            self.port_watcher.scan()
+            self.com_ports = self.port_watcher.port_names()
+            return
+        from serial.tools import list_ports
         com_port_objects = list_ports.comports()
         self.com_ports = []
         for com_port in com_port_objects:
@@ -390,10 +695,14 @@ class PeripheralController(QAbstractListModel):
         """
         Called by Main.qml
 
-        Returns the available com ports after refreshing the com_ports list
+        Returns the available com ports, the port watcher's cached list once it runs (no enumeration per call),
+        otherwise after refreshing the com_ports list
         Please see: https://pyserial.readthedocs.io/en/latest/tools.html
         """
-        self.refreshComPorts()
+        if self.port_watcher != None:
+            self.com_ports = self.port_watcher.port_names()
+        else:
+            self.refreshComPorts()
         return self.com_ports
     
     
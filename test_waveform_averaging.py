@@ -0,0 +1,45 @@
+import numpy as np
+
+from OscilloscopeInterface import Oscilloscope
+from SimulatedInstruments import SimulatedResourceManager
+
+
+def connect_simulated_scope(record_length=10000):
+    scope = Oscilloscope(SimulatedResourceManager(record_length=record_length, acquisition_time=1E-6, seed=0))
+    scope.connect()
+    scope.set_acquisition_time(1E-6)
+    scope.set_acquisition_record_length(record_length)
+    return scope
+
+
+def test_averaging_with_auto_export_window():
+    # the window set by the first capture must not shorten or shift the captures that follow
+    scope = connect_simulated_scope()
+    scope.set_auto_export_window(True, margin_fraction=0.25, minimum_margin=5E-9)
+    average = scope.record_averaged_waveform(5, silent=True)
+    scope.close()
+    assert average != None
+    assert average.count == 5
+    assert scope.auto_export_window == (0.25, 5E-9)
+    assert scope.export_window == None
+
+    # the same captures from an identically seeded scope, averaged by hand
+    reference = connect_simulated_scope()
+    captures = [reference.record_waveform_raw(silent=True).voltages.astype(np.float64) for _ in range(5)]
+    reference.close()
+    assert all(len(capture) == 10000 for capture in captures)
+    assert np.allclose(average.mean, np.mean(captures, axis=0), rtol=0, atol=1E-6)
+
+
+def test_averaging_restores_export_window():
+    scope = connect_simulated_scope()
+    scope.set_auto_export_window(True)
+    scope.record_waveform_raw(silent=True)
+    # the first capture moved the window to the pulse, averaging must hand it back unchanged
+    export_window = scope.export_window
+    assert export_window != None
+    average = scope.record_averaged_waveform(3, silent=True)
+    scope.close()
+    assert average.count == 3
+    assert scope.auto_export_window == (0.5, 2E-9)
+    assert scope.export_window == export_window